@@ -0,0 +1,111 @@
+import random
+import subprocess
+import sys
+import time
+import types
+from argparse import ArgumentParser
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from facpu import assembler
+
+MACRO_HEADER = [
+    "#define(ADDA, ADD $1 $1 $2)",
+    "#define(SUBA, SUB $1 $1 $2)",
+    "#define(PIXEL, GDS $1 $2 0 0 $3)",
+    "#define(BALL, R3)",
+]
+
+
+def generate_source(line_count: int, seed: int = 0) -> list[str]:
+    # Synthetic program mixing labels, nested macros and long DAT tables, as generated sprite and lookup tables are
+    rng = random.Random(seed)
+    lines = list(MACRO_HEADER)
+    label_count = 0
+
+    while len(lines) < line_count:
+        kind = rng.random()
+        if kind < 0.05:
+            lines.append(f"label_{label_count}:")
+            label_count += 1
+        elif kind < 0.35:
+            lines.append(f"  DAT {rng.randrange(1 << 31)} ; table entry")
+        elif kind < 0.55:
+            lines.append(f"  #PIXEL({rng.randrange(16)}, {rng.randrange(16)}, #col({rng.randrange(256)}, {rng.randrange(256)}, {rng.randrange(256)}))")
+        elif kind < 0.7:
+            lines.append(f"  #ADDA(#BALL, {rng.randrange(1024)})")
+        elif kind < 0.8 and label_count:
+            lines.append(f"  BEQ R{rng.randrange(16)} {rng.randrange(1024)} label_{rng.randrange(min(label_count, 40))}")
+        else:
+            lines.append(f"  ADD R{rng.randrange(16)} R{rng.randrange(16)} R{rng.randrange(16)}")
+
+    return [line + "\n" for line in lines]
+
+
+def load_module(revision: str, name: str) -> types.ModuleType:
+    source = subprocess.check_output(["git", "show", f"{revision}:facpu/{name}.py"], text=True, cwd=Path(__file__).resolve().parent)
+    module = types.ModuleType(f"facpu.{name}")
+    module.__package__ = "facpu"
+    exec(compile(source, f"facpu/{name}.py@{revision}", "exec"), module.__dict__)
+    return module
+
+
+def load_revision(revision: str) -> types.ModuleType:
+    # Import the assembler module as it was at an earlier git revision, to compare against.
+    # Its macros are loaded from the same revision, as the interface between them has changed over time.
+    current_macros = sys.modules["facpu.macros"]
+    sys.modules["facpu.macros"] = load_module(revision, "macros")
+    try:
+        return load_module(revision, "assembler")
+    finally:
+        sys.modules["facpu.macros"] = current_macros
+
+
+def reset_macros(module: types.ModuleType) -> None:
+    # Before each program had its own registry, `#define`s were kept on the class
+    macros = getattr(module.UserMacroRegistry, "macros", None)
+    if isinstance(macros, dict):
+        macros.clear()
+
+
+def time_assembler(module: types.ModuleType, lines: list[str], repeat: int) -> dict[str, float]:
+    # Best of several runs, so other load on the machine affects both assemblers less
+    best = {"preprocess": float("inf"), "assemble_line": float("inf")}
+
+    for _ in range(repeat):
+        reset_macros(module)
+
+        start = time.perf_counter()
+        processed_lines, labels = module.preprocess(lines)
+        preprocessed = time.perf_counter()
+        for line in processed_lines:
+            module.assemble_line(line, labels)
+        assembled = time.perf_counter()
+
+        best = {"preprocess": min(best["preprocess"], preprocessed - start), "assemble_line": min(best["assemble_line"], assembled - preprocessed)}
+
+    return best
+
+
+def main():
+    parser = ArgumentParser(description="Assembler throughput on a large synthetic source")
+    parser.add_argument("--lines", type=int, default=100_000)
+    parser.add_argument("--compare", type=str, help="Git revision of the assembler to compare against")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    lines = generate_source(args.lines)
+    results = {"current": time_assembler(assembler, lines, args.repeat)}
+    if args.compare:
+        results[args.compare] = time_assembler(load_revision(args.compare), lines, args.repeat)
+
+    print(f"{len(lines):,} lines")
+    print(f"{'assembler':<16}{'preprocess':>14}{'assemble_line':>16}{'lines/s':>14}")
+    for name, timings in results.items():
+        total = sum(timings.values())
+        print(f"{name:<16}{timings['preprocess']:>13.3f}s{timings['assemble_line']:>15.3f}s{len(lines) / total:>14,.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from facpu.assembler import assemble
+from facpu.factorio import generate_draftsman_blueprint, generate_flasher_blueprint
+
+DEMOS_DIR = Path(__file__).resolve().parent.parent / "demos"
+# Largest program the address space can hold, with words covering the full 31 bit range
+LARGE_PROGRAM = [(i * 2654435761) & 0x7FFFFFFF for i in range(1024)]
+
+
+def timed(generate, machine_code: list[int], label: str) -> tuple[float, str]:
+    start = time.perf_counter()
+    blueprint = generate(machine_code, label=label)
+    return time.perf_counter() - start, blueprint
+
+
+def main():
+    programs = [(fpu_file.name, assemble(fpu_file)) for fpu_file in sorted(DEMOS_DIR.glob("*.fpu"))]
+    programs += [("empty", []), ("unlabelled", [1, 2, 3]), ("1024 words", LARGE_PROGRAM)]
+
+    print(f"{'program':<24}{'draftsman':>12}{'direct':>12}{'speedup':>10}")
+    for name, machine_code in programs:
+        label = None if name == "unlabelled" else name
+        draftsman_time, draftsman_blueprint = timed(generate_draftsman_blueprint, machine_code, label)
+        direct_time, direct_blueprint = timed(generate_flasher_blueprint, machine_code, label)
+
+        # The direct encoder must write exactly what draftsman does, tests/test_factorio.py checks this too
+        if direct_blueprint != draftsman_blueprint:
+            raise SystemExit(f"{name}: blueprint strings differ")
+
+        print(f"{name:<24}{draftsman_time * 1000:>10.1f}ms{direct_time * 1000:>10.1f}ms{draftsman_time / direct_time:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
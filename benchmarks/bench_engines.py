@@ -0,0 +1,79 @@
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from facpu.assembler import assemble
+from facpu.block_engine import BlockEmulator
+from facpu.emulator import Emulator
+
+DEMOS_DIR = Path(__file__).resolve().parent.parent / "demos"
+CYCLES = 2_000_000
+# Arrow keys, fed to the keyboard queue every time a program restarts
+KEYS = [129, 129, 128, 130, 131, 128]
+# Cycles between the states compared across the engines
+SNAPSHOT_INTERVAL = 100_000
+
+# The demos halt or wait on input within a few thousand cycles, so they mostly measure reset() and compiling.
+# This loop never halts, so it measures execution.
+TIGHT_LOOP = """
+loop:
+  ADD R1 R1 1
+  MUL R2 R1 3
+  XOR R3 R3 R2
+  AND R4 R3 1023
+  ST scratch R4
+  LD R5 scratch
+  BLT R1 1000 loop
+  LI R1 0
+  JMP loop
+scratch: DAT 0
+"""
+
+
+def state(emu: Emulator):
+    # Copied, as the emulator keeps changing these in place
+    return (emu.pc, emu.cycles, emu.halted, list(emu.registers), list(emu.memory), list(emu.call_stack), list(emu.keyboard), bytes(emu.display.front), bytes(emu.display.back))
+
+
+def run(engine: type[Emulator], machine_code: list[int], cycles: int) -> tuple[float, list]:
+    # Halted programs are reset until the cycle count is reached
+    states = []
+    remaining = cycles
+    start = time.perf_counter()
+    emu = engine(machine_code, keyboard=KEYS)
+    while remaining > 0:
+        if emu.halted:
+            emu.reset(keyboard=KEYS)
+        remaining -= emu.run(min(remaining, SNAPSHOT_INTERVAL))
+        states.append(state(emu))
+    return time.perf_counter() - start, states
+
+
+def programs() -> dict[str, list[int]]:
+    programs = {fpu_file.name: assemble(fpu_file) for fpu_file in sorted(DEMOS_DIR.glob("*.fpu"))}
+    with tempfile.TemporaryDirectory() as directory:
+        loop_file = Path(directory) / "tight_loop.fpu"
+        loop_file.write_text(TIGHT_LOOP)
+        programs["tight loop"] = assemble(loop_file)
+    return programs
+
+
+def main():
+    cycles = int(sys.argv[1]) if len(sys.argv) > 1 else CYCLES
+
+    print(f"{'program':<24}{'stepping ips':>16}{'block ips':>16}{'speedup':>10}")
+    for name, machine_code in programs().items():
+        step_time, step_states = run(Emulator, machine_code, cycles)
+        block_time, block_states = run(BlockEmulator, machine_code, cycles)
+
+        if step_states != block_states:
+            raise SystemExit(f"{name}: block engine does not match the stepping mode")
+
+        print(f"{name:<24}{cycles / step_time:>16,.0f}{cycles / block_time:>16,.0f}{step_time / block_time:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+from typing import Callable
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bench_assembler import generate_source
+
+from facpu import assembler
+from facpu.assembler import assemble, assemble_line, preprocess
+from facpu.emulator import Emulator, EmulatorError, decode
+from facpu.factorio import generate_flasher_blueprint
+from facpu.hardware_definition import DEFAULT_INSTRUCTION_TICKS, INSTRUCTION_TICKS
+
+DEMOS_DIR = Path(__file__).resolve().parent.parent / "demos"
+PHASES = ["preprocess", "macro_expansion", "assemble_line", "blueprint"]
+# Keys pressed in turn every KEY_INTERVAL instructions, so every run sees the same input (0 presses nothing)
+KEY_SCRIPT = [128, 128, 0, 129, 129, 129, 0, 130, 131, 0]
+KEY_INTERVAL = 200
+# Registers pong keeps the ball's row and the top of the player's paddle in
+PONG_BALL_Y = 1
+PONG_PADDLE = 4
+# Timings within this fraction of the baseline are not reported as regressions
+TOLERANCE = 0.1
+
+
+def nested_macro_source(line_count: int, depth: int) -> list[str]:
+    # Every instruction is built from macro calls nested `depth` deep
+    lines = ["#define(WRAP, $1)", "#define(ADDA, ADD $1 $1 $2)"]
+    for i in range(line_count):
+        register = f"R{i % 16}"
+        value = str(i % 1024)
+        for _ in range(depth):
+            register, value = f"#WRAP({register})", f"#WRAP({value})"
+        lines.append(f"  #ADDA({register}, {value})")
+    return [line + "\n" for line in lines]
+
+
+def label_source(line_count: int) -> list[str]:
+    # A label on every other line, each branching back to an earlier one within the address space
+    lines: list[str] = []
+    for i in range(line_count // 2):
+        lines.append(f"label_{i}:")
+        lines.append(f"  BNE R{i % 16} {i % 1024} label_{(i // 2) % 1024}")
+    return [line + "\n" for line in lines]
+
+
+def dat_source(line_count: int) -> list[str]:
+    # A lookup table, with words covering the full 31 bit range
+    lines = ["table:"] + [f"  DAT {(i * 2654435761) & 0x7FFFFFFF}" for i in range(line_count)]
+    return [line + "\n" for line in lines]
+
+
+def time_phases(lines: list[str], repeat: int) -> dict[str, float]:
+    # Best of several runs. Macro expansion happens inside preprocess, so it is timed on its own and taken out of it.
+    expand_macros = assembler.expand_macros
+    macro_time = 0.0
+    depth = 0
+
+    def timed_expand_macros(*args):
+        nonlocal macro_time, depth
+        depth += 1
+        start = time.perf_counter()
+        try:
+            return expand_macros(*args)
+        finally:
+            depth -= 1
+            if depth == 0:
+                macro_time += time.perf_counter() - start
+
+    best = dict.fromkeys(PHASES, float("inf"))
+    assembler.expand_macros = timed_expand_macros
+    try:
+        for _ in range(repeat):
+            macro_time = 0.0
+            start = time.perf_counter()
+            processed_lines, labels = preprocess(lines)
+            preprocessed = time.perf_counter()
+            machine_code = [assemble_line(line, labels) for line in processed_lines]
+            assembled = time.perf_counter()
+            generate_flasher_blueprint(machine_code, label="benchmark")
+            encoded = time.perf_counter()
+
+            timings = {"preprocess": preprocessed - start - macro_time, "macro_expansion": macro_time, "assemble_line": assembled - preprocessed, "blueprint": encoded - assembled}
+            best = {phase: min(best[phase], timings[phase]) for phase in PHASES}
+    finally:
+        assembler.expand_macros = expand_macros
+
+    return best
+
+
+def benchmark_assembler(line_count: int, depth: int, repeat: int) -> dict[str, dict]:
+    workloads = {
+        "mixed": generate_source(line_count),
+        "nested_macros": nested_macro_source(line_count, depth),
+        "labels": label_source(line_count),
+        "dat_table": dat_source(line_count),
+    }
+
+    results: dict[str, dict] = {}
+    for name, lines in workloads.items():
+        phases = time_phases(lines, repeat)
+        results[name] = {"lines": len(lines), "phases": phases, "lines_per_second": len(lines) / sum(phases.values())}
+    return results
+
+
+def frame_stats(values: list[int]) -> dict[str, float]:
+    if not values:
+        return {"mean": 0, "min": 0, "max": 0}
+    return {"mean": statistics.fmean(values), "min": min(values), "max": max(values)}
+
+
+def scripted_keys(emu: Emulator) -> int:
+    if emu.cycles % KEY_INTERVAL:
+        return 0
+    return KEY_SCRIPT[emu.cycles // KEY_INTERVAL % len(KEY_SCRIPT)]
+
+
+def pong_keys(emu: Emulator) -> int:
+    # Moves the paddle towards the ball, one key for each frame as pong reads a key per frame, so the game is never lost.
+    # Scripted keys would miss the ball and end the game after a few dozen frames.
+    if emu.keyboard:
+        return 0
+    offset = emu.registers[PONG_BALL_Y] - 1 - emu.registers[PONG_PADDLE]
+    return 129 if offset > 0 else 128 if offset < 0 else 0
+
+
+# Input for each demo, which decides the key to press (0 for none) before every instruction
+KEY_INPUTS: dict[str, Callable[[Emulator], int]] = {"pong.fpu": pong_keys}
+
+
+def run_frames(machine_code: list[int], frames: int, max_cycles: int, keys: Callable[[Emulator], int] = scripted_keys) -> dict:
+    # Minimal stepping runner: one instruction at a time, counting instructions and ticks between GSWPs
+    emu = Emulator(machine_code)
+    frame_cycles: list[int] = []
+    frame_ticks: list[int] = []
+    cycles = ticks = 0
+    error = None
+
+    while not emu.halted and emu.cycles < max_cycles and len(frame_cycles) < frames:
+        key = keys(emu)
+        if key:
+            emu.press(key)
+
+        decoded = decode(emu.memory[emu.pc])
+        try:
+            emu.step()
+        except EmulatorError as e:
+            error = str(e)
+            break
+
+        cycles += 1
+        ticks += INSTRUCTION_TICKS.get(decoded[0], DEFAULT_INSTRUCTION_TICKS) if decoded is not None else DEFAULT_INSTRUCTION_TICKS
+        if emu.display.frames > len(frame_cycles):
+            frame_cycles.append(cycles)
+            frame_ticks.append(ticks)
+            cycles = ticks = 0
+
+    return {
+        "frames": len(frame_cycles),
+        "cycles": emu.cycles,
+        "halted": emu.halted,
+        "error": error,
+        "cycles_per_frame": frame_stats(frame_cycles),
+        "ticks_per_frame": frame_stats(frame_ticks),
+    }
+
+
+def benchmark_programs(frames: int, max_cycles: int) -> dict[str, dict]:
+    return {fpu_file.name: run_frames(assemble(fpu_file), frames, max_cycles, KEY_INPUTS.get(fpu_file.name, scripted_keys)) for fpu_file in sorted(DEMOS_DIR.glob("*.fpu"))}
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], text=True, cwd=Path(__file__).resolve().parent, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline: dict, results: dict, tolerance: float) -> list[str]:
+    # Cycle counts are deterministic, so any increase is a regression. Timings are allowed some noise.
+    # A demo which runs for fewer frames, or halts when it did not, is compared over a different run, so that is a regression too.
+    regressions: list[str] = []
+    for name, result in results["assembler"].items():
+        old = baseline.get("assembler", {}).get(name)
+        if old is None or old["lines"] != result["lines"]:
+            continue
+        for phase, seconds in result["phases"].items():
+            if phase in old["phases"] and seconds > old["phases"][phase] * (1 + tolerance):
+                regressions.append(f"assembler {name} {phase}: {old['phases'][phase] * 1000:.1f}ms -> {seconds * 1000:.1f}ms")
+
+    for name, result in results["programs"].items():
+        old = baseline.get("programs", {}).get(name)
+        if old is None:
+            continue
+        if result["frames"] != old["frames"] or result["halted"] != old["halted"]:
+            regressions.append(f"{name} ran {result['frames']} frames{' and halted' if result['halted'] else ''}, the baseline ran {old['frames']}{' and halted' if old['halted'] else ''}")
+            continue
+        for measure in ["cycles_per_frame", "ticks_per_frame"]:
+            if result[measure]["mean"] > old[measure]["mean"]:
+                regressions.append(f"{name} {measure}: {old[measure]['mean']:.1f} -> {result[measure]['mean']:.1f}")
+
+    return regressions
+
+
+def main():
+    parser = ArgumentParser(description="Assembler throughput by phase and cycles per frame of the demos, written as JSON")
+    parser.add_argument("--lines", type=int, default=10_000, help="Lines in each synthetic source")
+    parser.add_argument("--depth", type=int, default=8, help="Nesting depth of macro calls in the nested macro source")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--frames", type=int, default=100, help="Frames to run each demo for")
+    parser.add_argument("--cycles", type=int, default=1_000_000, help="Stop a demo after this many instructions")
+    parser.add_argument("-o", "--output", type=str, help="File to write the results to (defaults to stdout)")
+    parser.add_argument("--compare", type=str, help="Results of an earlier run, fail if anything got slower")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE, help="Fraction a timing may exceed the baseline by")
+    args = parser.parse_args()
+
+    results = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "settings": {"lines": args.lines, "depth": args.depth, "frames": args.frames, "cycles": args.cycles, "key_script": KEY_SCRIPT, "key_interval": KEY_INTERVAL, "key_inputs": {name: keys.__name__ for name, keys in KEY_INPUTS.items()}},
+        "assembler": benchmark_assembler(args.lines, args.depth, args.repeat),
+        "programs": benchmark_programs(args.frames, args.cycles),
+    }
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(results, indent=2) + "\n")
+    else:
+        print(json.dumps(results, indent=2))
+
+    if args.compare:
+        regressions = compare(json.loads(Path(args.compare).read_text()), results, args.tolerance)
+        for regression in regressions:
+            print(f"regression: {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,486 @@
+from colored import Fore, Style
+
+from .assembler import AssembledProgram
+from .emulator import ADDRESS_MASK, ALU_OPERATIONS, BRANCH_CONDITIONS, decode
+
+# Loops are only simulated up to this many iterations when trying to bound them
+MAX_LOOP_ITERATIONS = 100_000
+
+
+class Summary:
+    # Costs of the paths from a node to the end of its region, in ticks and instructions
+    def __init__(self, best: int, worst: int, worst_instructions: int, paths: int, total: int, worst_next: int | None) -> None:
+        self.best = best
+        self.worst = worst
+        self.worst_instructions = worst_instructions
+        self.paths = paths
+        self.total = total
+        self.worst_next = worst_next
+
+    @property
+    def typical(self) -> float:
+        return self.total / self.paths
+
+
+def chain(first: Summary, then: Summary) -> Summary:
+    # Every path of `first` followed by every path of `then`
+    return Summary(
+        first.best + then.best,
+        first.worst + then.worst,
+        first.worst_instructions + then.worst_instructions,
+        first.paths * then.paths,
+        first.total * then.paths + then.total * first.paths,
+        None,
+    )
+
+
+def merge(summaries: list[Summary]) -> Summary | None:
+    # Any one of the summaries, None when there are none
+    if not summaries:
+        return None
+    worst = max(summaries, key=lambda summary: summary.worst)
+    return Summary(
+        min(summary.best for summary in summaries),
+        worst.worst,
+        worst.worst_instructions,
+        sum(summary.paths for summary in summaries),
+        sum(summary.total for summary in summaries),
+        None,
+    )
+
+
+class Loop:
+    def __init__(self, members: list[int], trips: int | None) -> None:
+        self.members = members
+        self.trips = trips
+
+    @property
+    def bounded(self) -> bool:
+        return self.trips is not None
+
+
+class FrameAnalysis:
+    def __init__(self, start: int, summary: Summary | None, path: list[int], loops: list[Loop], returning_from: int | None = None, halts: bool = False) -> None:
+        self.start = start
+        self.summary = summary
+        self.path = path
+        self.loops = loops
+        # Subroutine whose GSWP ended the previous frame, when the frame starts by returning from it
+        self.returning_from = returning_from
+        self.halts = halts
+
+    @property
+    def unbounded_loops(self) -> list[Loop]:
+        return [loop for loop in self.loops if not loop.bounded]
+
+
+class Analyzer:
+    def __init__(self, program: AssembledProgram, ticks: dict[str, int]) -> None:
+        self.program = program
+        self.ticks = ticks
+        self.instructions = [decode(word) for word in program.machine_code]
+        self.warnings: list[str] = []
+        self._subroutines: dict[int, Summary | None] = {}
+        self._in_progress: set[int] = set()
+        self._swaps: dict[int, Summary | None] = {}
+        self._swaps_in_progress: set[int] = set()
+        self._resumes: dict[int, Summary | None] = {}
+
+    def name(self, address: int) -> str | None:
+        if address >= len(self.instructions) or self.instructions[address] is None:
+            return None
+        return self.instructions[address][0]
+
+    def successors(self, address: int, sinks: set[str]) -> list[int]:
+        decoded = self.instructions[address] if address < len(self.instructions) else None
+        if decoded is None:
+            return []
+
+        name, args = decoded
+        base = name.split("/")[0]
+        nxt = (address + 1) & ADDRESS_MASK
+
+        if name in sinks or name in ("HLT", "RET"):
+            return []
+        if name == "JMP":
+            return [args[0]]
+        if base in BRANCH_CONDITIONS:
+            return [nxt, args[2]] if args[2] != nxt else [nxt]
+        return [nxt]
+
+    def cost(self, address: int, summary: str, ends: set[str] = set()) -> tuple[int, int]:
+        # Ticks and instructions of a single instruction, including the chosen summary of any subroutine it calls
+        name = self.name(address)
+        ticks = self.ticks.get(name, 0) if name else 0
+        if name != "CALL":
+            return ticks, 1
+
+        callee = self.swapping_call(address, ends) or self.subroutine(self.instructions[address][1][0])
+        if callee is None:
+            return ticks, 1
+        if summary == "best":
+            return ticks + callee.best, 1 + callee.worst_instructions
+        if summary == "typical":
+            return ticks + round(callee.typical), 1 + callee.worst_instructions
+        return ticks + callee.worst, 1 + callee.worst_instructions
+
+    def subroutine(self, address: int) -> Summary | None:
+        if address in self._in_progress:
+            self.warnings.append(f"Recursive call to address {address} cannot be bounded")
+            return None
+        if address in self._subroutines:
+            return self._subroutines[address]
+
+        self._in_progress.add(address)
+        summary, _, loops = self.analyze_region(address, ends={"RET"}, sinks=set())
+        self._in_progress.discard(address)
+        self._subroutines[address] = summary
+        if summary is None:
+            self.warnings.append(f"Subroutine at address {address} never returns")
+        if any(not loop.bounded for loop in loops):
+            self.warnings.append(f"Subroutine at address {address} contains an unbounded loop")
+        return summary
+
+    def swaps(self, address: int) -> Summary | None:
+        # Costs from entering the subroutine at address to its first GSWP, None when it never swaps
+        if address in self._swaps_in_progress:
+            return None
+        if address not in self._swaps:
+            self._swaps_in_progress.add(address)
+            self._swaps[address] = self.analyze_region(address, ends={"GSWP"}, sinks={"RET"})[0]
+            self._swaps_in_progress.discard(address)
+        return self._swaps[address]
+
+    def swapping_call(self, address: int, ends: set[str]) -> Summary | None:
+        # While looking for a GSWP, a CALL to a subroutine which swaps ends the frame inside it
+        if "GSWP" not in ends or self.name(address) != "CALL":
+            return None
+        return self.swaps(self.instructions[address][1][0])
+
+    def resume(self, address: int) -> Summary | None:
+        # Costs from just after the subroutine at address swaps until it returns
+        if address in self._resumes:
+            return self._resumes[address]
+
+        self._resumes[address] = None
+        tails: list[Summary] = []
+        for site in self.reachable(address, lambda site: self.successors(site, {"RET"})):
+            if self.name(site) == "GSWP":
+                tail = self.analyze_region(site + 1, ends={"RET"}, sinks=set())[0]
+            elif self.swapping_call(site, {"GSWP"}):
+                inner = self.resume(self.instructions[site][1][0])
+                rest = self.analyze_region(site + 1, ends={"RET"}, sinks=set())[0]
+                tail = chain(inner, rest) if inner is not None and rest is not None else None
+            else:
+                continue
+            if tail is not None:
+                tails.append(tail)
+
+        self._resumes[address] = merge(tails)
+        return self._resumes[address]
+
+    def reachable(self, start: int, successors) -> list[int]:
+        nodes: list[int] = []
+        seen = {start}
+        stack = [start]
+        while stack:
+            address = stack.pop()
+            nodes.append(address)
+            for succ in successors(address):
+                if succ not in seen:
+                    seen.add(succ)
+                    stack.append(succ)
+        return nodes
+
+    def analyze_region(self, start: int, ends: set[str], sinks: set[str]) -> tuple[Summary | None, list[int], list[Loop]]:
+        # Paths from start are followed until they reach an instruction in `ends`, stopping early at `sinks`
+        def is_end(address: int) -> bool:
+            return self.name(address) in ends or self.swapping_call(address, ends) is not None
+
+        def successors(address: int) -> list[int]:
+            return [] if is_end(address) else self.successors(address, sinks | ends)
+
+        nodes = self.reachable(start, successors)
+        components = strongly_connected_components(nodes, successors)
+        component_of = {address: i for i, component in enumerate(components) for address in component}
+
+        loops: list[Loop] = []
+        component_cost: list[dict[str, tuple[int, int]]] = []
+        for component in components:
+            is_loop = len(component) > 1 or component[0] in successors(component[0])
+            trips = 1
+            if is_loop:
+                loop = Loop(sorted(component), self.loop_trips(component))
+                loops.append(loop)
+                trips = loop.trips if loop.trips is not None else 1
+
+            costs = {}
+            for summary in ("best", "typical", "worst"):
+                member_costs = [self.cost(address, summary, ends) for address in component]
+                costs[summary] = (trips * sum(c[0] for c in member_costs), trips * sum(c[1] for c in member_costs))
+            component_cost.append(costs)
+
+        # Components come out of Tarjan's algorithm in reverse topological order, so successors are always summarised first
+        summaries: list[Summary | None] = []
+        for i, component in enumerate(components):
+            best_ticks = component_cost[i]["best"][0]
+            worst_ticks, worst_instructions = component_cost[i]["worst"]
+            typical_ticks = component_cost[i]["typical"][0]
+
+            ending = [address for address in component if is_end(address)]
+            next_components = {component_of[succ] for address in component for succ in successors(address)} - {i}
+            next_summaries = [(j, summaries[j]) for j in next_components if summaries[j] is not None]
+
+            if ending:
+                summaries.append(Summary(best_ticks, worst_ticks, worst_instructions, 1, typical_ticks, None))
+            elif next_summaries:
+                worst_j, worst_next = max(next_summaries, key=lambda item: item[1].worst)
+                paths = sum(s.paths for _, s in next_summaries)
+                summaries.append(
+                    Summary(
+                        best_ticks + min(s.best for _, s in next_summaries),
+                        worst_ticks + worst_next.worst,
+                        worst_instructions + worst_next.worst_instructions,
+                        paths,
+                        typical_ticks * paths + sum(s.total for _, s in next_summaries),
+                        worst_j,
+                    )
+                )
+            else:
+                summaries.append(None)
+
+        start_component = component_of[start]
+        path: list[int] = []
+        current: int | None = start_component
+        while current is not None:
+            path.extend(sorted(components[current]))
+            current = summaries[current].worst_next if summaries[current] is not None else None
+
+        return summaries[start_component], path, loops
+
+    def loop_trips(self, component: list[int]) -> int | None:
+        # A loop is bounded when it is a single cycle counting a register, set by an LI just before the loop,
+        # with an ADD/SUB immediate until an immediate branch exits the loop
+        members = set(component)
+        header = min(component)
+
+        # Walk the cycle from the header, every member must run exactly once per iteration
+        order: list[int] = []
+        address = header
+        while True:
+            decoded = self.instructions[address]
+            if decoded is None or decoded[0] == "CALL":
+                return None
+            order.append(address)
+            inside = [succ for succ in self.successors(address, set()) if succ in members]
+            if len(inside) != 1:
+                return None
+            address = inside[0]
+            if address == header:
+                break
+        if len(order) != len(members):
+            return None
+
+        writes: dict[int, list[int]] = {}
+        for address in order:
+            name, args = self.instructions[address]
+            if name in ("MOV", "LI", "LD", "LDR", "KRD", "KRDP") or name.split("/")[0] in ALU_OPERATIONS:
+                writes.setdefault(args[0], []).append(address)
+
+        for position, address in enumerate(order):
+            name, args = self.instructions[address]
+            base, _, variant = name.partition("/")
+            if base not in BRANCH_CONDITIONS or variant != "I":
+                continue
+
+            register, limit, target = args
+            exits_when_taken = target not in members
+
+            counter_writes = writes.get(register, [])
+            if len(counter_writes) != 1:
+                continue
+            step_name, step_args = self.instructions[counter_writes[0]]
+            if step_name not in ("ADD/I", "SUB/I") or step_args[1] != register:
+                continue
+
+            value = self.initial_value(header, register, members)
+            if value is None:
+                continue
+
+            step = step_args[2] if step_name == "ADD/I" else -step_args[2]
+            step_first = order.index(counter_writes[0]) < position
+            condition = BRANCH_CONDITIONS[base]
+            for trips in range(1, MAX_LOOP_ITERATIONS + 1):
+                if step_first:
+                    value = ALU_OPERATIONS["ADD"](value, step)
+                if condition(value, limit) == exits_when_taken:
+                    return trips
+                if not step_first:
+                    value = ALU_OPERATIONS["ADD"](value, step)
+
+        return None
+
+    def initial_value(self, header: int, register: int, members: set[int]) -> int | None:
+        # Look for `LI register` in the straight line code leading into the loop header
+        address = header - 1
+        while address >= 0:
+            decoded = self.instructions[address]
+            if decoded is None or self.successors(address, set()) != [address + 1]:
+                return None
+
+            name, args = decoded
+            if name == "LI" and args[0] == register:
+                initial = args[1]
+                break
+            if name in ("MOV", "LD", "LDR", "KRD", "KRDP") or name.split("/")[0] in ALU_OPERATIONS:
+                if args[0] == register:
+                    return None
+            address -= 1
+        else:
+            return None
+
+        # Nothing else may jump into the loop, or between the LI and the loop
+        guarded = members | set(range(address + 1, header))
+        for other, decoded in enumerate(self.instructions):
+            if decoded is None or other in members:
+                continue
+            name, args = decoded
+            if (name in ("JMP", "CALL") or name.split("/")[0] in BRANCH_CONDITIONS) and args[-1] in guarded:
+                return None
+
+        return initial
+
+    def analyze_frames(self) -> list[FrameAnalysis]:
+        # Frames start at the beginning, after each GSWP, and on returning from each CALL to a subroutine which swaps
+        starts: dict[int, int | None] = {0: None}
+        for address in range(len(self.instructions)):
+            if self.name(address) == "GSWP":
+                starts.setdefault(address + 1, None)
+            elif self.swapping_call(address, {"GSWP"}):
+                starts[address + 1] = self.instructions[address][1][0]
+
+        frames: list[FrameAnalysis] = []
+        for start, callee in starts.items():
+            if start >= len(self.instructions):
+                continue
+            summary, path, loops = self.analyze_region(start, ends={"GSWP"}, sinks=set())
+            reached = {self.name(address) for address in self.reachable(start, lambda address: self.successors(address, {"GSWP"}))}
+
+            if callee is not None:
+                resume = self.resume(callee)
+                summary = chain(resume, summary) if resume is not None and summary is not None else None
+            elif summary is None and "RET" in reached:
+                # The rest of a subroutine after its GSWP, counted in the frames starting where it returns to
+                continue
+
+            frames.append(FrameAnalysis(start, summary, path if summary is not None else [], loops, callee, summary is None and "HLT" in reached))
+
+        return frames
+
+
+def strongly_connected_components(nodes: list[int], successors) -> list[list[int]]:
+    # Iterative Tarjan's algorithm, components are returned in reverse topological order
+    index: dict[int, int] = {}
+    low: dict[int, int] = {}
+    on_stack: set[int] = set()
+    stack: list[int] = []
+    components: list[list[int]] = []
+    counter = 0
+
+    for root in nodes:
+        if root in index:
+            continue
+
+        work = [(root, iter(successors(root)))]
+        index[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack.add(root)
+
+        while work:
+            node, children = work[-1]
+            advanced = False
+            for child in children:
+                if child not in index:
+                    index[child] = low[child] = counter
+                    counter += 1
+                    stack.append(child)
+                    on_stack.add(child)
+                    work.append((child, iter(successors(child))))
+                    advanced = True
+                    break
+                if child in on_stack:
+                    low[node] = min(low[node], index[child])
+
+            if advanced:
+                continue
+
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                low[parent] = min(low[parent], low[node])
+
+            if low[node] == index[node]:
+                component = []
+                while True:
+                    member = stack.pop()
+                    on_stack.discard(member)
+                    component.append(member)
+                    if member == node:
+                        break
+                components.append(component)
+
+    return components
+
+
+def describe_address(program: AssembledProgram, address: int) -> str:
+    label = max(((labelled, name) for name, labelled in program.labels.items() if labelled <= address), default=None)
+    if label is None:
+        return f"address {address}"
+    return f"{label[1]}" if label[0] == address else f"{label[1]}+{address - label[0]}"
+
+
+def source_ranges(program: AssembledProgram, addresses: list[int]) -> list[str]:
+    # Merge runs of consecutive addresses into source line ranges
+    lines = [program.processed_lines[address][0] for address in addresses if address < len(program.processed_lines)]
+    ranges: list[str] = []
+    for line in lines:
+        if ranges and ranges[-1][1] + 1 == line:
+            ranges[-1] = (ranges[-1][0], line)
+        else:
+            ranges.append((line, line))
+
+    return [f"line {start + 1}" if start == end else f"lines {start + 1}-{end + 1}" for start, end in ranges]
+
+
+def format_analysis(program: AssembledProgram, frames: list[FrameAnalysis], warnings: list[str], verbose: bool = False) -> str:
+    report = ""
+    for frame in frames:
+        start_line = program.processed_lines[frame.start][0] + 1
+        returning = f" returning from {describe_address(program, frame.returning_from)}" if frame.returning_from is not None else ""
+        report += f"{Fore.cyan}Frame from {describe_address(program, frame.start)} (line {start_line}){returning}{Style.reset}\n"
+
+        if frame.summary is None and frame.halts:
+            report += "  halts without another GSWP\n"
+        elif frame.summary is None:
+            report += f"  {Fore.yellow}No GSWP reachable{Style.reset}\n"
+        else:
+            summary = frame.summary
+            report += f"  worst {summary.worst} ticks ({summary.worst_instructions} instructions), typical {summary.typical:.0f} ticks, best {summary.best} ticks over {summary.paths} paths\n"
+            report += f"  worst path: {', '.join(source_ranges(program, frame.path))}\n"
+            if verbose:
+                for address in frame.path:
+                    line_no, content = program.processed_lines[address]
+                    report += f"    {line_no + 1}: {program.lines[line_no].strip()}\n"
+
+        for loop in frame.loops:
+            where = f"{describe_address(program, loop.members[0])} ({', '.join(source_ranges(program, loop.members))})"
+            if loop.bounded:
+                report += f"  loop at {where} runs {loop.trips} times\n"
+            else:
+                report += f"  {Fore.red}unbounded loop at {where}{Style.reset}\n"
+
+    for warning in dict.fromkeys(warnings):
+        report += f"{Fore.yellow}{warning}{Style.reset}\n"
+
+    return report
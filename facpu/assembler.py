@@ -1,5 +1,7 @@
 import re
+from functools import cache
 from pathlib import Path
+from typing import TYPE_CHECKING
 
 from colored import Fore, Style
 
@@ -8,19 +10,28 @@ from .assembler_instructions import (ALIASED_INSTRUCTIONS,
                                      PseudoInstruction)
 from .hardware_definition import (INSTRUCTION_SIZE, INSTRUCTIONS, OPCODE_SIZE,
                                   PARAM_SIZE, InstructionInfo, ParamType)
-from .macros import MACROS, UserMacroRegistry
+from .lexer import Token, token_end, tokenize
+from .macros import MACROS, MAX_MACRO_DEPTH, UserMacroRegistry
+
+if TYPE_CHECKING:
+    from .optimizer import OptimizationReport
 
 
 class AssemblyError(Exception):
-    def __init__(self, message: str, line: int, token: str | None = None):
+    def __init__(self, message: str, line: int, token: str | None = None, column: int | None = None):
         super().__init__(message)
         self.line = line
         self.token = token
+        self.column = column
 
     def format_error(self, lines) -> str:
         error_line = lines[self.line].strip()
 
-        token_index = error_line.find(self.token) if self.token else -1
+        if self.token and self.column is not None:
+            # Columns are counted in the unstripped line
+            token_index = self.column - (len(lines[self.line]) - len(lines[self.line].lstrip()))
+        else:
+            token_index = error_line.find(self.token) if self.token else -1
         if token_index >= 0:
             assert self.token is not None  # for python type checker
 
@@ -41,126 +52,228 @@ class AssemblyError(Exception):
         )
 
 
-def parse_macros(line: str, line_no: int) -> str:
-    i = 0
-    n = len(line)
-    result = ""
-
-    while i < n:
-        if line[i] == "#":
-            # Start of macro
-
-            j = i + 1
-            # Get macro name (letters, digits, underscore)
-            while j < n and (line[j].isalnum() or line[j] == "_"):
-                j += 1
-            macro_name = line[i + 1 : j]
-            arg_str = ""
-
-            if j < n and line[j] == "(":
-                # If macro has parentheses
-                depth = 1
-                k = j + 1
-                # Skip over embedded macros and only return on the correct depth
-                while k < n and depth > 0:
-                    if line[k] == "(":
-                        depth += 1
-                    elif line[k] == ")":
-                        depth -= 1
-                    k += 1
-
-                args_text = line[j + 1 : k - 1]  # Content inside parentheses
-
-                # Recursively parse arguments
-                arg_str = parse_macros(args_text, line_no)
-
-                i = k
-            else:
-                # If macro does not have parentheses
-                i = j
-
-            # Replace macro with called macro function
-            args = [arg.strip() for arg in arg_str.split(",") if arg.strip()]
-            if macro_name in MACROS:
-                resolved_macro = MACROS[macro_name].func(args, line_no)
-            elif macro_name in UserMacroRegistry.macros:
-                resolved_macro = UserMacroRegistry.apply_macro(macro_name, args, line_no)
+def match_brackets(tokens: list[Token]) -> dict[int, tuple[int, bool]]:
+    # Index of the closing parenthesis of each opening one (the number of tokens if it is never closed),
+    # and whether a macro or label is inside, found in one pass so nested arguments are never scanned again
+    brackets: dict[int, tuple[int, bool]] = {}
+    opened: list[int] = []
+    nested: list[bool] = []
+
+    for j, (kind, _, _, _) in enumerate(tokens):
+        if kind == "lparen":
+            opened.append(j)
+            nested.append(False)
+        elif kind == "macro" or kind == "label":
+            if nested:
+                nested[-1] = True
+        elif kind == "rparen" and opened:
+            inner = nested.pop()
+            brackets[opened.pop()] = (j, inner)
+            if inner and nested:
+                nested[-1] = True
+
+    while opened:
+        inner = nested.pop()
+        brackets[opened.pop()] = (len(tokens), inner)
+        if inner and nested:
+            nested[-1] = True
+
+    return brackets
+
+
+def expand_macros(
+    line: str, tokens: list[Token], line_no: int, start: int, end: int, span_start: int, span_end: int, registry: UserMacroRegistry, nesting: int = 0, brackets: dict[int, tuple[int, bool]] | None = None
+) -> str:
+    # Rebuild line[span_start:span_end] with the macros in tokens[start:end] expanded and labels removed.
+    # Text between macros is copied as whole slices, so this is linear in the length of the line.
+    if brackets is None:
+        brackets = match_brackets(tokens)
+
+    pieces: list[str] = []
+    position = span_start
+    i = start
+
+    while i < end:
+        kind, macro_name, _, column = tokens[i]
+
+        if kind == "label":
+            pieces.append(line[position:column])
+            position = token_end(tokens[i])
+            i += 1
+            continue
+
+        if kind != "macro":
+            i += 1
+            continue
+
+        # `nesting` counts the macro calls whose arguments hold this one
+        if nesting >= MAX_MACRO_DEPTH:
+            raise AssemblyError(f"Macro calls are nested more than {MAX_MACRO_DEPTH} deep", line_no, token=f"#{macro_name}", column=column)
+
+        pieces.append(line[position:column])
+        arg_str = ""
+
+        if i + 1 < end and tokens[i + 1][0] == "lparen" and tokens[i + 1][3] == token_end(tokens[i]):
+            j, nested = brackets[i + 1]
+            j = min(j, end)
+
+            args_start = tokens[i + 1][3] + 1
+            args_end = tokens[j][3] if j < end else span_end
+            # Recursively expand arguments
+            if nested:
+                arg_str = expand_macros(line, tokens, line_no, i + 2, j, args_start, args_end, registry, nesting + 1, brackets)
             else:
-                raise AssemblyError(f"Macro {Style.underline}{macro_name}{Style.res_underline} unknown", line_no, token=f"#{macro_name}")
+                arg_str = line[args_start:args_end]
 
-            result += resolved_macro
+            position = args_end + 1 if j < end else span_end
+            i = j + 1
         else:
-            # If not macro just write back line character
-            result += line[i]
+            position = token_end(tokens[i])
             i += 1
 
-    return result
+        # Replace macro with called macro function
+        args = [arg.strip() for arg in arg_str.split(",") if arg.strip()]
+        if macro_name in MACROS:
+            resolved_macro = MACROS[macro_name].func(args, line_no, registry)
+        elif macro_name in registry.macros:
+            resolved_macro = registry.apply_macro(macro_name, args, line_no)
+        else:
+            raise AssemblyError(f"Macro {Style.underline}{macro_name}{Style.res_underline} unknown", line_no, token=f"#{macro_name}", column=column)
+
+        pieces.append(resolved_macro)
+
+    pieces.append(line[position:span_end])
+    return "".join(pieces)
+
+
+def parse_macros(line: str, line_no: int, registry: UserMacroRegistry) -> str:
+    tokens = tokenize(line, line_no, labels=False)
+    return expand_macros(line, tokens, line_no, 0, len(tokens), 0, len(line), registry)
+
 
+UNEXPECTED_AFTER_EXPANSION = re.compile(r"[()#]")
 
-def detect_param_type(param: str) -> set[ParamType]:
-    if param.strip().startswith("R"):
-        return {"reg"}
+
+def line_words(line: str, tokens: list[Token], line_no: int, registry: UserMacroRegistry) -> list[str]:
+    # Instruction and parameters of a line, once labels, comments and macros are removed
+    words: list[str] = []
+    for kind, text, _, column in tokens:
+        if kind == "word":
+            words.append(text)
+        elif kind == "macro":
+            break
+        elif kind == "lparen" or kind == "rparen":
+            raise AssemblyError(f"Unexpected {Style.underline}{text}{Style.res_underline}", line_no, token=text, column=column)
     else:
-        return {"imm4", "imm8", "imm10", "addr"}
+        return words
+
+    # Parentheses outside of a macro's arguments are found before expanding, while their column is known
+    brackets = match_brackets(tokens)
+    j = 0
+    while j < len(tokens):
+        kind, text, _, column = tokens[j]
+        if kind == "macro" and j + 1 < len(tokens) and tokens[j + 1][0] == "lparen" and tokens[j + 1][3] == token_end(tokens[j]):
+            j = brackets[j + 1][0] + 1
+            continue
+        if kind == "lparen" or kind == "rparen":
+            raise AssemblyError(f"Unexpected {Style.underline}{text}{Style.res_underline}", line_no, token=text, column=column)
+        j += 1
 
+    # Macros expand to plain text, which only needs splitting into words
+    expanded = expand_macros(line, tokens, line_no, 0, len(tokens), 0, token_end(tokens[-1]), registry, brackets=brackets)
+    unexpected = UNEXPECTED_AFTER_EXPANSION.search(expanded)
+    if unexpected is not None:
+        # Positions in expanded text do not match the source line
+        raise AssemblyError(f"Unexpected {Style.underline}{unexpected[0]}{Style.res_underline}", line_no, token=unexpected[0])
 
-def resolve_instr_alias(instr: str, params: list[str]) -> str | None:
+    return expanded.replace(",", " ").split()
+
+
+REGISTER_TYPES: frozenset[ParamType] = frozenset({"reg"})
+IMMEDIATE_TYPES: frozenset[ParamType] = frozenset({"imm4", "imm8", "imm10", "addr"})
+
+
+def detect_param_type(param: str) -> frozenset[ParamType]:
+    # Virtual registers (%name) are given a physical register after preprocessing
+    if param.strip().startswith(("R", "%")):
+        return REGISTER_TYPES
+    else:
+        return IMMEDIATE_TYPES
+
+
+@cache
+def resolve_alias_types(instr: str, param_types: tuple[frozenset[ParamType], ...]) -> str | None:
     for possible_instr in ALIASED_INSTRUCTIONS[instr]:
         possible_instr_info = INSTRUCTIONS[possible_instr]
 
-        if len(possible_instr_info["params"]) != len(params):
+        if len(possible_instr_info["params"]) != len(param_types):
             continue
 
-        if all(possible_instr_param in detect_param_type(our_param) for our_param, possible_instr_param in zip(params, possible_instr_info["params"])):
+        if all(possible_instr_param in types for types, possible_instr_param in zip(param_types, possible_instr_info["params"])):
             return possible_instr
 
     return None
 
 
-def preprocess(lines: list[str]) -> tuple[list[tuple[int, str]], dict[str, int]]:
+def resolve_instr_alias(instr: str, params: list[str]) -> str | None:
+    # Aliases only depend on the kind of each parameter, so resolutions are shared between lines
+    return resolve_alias_types(instr, tuple(detect_param_type(param) for param in params))
+
+
+def preprocess_line(line: str, line_no: int, registry: UserMacroRegistry) -> tuple[list[Token], str | None]:
+    # Returns the labels on the line and its processed content, or None for lines without an instruction
+    tokens = tokenize(line, line_no)
+    found_labels = [token for token in tokens if token[0] == "label"] if ":" in line else []
+
+    words = line_words(line, tokens, line_no, registry)
+    if not words:
+        return found_labels, None
+
+    instr, *params = words
+
+    # Alias commands
+    if instr in ALIASED_INSTRUCTIONS:
+        real_instr = resolve_instr_alias(instr, params)
+        if real_instr is None:
+            raise AssemblyError(
+                f"Instruction {instr} with these parameters cannot be aliased to one of \n{"\n".join([f"  {possible_instr} - {", ".join(INSTRUCTIONS[possible_instr]["params"])}" for possible_instr in ALIASED_INSTRUCTIONS[instr]])}",
+                line_no,
+            )
+        instr = real_instr
+
+    return found_labels, " ".join([instr, *params])
+
+
+def preprocess(lines: list[str], registry: UserMacroRegistry | None = None) -> tuple[list[tuple[int, str]], dict[str, int]]:
     processed_lines: list[tuple[int, str]] = []
     address: int = 0
     labels: dict[str, int] = {}
+    # Every program starts with no user macros
+    registry = UserMacroRegistry() if registry is None else registry
 
     for i, line in enumerate(lines):
-        # Remove comments
-        clean_line = line.split(";")[0].strip()
-
-        # Identify and remove labels
-        found_labels = re.findall(r"([^\s]+):", clean_line)
-        if found_labels:
-            for label in found_labels:
-                if label in labels:
-                    raise AssemblyError(f"Duplicate label {Style.underline}{label}{Style.res_underline} found", i, token=label)
-                labels.update({label: address})
-            clean_line = re.sub(r"[^\s]+:", "", clean_line).strip()
-
-        # Parse Macros
-        clean_line = parse_macros(clean_line, i)
-
-        # Alias commands
-        instr, params = split_line(clean_line)
-        if instr in ALIASED_INSTRUCTIONS:
-            real_instr = resolve_instr_alias(instr, params)
-            if real_instr is None:
-                raise AssemblyError(
-                    f"Instruction {instr} with these parameters cannot be aliased to one of \n{"\n".join([f"  {possible_instr} - {", ".join(INSTRUCTIONS[possible_instr]["params"])}" for possible_instr in ALIASED_INSTRUCTIONS[instr]])}",
-                    i,
-                )
-            clean_line = ",".join([real_instr, *params])
+        found_labels, content = preprocess_line(line, i, registry)
+
+        for _, label, _, column in found_labels:
+            if label in labels:
+                raise AssemblyError(f"Duplicate label {Style.underline}{label}{Style.res_underline} found", i, token=label, column=column)
+            labels.update({label: address})
 
         # Remove empty lines
-        if not clean_line:
+        if content is None:
             continue
 
-        processed_lines.append((i, clean_line))
+        processed_lines.append((i, content))
         address += 1
 
     return processed_lines, labels
 
 
 def split_line(content: str) -> tuple[str, list[str]]:
-    parts = re.split(r"[,\s]+", content)
+    parts = content.replace(",", " ").split()
+    if not parts:
+        return "", []
+
     instr, *params = parts
     return instr, params
 
@@ -260,7 +373,27 @@ def assemble_line(line: tuple[int, str], labels: dict[str, int]) -> int:
     return binary
 
 
-def assemble(file: Path) -> list[int]:
+class AssembledProgram:
+    def __init__(
+        self,
+        lines: list[str],
+        processed_lines: list[tuple[int, str]],
+        labels: dict[str, int],
+        machine_code: list[int],
+        optimization: "OptimizationReport | None" = None,
+    ) -> None:
+        self.lines = lines
+        self.processed_lines = processed_lines
+        self.labels = labels
+        self.machine_code = machine_code
+        self.optimization = optimization
+
+
+def assemble_program(file: Path, optimize: bool = False, inline_budget: int | None = None) -> AssembledProgram:
+    from .constants import expand_pseudo_instructions
+    from .optimizer import optimize as optimize_lines
+    from .regalloc import allocate_registers
+
     if not file.exists():
         raise Exception(f"{Fore.red}File {Style.underline}{file}{Style.res_underline} cannot be found{Style.reset}")
 
@@ -269,6 +402,12 @@ def assemble(file: Path) -> list[int]:
 
     try:
         processed_lines, labels = preprocess(lines)
+        processed_lines, labels = expand_pseudo_instructions(processed_lines, labels)
+        processed_lines, labels = allocate_registers(processed_lines, labels)
+
+        optimization = None
+        if optimize:
+            processed_lines, labels, optimization = optimize_lines(processed_lines, labels, inline_budget)
 
         machine_code: list[int] = []
         for line in processed_lines:
@@ -278,4 +417,8 @@ def assemble(file: Path) -> list[int]:
     except AssemblyError as e:
         raise Exception(e.format_error(lines))
 
-    return machine_code
+    return AssembledProgram(lines, processed_lines, labels, machine_code, optimization)
+
+
+def assemble(file: Path, optimize: bool = False) -> list[int]:
+    return assemble_program(file, optimize).machine_code
@@ -17,7 +17,7 @@ ALIASED_INSTRUCTIONS = {
     "SHL": ["SHL/R", "SHL/I"],
     "SHR": ["SHR/R", "SHR/I"],
     "AND": ["AND/R", "AND/I"],
-    "OR ": ["OR /R", "OR /I"],
+    "OR": ["OR/R", "OR/I"],
     "XOR": ["XOR/R", "XOR/I"],
     "GDS": ["GDS/III", "GDS/IIR", "GDS/IRI", "GDS/IRR", "GDS/RII", "GDS/RIR", "GDS/RRI", "GDS/RRR"],
 }
@@ -34,6 +34,13 @@ class PseudoInstruction:
         return len(params) - (1 if "line_no" in params else 0)
 
 
+class ExpandingPseudoInstruction(PseudoInstruction):
+    # Stands for several instructions, `func` returns their processed lines.
+    # These are expanded before labels are given addresses, see constants.expand_pseudo_instructions()
+    def __init__(self, func: Callable[..., list[str]]) -> None:
+        super().__init__(func)
+
+
 def data_instr(data: str, line_no: int) -> int:
     from .assembler import AssemblyError
     from .hardware_definition import INSTRUCTION_SIZE
@@ -50,6 +57,29 @@ def data_instr(data: str, line_no: int) -> int:
     return val
 
 
+def parse_constant(value: str, line_no: int) -> int:
+    from .assembler import AssemblyError
+    from .hardware_definition import INSTRUCTION_SIZE
+
+    try:
+        val = int(value, 0)  # auto-detect binary/hex
+    except ValueError:
+        raise AssemblyError(f"Constant {Style.underline}{value}{Style.res_underline} has invalid syntax", line_no, token=value)
+
+    max_binary: int = (1 << INSTRUCTION_SIZE) - 1
+    if not (0 <= val <= max_binary):
+        raise AssemblyError(f"Constant {Style.underline}{value}{Style.res_underline} out of range (max {max_binary})", line_no, token=value)
+
+    return val
+
+
+def load_word_instr(register: str, value: str, line_no: int) -> list[str]:
+    from .constants import sequence_lines
+
+    return sequence_lines(register, parse_constant(value, line_no))
+
+
 ASSEMBLER_PSEUDO_INSTRUCTIONS: dict[str, PseudoInstruction] = {
     "DAT": PseudoInstruction(data_instr),
+    "LIW": ExpandingPseudoInstruction(load_word_instr),
 }
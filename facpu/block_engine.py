@@ -0,0 +1,294 @@
+from types import CodeType
+from typing import Callable, Iterable
+
+from .emulator import (ADDRESS_MASK, BRANCH_CONDITIONS, FIELD_LAYOUTS,
+                       OPCODES, WORD_MASK, Display, Emulator, Pause,
+                       alu_div, alu_mod, alu_pow, decode, to_int32)
+from .hardware_definition import (CALL_STACK_SIZE, INSTRUCTION_SIZE,
+                                  MEMORY_SIZE, OPCODE_SIZE)
+
+CONTROL_FLOW_INSTRUCTIONS = {"JMP", "CALL", "RET", "HLT", *(f"{name}/{variant}" for name in BRANCH_CONDITIONS for variant in "RI")}
+
+BRANCH_OPERATORS = {"BEQ": "==", "BNE": "!=", "BLT": "<", "BGT": ">"}
+
+# Expressions for each ALU operation, `{a}` and `{b}` are replaced with the operand expressions
+ALU_EXPRESSIONS = {
+    "ADD": "{a} + {b}",
+    "SUB": "{a} - {b}",
+    "MUL": "{a} * {b}",
+    "DIV": "alu_div({a}, {b})",
+    "MOD": "alu_mod({a}, {b})",
+    "POW": "alu_pow({a}, {b})",
+    "SHL": "{a} << ({b} & 31)",
+    "SHR": "{a} >> ({b} & 31)",
+    "AND": "{a} & {b}",
+    "OR": "{a} | {b}",
+    "XOR": "{a} ^ {b}",
+}
+# Operations which can leave the signed 32-bit range and need wrapping
+WRAPPED_ALU_OPERATIONS = {"ADD", "SUB", "MUL", "SHL"}
+
+MAX_BLOCK_LENGTH = 64
+
+# Block exits above the address space, offset by the address of the instruction which stopped the block
+HALT_EXIT = MEMORY_SIZE
+FAULT_EXIT = 2 * MEMORY_SIZE
+# Exits offset by the address to continue from
+PAUSE_EXIT = 3 * MEMORY_SIZE
+
+# Generated code is shared between emulators running the same program
+_CODE_CACHE: dict[str, CodeType] = {}
+
+
+def find_leaders(memory: list[int]) -> set[int]:
+    leaders = {0}
+    for address, word in enumerate(memory):
+        decoded = decode(word)
+        if decoded is None:
+            continue
+
+        name, args = decoded
+        if name in CONTROL_FLOW_INSTRUCTIONS:
+            leaders.add((address + 1) & ADDRESS_MASK)
+            if name not in ("RET", "HLT"):
+                leaders.add(args[-1])
+
+    return leaders
+
+
+class BlockEmulator(Emulator):
+    def __init__(self, machine_code: list[int], keyboard: Iterable[int] = (), display: Display | None = None) -> None:
+        super().__init__(machine_code, keyboard, display)
+
+        self.leaders = find_leaders(self.memory[: len(machine_code)])
+        # Blocks take the pc they were entered at, so every uncompiled address can share the same stub
+        self._entry: list[Callable[[int], tuple[int, int]]] = [self._compile_and_run] * MEMORY_SIZE
+        self._lengths: dict[int, int] = {}
+        # Start addresses of the cached blocks covering each address
+        self._cover: list[list[int]] = [[] for _ in range(MEMORY_SIZE)]
+
+        self._namespace = {
+            "regs": self.registers,
+            "memory": self.memory,
+            "stack": self.call_stack,
+            "keyboard": self.keyboard,
+            "draw": self.display.draw,
+            "swap": self.display.swap,
+            "code": self._code,
+            "recompile": self._compile_at,
+            "cover": self._cover,
+            "invalidate": self._invalidate,
+            "Pause": Pause,
+            "to_int32": to_int32,
+            "alu_div": alu_div,
+            "alu_mod": alu_mod,
+            "alu_pow": alu_pow,
+        }
+
+    def _invalidate(self, address: int, current: int) -> bool:
+        # Drop every block containing a modified word, returning whether the running block was one of them
+        starts = self._cover[address]
+        hit = current in starts
+        for start in list(starts):
+            length = self._lengths.pop(start)
+            self._entry[start] = self._compile_and_run
+            for offset in range(length):
+                self._cover[(start + offset) & ADDRESS_MASK].remove(start)
+
+        return hit
+
+    def _invalidate_word(self, address: int) -> None:
+        super()._invalidate_word(address)
+        if self._cover[address]:
+            self._invalidate(address, -1)
+
+    def compile(self, address: int, word: int) -> Callable[[int], int]:
+        op = super().compile(address, word)
+
+        # Stores made while single stepping must also drop any compiled blocks they modify
+        name, args = decode(word) or ("", [])
+        if name not in ("ST", "STR"):
+            return op
+
+        regs = self.registers
+        store_address = (lambda: args[0]) if name == "ST" else (lambda: regs[args[0]] & ADDRESS_MASK)
+
+        def store(pc: int) -> int:
+            target = store_address()
+            nxt = op(pc)
+            if self._cover[target]:
+                self._invalidate(target, -1)
+            return nxt
+
+        return store
+
+    def block_source(self, start: int) -> tuple[str, int]:
+        lines = ["def block(pc):"]
+        address = start
+        length = 0
+        terminated = False
+
+        def emit(line: str) -> None:
+            lines.append(f"    {line}")
+
+        while not terminated:
+            if length > 0 and address in self.leaders:
+                break
+
+            word = self.memory[address]
+            opcode = word >> (INSTRUCTION_SIZE - OPCODE_SIZE)
+            if opcode not in OPCODES:
+                # Leave unknown opcodes to the stepping mode so it raises the error
+                break
+
+            name = OPCODES[opcode]
+            base, _, variant = name.partition("/")
+            args = [(word >> shift) & mask for shift, mask in FIELD_LAYOUTS[opcode]]
+            nxt = (address + 1) & ADDRESS_MASK
+            done = length + 1
+
+            match base:
+                case "MOV":
+                    emit(f"regs[{args[0]}] = regs[{args[1]}]")
+                case "LI":
+                    emit(f"regs[{args[0]}] = {args[1]}")
+                case "LD":
+                    emit(f"regs[{args[0]}] = memory[{args[1]}]")
+                case "ST" | "STR":
+                    if base == "ST":
+                        emit(f"a = {args[0]}")
+                    else:
+                        emit(f"a = regs[{args[0]}] & {ADDRESS_MASK}")
+                    emit(f"memory[a] = regs[{args[1]}] & {WORD_MASK}")
+                    emit("code[a] = recompile")
+                    emit(f"if cover[a] and invalidate(a, {start}):")
+                    emit(f"    return ({nxt}, {done})")
+                case "LDR":
+                    emit(f"regs[{args[0]}] = memory[regs[{args[1]}] & {ADDRESS_MASK}]")
+                case "NOP":
+                    pass
+                case "HLT":
+                    emit(f"return ({HALT_EXIT + address}, {done})")
+                    terminated = True
+                case "JMP":
+                    emit(f"return ({args[0]}, {done})")
+                    terminated = True
+                case "BEQ" | "BNE" | "BLT" | "BGT":
+                    b = str(args[1]) if variant == "I" else f"regs[{args[1]}]"
+                    emit(f"return ({args[2]}, {done}) if regs[{args[0]}] {BRANCH_OPERATORS[base]} {b} else ({nxt}, {done})")
+                    terminated = True
+                case "CALL":
+                    # Faults are left to the stepping mode by exiting before the faulting instruction
+                    emit(f"if len(stack) >= {CALL_STACK_SIZE}:")
+                    emit(f"    return ({FAULT_EXIT + address}, {length})")
+                    emit(f"stack.append({nxt})")
+                    emit(f"return ({args[0]}, {done})")
+                    terminated = True
+                case "RET":
+                    emit("if not stack:")
+                    emit(f"    return ({FAULT_EXIT + address}, {length})")
+                    emit(f"return (stack.pop(), {done})")
+                    terminated = True
+                case "GDS":
+                    pos_reg, size_reg, col_reg = (letter == "R" for letter in variant)
+                    params = [f"regs[{arg}]" if is_reg else str(arg) for arg, is_reg in zip(args, (pos_reg, pos_reg, size_reg, size_reg, col_reg))]
+                    emit(f"draw({', '.join(params)})")
+                case "GSWP":
+                    emit("try:")
+                    emit("    swap()")
+                    emit("except Pause:")
+                    emit(f"    return ({PAUSE_EXIT + nxt}, {done})")
+                case "KRD":
+                    emit(f"regs[{args[0]}] = keyboard.popleft() if keyboard else 0")
+                case "KRDP":
+                    emit(f"regs[{args[0]}] = keyboard[0] if keyboard else 0")
+                case _:
+                    b = str(args[2]) if variant == "I" else f"regs[{args[2]}]"
+                    expression = ALU_EXPRESSIONS[base].format(a=f"regs[{args[1]}]", b=b)
+                    if base in WRAPPED_ALU_OPERATIONS:
+                        emit(f"v = {expression}")
+                        emit(f"regs[{args[0]}] = v if -2147483648 <= v <= 2147483647 else to_int32(v)")
+                    else:
+                        emit(f"regs[{args[0]}] = {expression}")
+
+            length += 1
+            address = nxt
+
+            if address == 0 or length == MAX_BLOCK_LENGTH:
+                # Do not wrap around the end of memory within a block
+                break
+
+        if not terminated:
+            emit(f"return ({address}, {length})")
+
+        return "\n".join(lines), length
+
+    def _compile_block(self, start: int) -> Callable[[int], tuple[int, int]]:
+        source, length = self.block_source(start)
+        if length == 0:
+            return lambda pc: (FAULT_EXIT + start, 0)
+
+        code = _CODE_CACHE.get(source)
+        if code is None:
+            code = compile(source, f"<facpu block {start}>", "exec")
+            _CODE_CACHE[source] = code
+        exec(code, self._namespace)
+
+        block = self._namespace["block"]
+        self._entry[start] = block
+        self._lengths[start] = length
+        for offset in range(length):
+            self._cover[(start + offset) & ADDRESS_MASK].append(start)
+
+        return block
+
+    def _compile_and_run(self, pc: int) -> tuple[int, int]:
+        return self._compile_block(pc)(pc)
+
+    def run(self, max_cycles: int | None = None) -> int:
+        if self.halted:
+            return 0
+
+        limit = max_cycles if max_cycles is not None else 1 << 62
+        # Blocks are run freely until one could overrun the cycle limit, the rest is single stepped
+        fast_limit = limit - MAX_BLOCK_LENGTH
+        entry = self._entry
+        pc = self.pc
+        executed = 0
+        pending = 0  # cycles run in blocks which are not yet counted in self.cycles
+        self.paused = False
+
+        try:
+            while executed < limit:
+                while executed <= fast_limit and pc < MEMORY_SIZE:
+                    pc, done = entry[pc](pc)
+                    executed += done
+                    pending += done
+
+                if pc >= PAUSE_EXIT:
+                    pc -= PAUSE_EXIT
+                    self.paused = True
+                    break
+
+                if HALT_EXIT <= pc < FAULT_EXIT:
+                    pc -= HALT_EXIT
+                    self.halted = True
+                    break
+
+                if pc >= FAULT_EXIT:
+                    # The block stopped before a faulting instruction, stepping it raises the error
+                    pc -= FAULT_EXIT
+
+                self.pc = pc
+                self.cycles += pending
+                pending = 0
+
+                executed += Emulator.run(self, 1)
+                pc = self.pc
+                if self.halted or self.paused:
+                    break
+        finally:
+            self.pc = pc
+            self.cycles += pending
+
+        return executed
@@ -0,0 +1,93 @@
+import glob
+import json
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+
+from colored import Fore, Style
+
+from .assembler import assemble_program
+from .factorio import generate_flasher_blueprint
+from .image import write_image
+
+# File suffix of each way a program can be written out
+OUTPUT_FORMATS = {"blueprint": ".blueprint.txt", "json": ".json", "bin": ".bin"}
+
+
+class BuildResult:
+    def __init__(self, source: Path, output: Path | None, words: int, size: int, seconds: float, error: str | None = None) -> None:
+        self.source = source
+        self.output = output
+        self.words = words
+        self.size = size
+        self.seconds = seconds
+        self.error = error
+
+
+def find_sources(pattern: str) -> list[Path]:
+    # A directory builds every program inside it, anything else is a glob
+    path = Path(pattern)
+    if path.is_dir():
+        return sorted(path.rglob("*.fpu"))
+
+    return sorted(Path(match) for match in glob.glob(pattern, recursive=True) if match.endswith(".fpu"))
+
+
+def output_path(source: Path, output_dir: Path | None, output_format: str) -> Path:
+    return (source.parent if output_dir is None else output_dir) / f"{source.stem}{OUTPUT_FORMATS[output_format]}"
+
+
+def write_output(output: Path, machine_code: list[int], label: str, output_format: str, symbols: dict[str, int] | None = None) -> int:
+    # Binary images keep their symbols in a sidecar, returns the number of bytes written
+    if output_format == "bin":
+        return write_image(output, machine_code, symbols)
+
+    contents = json.dumps(machine_code) if output_format == "json" else generate_flasher_blueprint(machine_code, label=label)
+    with open(output, "w") as f:
+        f.write(contents)
+    return len(contents)
+
+
+def build_file(source: Path, output_dir: Path | None, optimize: bool, output_format: str) -> BuildResult:
+    # Runs in a worker process, so errors are returned rather than raised
+    start = time.perf_counter()
+    output = output_path(source, output_dir, output_format)
+    try:
+        program = assemble_program(source, optimize=optimize)
+        size = write_output(output, program.machine_code, source.name, output_format, program.labels)
+    except Exception as e:
+        return BuildResult(source, None, 0, 0, time.perf_counter() - start, str(e))
+
+    return BuildResult(source, output, len(program.machine_code), size, time.perf_counter() - start)
+
+
+def build(sources: list[Path], output_dir: Path | None = None, optimize: bool = False, output_format: str = "blueprint", jobs: int | None = None) -> list[BuildResult]:
+    if output_dir is not None:
+        output_dir.mkdir(parents=True, exist_ok=True)
+
+    if jobs == 1 or len(sources) <= 1:
+        return [build_file(source, output_dir, optimize, output_format) for source in sources]
+
+    # Workers are spawned, as forking the threaded server could copy a lock some other thread is holding
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=get_context("spawn")) as executor:
+        return list(executor.map(build_file, sources, [output_dir] * len(sources), [optimize] * len(sources), [output_format] * len(sources)))
+
+
+def format_build_summary(results: list[BuildResult], seconds: float) -> str:
+    width = max([len(str(result.source)) for result in results] + [len("program")])
+    summary = f"{'program':<{width}}{'words':>8}{'bytes':>10}{'time':>10}\n"
+
+    for result in results:
+        if result.error is not None:
+            summary += f"{Fore.red}{str(result.source):<{width}}{'failed':>8}{Style.reset}\n{result.error}\n"
+        else:
+            summary += f"{str(result.source):<{width}}{result.words:>8}{result.size:>10}{result.seconds * 1000:>8.1f}ms\n"
+
+    failed = sum(result.error is not None for result in results)
+    built = len(results) - failed
+    colour = Fore.red if failed else Fore.green
+    summary += f"{colour}Built {built} of {len(results)} programs in {seconds * 1000:.1f}ms"
+    summary += f", {failed} failed{Style.reset}" if failed else f"{Style.reset}"
+
+    return summary
@@ -0,0 +1,85 @@
+import hashlib
+import json
+from pathlib import Path
+
+from .assembler import AssembledProgram, assemble_program
+from .flashing import IMAGE_DIRECTORY
+from .optimizer import OptimizationReport
+
+_assembler_version: str | None = None
+
+
+def assembler_version() -> str:
+    # Hash of the assembler's own source, so any change to it invalidates cached results
+    global _assembler_version
+    if _assembler_version is None:
+        digest = hashlib.sha256()
+        for module in sorted(Path(__file__).parent.glob("*.py")):
+            digest.update(module.name.encode("utf-8"))
+            digest.update(module.read_bytes())
+        _assembler_version = digest.hexdigest()
+
+    return _assembler_version
+
+
+def cache_path(source: Path) -> Path:
+    return source.parent / IMAGE_DIRECTORY / f"{source.name}.cache.json"
+
+
+def cache_key(source_text: bytes, optimize: bool, inline_budget: int | None = None) -> str:
+    digest = hashlib.sha256(assembler_version().encode("utf-8"))
+    digest.update(f"optimize {inline_budget}".encode("utf-8") if optimize else b"plain")
+    digest.update(source_text)
+    return digest.hexdigest()
+
+
+def load_entry(source: Path, key: str) -> dict | None:
+    path = cache_path(source)
+    if not path.exists():
+        return None
+
+    try:
+        with open(path, "r") as f:
+            entry = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+    return entry if isinstance(entry, dict) and entry.get("key") == key else None
+
+
+def save_entry(source: Path, entry: dict) -> None:
+    path = cache_path(source)
+    path.parent.mkdir(exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(entry, f)
+
+
+def program_from_entry(lines: list[str], entry: dict) -> AssembledProgram:
+    optimization = None if entry["optimization"] is None else OptimizationReport.from_dict(entry["optimization"])
+    processed_lines = [(line_no, content) for line_no, content in entry["processed_lines"]]
+    return AssembledProgram(lines, processed_lines, entry["labels"], entry["machine_code"], optimization)
+
+
+def assemble_cached(file: Path, optimize: bool = False, inline_budget: int | None = None) -> tuple[AssembledProgram, dict]:
+    # Returns the program and its cache entry, which also holds the full blueprint once it has been generated
+    if not file.exists():
+        return assemble_program(file, optimize, inline_budget), {}
+
+    with open(file, "r") as f:
+        lines = f.readlines()
+    key = cache_key("".join(lines).encode("utf-8"), optimize, inline_budget)
+
+    entry = load_entry(file, key)
+    if entry is not None:
+        return program_from_entry(lines, entry), entry
+
+    program = assemble_program(file, optimize, inline_budget)
+    entry = {
+        "key": key,
+        "processed_lines": program.processed_lines,
+        "labels": program.labels,
+        "machine_code": program.machine_code,
+        "optimization": None if program.optimization is None else program.optimization.to_dict(),
+        "blueprint": None,
+    }
+    return program, entry
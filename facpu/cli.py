@@ -1,27 +1,60 @@
-from argparse import ArgumentParser
+import sys
+import time
+from argparse import ArgumentParser, Namespace
 from pathlib import Path
 
 import pyperclip
 from colored import Fore, Style
 
-from .assembler import assemble
+from .assembler import AssembledProgram, assemble_program
+from .cache import assemble_cached, save_entry
 from .factorio import generate_flasher_blueprint
+from .flashing import FlashSession
+from .hardware_definition import INSTRUCTION_TICKS
+from .image import symbols_path, write_image
+from .incremental import IncrementalAssembler
+from .optimizer import INLINE_BUDGET
+from .timing import calibration_note, format_cost_report, load_calibration
 
 
-def main():
-    parser = ArgumentParser(description="facPU assembler")
-    parser.add_argument("filename", type=str, help="Input assembly file")
+WATCH_INTERVAL = 0.2
 
-    args = parser.parse_args()
 
-    fpu_file = Path(args.filename)
-    try:
-        machine_code = assemble(fpu_file)
-    except Exception as e:
-        print(e)
+def add_output_format(parser: ArgumentParser) -> None:
+    formats = parser.add_mutually_exclusive_group()
+    formats.add_argument("--image", dest="format", action="store_const", const="json", default="blueprint", help="Write the machine code as a JSON image rather than a blueprint")
+    formats.add_argument("--bin", dest="format", action="store_const", const="bin", help="Write the machine code as a packed little-endian 32-bit image, with a .sym.json symbol table")
+
+
+def flash_program(fpu_file: Path, program: AssembledProgram, args: Namespace, ticks: dict[str, int], entry: dict, session: FlashSession) -> None:
+    machine_code = program.machine_code
+    if program.optimization is not None:
+        print(program.optimization.format_report())
+    print(format_cost_report(program, ticks, details=args.cost))
+
+    if args.bin:
+        image = fpu_file.with_suffix(".bin")
+        write_image(image, machine_code, program.labels)
+        print(f"{Fore.green}Image written to {Style.underline}{image}{Style.res_underline} with symbols in {Style.underline}{symbols_path(image)}{Style.res_underline}{Style.reset}")
+
+    addresses = session.addresses(machine_code)
+    if addresses == []:
+        print(f"{Fore.green}All {len(machine_code)} words are unchanged since the last flash, nothing to flash{Style.reset}")
         return
 
-    factorio_blueprint = generate_flasher_blueprint(machine_code, label=fpu_file.name)
+    if addresses is None and not args.validate and entry.get("blueprint") is not None:
+        factorio_blueprint = entry["blueprint"]
+    else:
+        factorio_blueprint = generate_flasher_blueprint(machine_code, label=fpu_file.name, validate=args.validate, addresses=addresses)
+        if addresses is None and not args.validate:
+            entry["blueprint"] = factorio_blueprint
+    session.flashed(machine_code)
+
+    if addresses is None:
+        print(f"{Fore.green}Flashing all {len(machine_code)} words{Style.reset}")
+    else:
+        print(f"{Fore.green}Flashing {len(addresses)} of {len(machine_code)} words, {len(machine_code) - len(addresses)} unchanged words skipped (use --full to flash every word){Style.reset}")
+
     pyperclip.copy(factorio_blueprint)
     print(
         f"{Fore.green}Factorio blueprint generated{Style.reset}\n"
@@ -30,5 +63,425 @@ def main():
     )
 
 
+def watch(fpu_file: Path, args: Namespace, ticks: dict[str, int]) -> int:
+    assembler = IncrementalAssembler(optimize=args.optimize, inline_budget=args.inline)
+    session = FlashSession(fpu_file, args.full)
+    last_modified = None
+    print(f"{Fore.cyan}Watching {Style.underline}{fpu_file}{Style.res_underline} for changes, press Ctrl+C to stop{Style.reset}")
+
+    try:
+        while True:
+            modified = fpu_file.stat().st_mtime_ns if fpu_file.exists() else None
+            if modified is not None and modified != last_modified:
+                last_modified = modified
+                with open(fpu_file, "r") as f:
+                    lines = f.readlines()
+
+                start = time.perf_counter()
+                try:
+                    program = assembler.update(lines)
+                except Exception as e:
+                    print(e)
+                    continue
+                elapsed = (time.perf_counter() - start) * 1000
+
+                print(f"{Fore.green}Reassembled in {elapsed:.1f}ms ({assembler.preprocessed} lines preprocessed, {assembler.encoded} words encoded){Style.reset}")
+                flash_program(fpu_file, program, args, ticks, {}, session)
+
+            time.sleep(WATCH_INTERVAL)
+    except KeyboardInterrupt:
+        return 0
+
+
+def assemble_main(argv: list[str]) -> int:
+    parser = ArgumentParser(description="facPU assembler")
+    parser.add_argument("filename", type=str, help="Input assembly file")
+    parser.add_argument("-O", "--optimize", action="store_true", help="Run peephole optimizations and print a report")
+    parser.add_argument("--inline", type=int, metavar="N", help=f"With -O, inline leaf subroutines of up to N instructions (default {INLINE_BUDGET})")
+    parser.add_argument("--cost", action="store_true", help="Print estimated ticks for each label and loop body")
+    parser.add_argument("--timing", type=str, help="JSON file of measured instruction timings to calibrate the cost model")
+    parser.add_argument("--validate", action="store_true", help="Build the blueprint with draftsman, validating every entity (slower)")
+    parser.add_argument("--full", action="store_true", help="Flash every word, rather than only those changed since the last flash")
+    parser.add_argument("--watch", action="store_true", help="Reassemble and copy the blueprint again every time the file is saved")
+    parser.add_argument("--bin", action="store_true", help="Also write the machine code beside the source as a packed .bin image with a symbol table")
+
+    args = parser.parse_args(argv)
+
+    fpu_file = Path(args.filename)
+    try:
+        ticks = load_calibration(Path(args.timing)) if args.timing else INSTRUCTION_TICKS
+        if args.watch:
+            if not fpu_file.exists():
+                raise Exception(f"{Fore.red}File {Style.underline}{fpu_file}{Style.res_underline} cannot be found{Style.reset}")
+            return watch(fpu_file, args, ticks)
+
+        program, entry = assemble_cached(fpu_file, optimize=args.optimize, inline_budget=args.inline)
+    except Exception as e:
+        print(e)
+        return 1
+
+    flash_program(fpu_file, program, args, ticks, entry, FlashSession(fpu_file, args.full))
+    save_entry(fpu_file, entry)
+
+    return 0
+
+
+def analyze_main(argv: list[str]) -> int:
+    from .analyzer import Analyzer, format_analysis
+
+    parser = ArgumentParser(prog="facpu analyze", description="Static worst-case analysis of the time between GSWP instructions")
+    parser.add_argument("filename", type=str, help="Input assembly file")
+    parser.add_argument("-O", "--optimize", action="store_true", help="Analyze the optimized program")
+    parser.add_argument("--timing", type=str, help="JSON file of measured instruction timings to calibrate the cost model")
+    parser.add_argument("--budget", type=int, help="Fail if the worst-case frame exceeds this many ticks")
+    parser.add_argument("--instructions", action="store_true", help="Measure the budget in instructions rather than ticks")
+    parser.add_argument("--allow-unbounded", action="store_true", help="Do not fail the budget because of unbounded loops")
+    parser.add_argument("-v", "--verbose", action="store_true", help="List every instruction on the worst-case path")
+
+    args = parser.parse_args(argv)
+
+    try:
+        program = assemble_program(Path(args.filename), optimize=args.optimize)
+        ticks = load_calibration(Path(args.timing)) if args.timing else INSTRUCTION_TICKS
+    except Exception as e:
+        print(e)
+        return 1
+
+    analyzer = Analyzer(program, ticks)
+    frames = analyzer.analyze_frames()
+    print(format_analysis(program, frames, analyzer.warnings, verbose=args.verbose) + calibration_note(ticks))
+
+    if args.budget is None:
+        return 0
+
+    measured = [frame.summary.worst_instructions if args.instructions else frame.summary.worst for frame in frames if frame.summary is not None]
+    worst = max(measured, default=0)
+    unbounded = not args.allow_unbounded and any(frame.unbounded_loops for frame in frames)
+    unit = "instructions" if args.instructions else "ticks"
+
+    if worst > args.budget or unbounded:
+        reason = "contains unbounded loops" if worst <= args.budget else f"takes {worst} {unit}"
+        print(f"{Fore.red}Frame budget of {args.budget} {unit} exceeded, worst-case frame {reason}{Style.reset}")
+        return 1
+
+    print(f"{Fore.green}Worst-case frame of {worst} {unit} is within the budget of {args.budget} {unit}{Style.reset}")
+    return 0
+
+
+def build_main(argv: list[str]) -> int:
+    from .build import build, find_sources, format_build_summary
+
+    parser = ArgumentParser(prog="facpu build", description="Assemble every program in a directory or glob in parallel")
+    parser.add_argument("pattern", type=str, help="Directory of .fpu files, or a glob such as 'roms/**/*.fpu'")
+    parser.add_argument("-o", "--output", type=str, help="Directory to write outputs to (defaults to beside each source)")
+    parser.add_argument("-O", "--optimize", action="store_true", help="Run peephole optimizations on every program")
+    add_output_format(parser)
+    parser.add_argument("-j", "--jobs", type=int, help="Number of worker processes (defaults to the number of CPUs)")
+
+    args = parser.parse_args(argv)
+
+    sources = find_sources(args.pattern)
+    if not sources:
+        print(f"{Fore.red}No .fpu files match {Style.underline}{args.pattern}{Style.res_underline}{Style.reset}")
+        return 1
+
+    start = time.perf_counter()
+    results = build(sources, Path(args.output) if args.output else None, optimize=args.optimize, output_format=args.format, jobs=args.jobs)
+    print(format_build_summary(results, time.perf_counter() - start))
+
+    return 1 if any(result.error is not None for result in results) else 0
+
+
+def link_main(argv: list[str]) -> int:
+    from .build import output_path, write_output
+    from .linker import format_link_summary, link, load_object
+
+    parser = ArgumentParser(prog="facpu link", description="Assemble each file to a cached object and link them into one program")
+    parser.add_argument("filenames", type=str, nargs="+", help="The program, followed by the library files it uses")
+    parser.add_argument("-o", "--output", type=str, help="File to write to (defaults to beside the program)")
+    add_output_format(parser)
+    parser.add_argument("--keep-unused", action="store_true", help="Keep library routines the program never references")
+
+    args = parser.parse_args(argv)
+
+    sources = [Path(filename) for filename in args.filenames]
+    try:
+        program = link([load_object(source) for source in sources], keep_unused=args.keep_unused)
+    except Exception as e:
+        print(e)
+        return 1
+
+    output = Path(args.output) if args.output else output_path(sources[0], None, args.format)
+    write_output(output, program.machine_code, sources[0].name, args.format, program.symbols)
+
+    print(format_link_summary(program))
+    print(f"{Fore.green}Written to {Style.underline}{output}{Style.res_underline}{Style.reset}")
+    return 0
+
+
+def disasm_main(argv: list[str]) -> int:
+    from .disasm import disassemble
+    from .image import load_image, load_symbols
+
+    parser = ArgumentParser(prog="facpu disasm", description="Decode a machine code image back to assembly which assembles to the same words")
+    parser.add_argument("filename", type=str, help="A .bin image, or a JSON image")
+    parser.add_argument("--symbols", type=str, help="Symbol table to name addresses with (defaults to the image's .sym.json, if present)")
+    parser.add_argument("--no-symbols", action="store_true", help="Write every address as a number")
+
+    args = parser.parse_args(argv)
+
+    image = Path(args.filename)
+    try:
+        machine_code = load_image(image)
+        symbols = {} if args.no_symbols else load_symbols(Path(args.symbols) if args.symbols else symbols_path(image))
+    except Exception as e:
+        print(e)
+        return 1
+
+    print(disassemble(machine_code, symbols), end="")
+    return 0
+
+
+def serve_main(argv: list[str]) -> int:
+    from .client import request, socket_path
+    from .server import serve
+
+    parser = ArgumentParser(prog="facpu serve", description="Keep an assembler loaded and run facpu commands sent to it over a Unix socket")
+    parser.add_argument("--socket", type=str, help="Socket to listen on (defaults to $FACPU_SOCKET, $XDG_RUNTIME_DIR/facpu.sock, or facpu-<user>.sock in the temporary directory)")
+    parser.add_argument("--stop", action="store_true", help="Stop the running server")
+    parser.add_argument("--status", action="store_true", help="Report whether a server is running")
+
+    args = parser.parse_args(argv)
+
+    path = Path(args.socket) if args.socket else socket_path()
+    if args.stop or args.status:
+        try:
+            reply = request({"command": "stop" if args.stop else "ping"}, path)
+        except PermissionError as e:
+            print(f"{Fore.red}{e}{Style.reset}")
+            return 1
+        except OSError:
+            print(f"{Fore.yellow}No server is listening on {Style.underline}{path}{Style.res_underline}{Style.reset}")
+            return 1
+
+        print(f"{Fore.green}Server stopped{Style.reset}" if args.stop else f"{Fore.green}Server {reply['pid']} is listening on {Style.underline}{path}{Style.res_underline}, {reply['requests']} requests handled{Style.reset}")
+        return 0
+
+    try:
+        serve(path)
+    except Exception as e:
+        print(e)
+        return 1
+
+    return 0
+
+
+def profile_main(argv: list[str]) -> int:
+    from .profiler import format_callgraph, format_flat, format_listing, format_summary, profile_program
+
+    parser = ArgumentParser(prog="facpu profile", description="Run a program in the emulator and report where its cycles go")
+    parser.add_argument("filename", type=str, help="Input assembly file")
+    parser.add_argument("-O", "--optimize", action="store_true", help="Profile the optimized program")
+    parser.add_argument("--timing", type=str, help="JSON file of measured instruction timings to calibrate the cost model")
+    parser.add_argument("--cycles", type=int, default=1_000_000, help="Stop after this many instructions if the program has not halted")
+    parser.add_argument("--keys", type=str, default="", help="Comma separated key codes queued on the keyboard before running")
+    parser.add_argument("--report", choices=["flat", "callgraph"], default="flat", help="Report hotspots by label, or by called function")
+    parser.add_argument("--listing", action="store_true", help="Also print the source annotated with counts and ticks")
+    parser.add_argument("--top", type=int, default=20, help="Number of entries in each report")
+
+    args = parser.parse_args(argv)
+
+    try:
+        program = assemble_program(Path(args.filename), optimize=args.optimize)
+        ticks = load_calibration(Path(args.timing)) if args.timing else INSTRUCTION_TICKS
+        keys = [int(key, 0) for key in args.keys.split(",") if key.strip()]
+    except Exception as e:
+        print(e)
+        return 1
+
+    profile = profile_program(program.machine_code, ticks, args.cycles, keyboard=keys)
+    print(format_summary(profile, args.cycles) + calibration_note(ticks))
+    if args.listing:
+        print(format_listing(program, profile))
+    print(format_callgraph(program, profile, args.top) if args.report == "callgraph" else format_flat(program, profile, args.top))
+
+    return 1 if profile.error is not None else 0
+
+
+def render_main(argv: list[str]) -> int:
+    from .render import export_gif, export_png_sequence, render
+
+    parser = ArgumentParser(prog="facpu render", description="Run a program with a headless display and export the frames it draws")
+    parser.add_argument("filename", type=str, help="Input assembly file")
+    parser.add_argument("-O", "--optimize", action="store_true", help="Render the optimized program")
+    parser.add_argument("--cycles", type=int, default=1_000_000, help="Stop after this many instructions if the program has not halted")
+    parser.add_argument("--frames", type=int, help="Stop after this many frames")
+    parser.add_argument("--keys", type=str, default="", help="Comma separated key codes queued on the keyboard before running")
+    parser.add_argument("--keep", type=int, default=1024, help="Number of most recent frames kept for export")
+    parser.add_argument("--png", type=str, help="Directory to write the kept frames to as a PNG sequence")
+    parser.add_argument("--gif", type=str, help="File to write the kept frames to as an animated GIF (needs Pillow)")
+    parser.add_argument("--scale", type=int, default=16, help="Size of each display pixel in exported images")
+    parser.add_argument("--fps", type=float, default=14, help="Frame rate of exported GIFs")
+    parser.add_argument("--hashes", type=str, help="File to write the hash of every frame to, one per line")
+    parser.add_argument("--check", type=str, help="File of expected frame hashes, fail on the first frame that differs")
+
+    args = parser.parse_args(argv)
+
+    try:
+        program = assemble_program(Path(args.filename), optimize=args.optimize)
+        keys = [int(key, 0) for key in args.keys.split(",") if key.strip()]
+        expected = Path(args.check).read_text().split() if args.check else None
+    except Exception as e:
+        print(e)
+        return 1
+
+    result = render(program.machine_code, args.cycles, args.frames, keyboard=keys, capacity=args.keep)
+    hashes = result.display.hashes
+    ended = "halted" if result.halted else f"stopped after {result.instructions} instructions"
+    print(f"{Fore.green}Rendered {len(hashes)} frames in {result.instructions} instructions ({ended}), checksum {result.checksum}{Style.reset}")
+    if result.error is not None:
+        print(f"{Fore.red}{result.error}{Style.reset}")
+
+    frames = result.display.recorded_frames()
+    try:
+        if args.png:
+            paths = export_png_sequence(frames, Path(args.png), args.scale)
+            print(f"{Fore.green}Wrote {len(paths)} frames to {Style.underline}{args.png}{Style.res_underline}{Style.reset}")
+        if args.gif and frames:
+            export_gif(frames, Path(args.gif), args.scale, args.fps)
+            print(f"{Fore.green}Wrote {len(frames)} frames to {Style.underline}{args.gif}{Style.res_underline}{Style.reset}")
+    except ImportError as e:
+        print(f"{Fore.red}{e}{Style.reset}")
+        return 1
+
+    if args.hashes:
+        Path(args.hashes).write_text("".join(f"{frame_hash}\n" for frame_hash in hashes))
+
+    if expected is not None:
+        mismatch = next((i for i, (actual, wanted) in enumerate(zip(hashes, expected)) if actual != wanted), None)
+        if mismatch is None and len(hashes) != len(expected):
+            print(f"{Fore.red}Rendered {len(hashes)} frames but {len(expected)} were expected{Style.reset}")
+            return 1
+        if mismatch is not None:
+            print(f"{Fore.red}Frame {mismatch} differs from the expected frame{Style.reset}")
+            return 1
+        print(f"{Fore.green}All {len(hashes)} frames match{Style.reset}")
+
+    return 1 if result.error is not None else 0
+
+
+def record_main(argv: list[str]) -> int:
+    from .trace import record, save_trace
+
+    parser = ArgumentParser(prog="facpu record", description="Run a program in the terminal and record the keys pressed as an input trace")
+    parser.add_argument("filename", type=str, help="Input assembly file")
+    parser.add_argument("-o", "--output", type=str, help="File to write the trace to (defaults to <filename>.trace)")
+    parser.add_argument("-O", "--optimize", action="store_true", help="Record with the optimized program")
+    parser.add_argument("--ips", type=float, default=20_000, help="Instructions run per second while recording")
+    parser.add_argument("--cycles", type=int, help="Stop recording after this many instructions")
+
+    args = parser.parse_args(argv)
+
+    fpu_file = Path(args.filename)
+    output = Path(args.output) if args.output else fpu_file.with_suffix(".trace")
+    try:
+        program = assemble_program(fpu_file, optimize=args.optimize)
+        events = record(program.machine_code, args.ips, args.cycles)
+    except Exception as e:
+        print(e)
+        return 1
+
+    save_trace(output, events)
+    print(f"{Fore.green}Recorded {len(events)} key presses to {Style.underline}{output}{Style.res_underline}{Style.reset}")
+    return 0
+
+
+def replay_main(argv: list[str]) -> int:
+    import json
+    import random
+
+    from .trace import format_replay_summary, load_trace, random_trace, replay_many, save_trace, worst_trace
+
+    parser = ArgumentParser(prog="facpu replay", description="Replay input traces against a program headlessly, reporting the instructions and ticks of every frame")
+    parser.add_argument("filename", type=str, help="Input assembly file")
+    parser.add_argument("traces", type=str, nargs="*", help="Trace files recorded with facpu record")
+    parser.add_argument("-O", "--optimize", action="store_true", help="Replay against the optimized program")
+    parser.add_argument("--random", type=int, default=0, help="Also replay this many randomly generated traces")
+    parser.add_argument("--seed", type=int, default=0, help="Seed for the random traces, so runs can be repeated")
+    parser.add_argument("--keys", type=str, default="128,129,130,131", help="Comma separated key codes the random traces press")
+    parser.add_argument("--interval", type=int, default=500, help="Average instructions between key presses in the random traces")
+    parser.add_argument("--cycles", type=int, default=1_000_000, help="Stop each trace after this many instructions if the program has not halted")
+    parser.add_argument("--frames", type=int, help="Stop each trace after this many frames")
+    parser.add_argument("--timing", type=str, help="JSON file of measured instruction timings to calibrate the cost model")
+    parser.add_argument("-j", "--jobs", type=int, help="Number of worker processes (defaults to the number of CPUs, 1 replays in this process)")
+    parser.add_argument("--budget", type=int, help="Fail if any frame takes more than this many ticks")
+    parser.add_argument("--save-worst", type=str, help="File to write the trace with the slowest frame to")
+    parser.add_argument("--json", type=str, help="File to write the frames of every trace to as JSON")
+
+    args = parser.parse_args(argv)
+
+    if not args.traces and args.random <= 0:
+        print(f"{Fore.red}Give trace files to replay, or --random to generate them{Style.reset}")
+        return 1
+
+    try:
+        program = assemble_program(Path(args.filename), optimize=args.optimize)
+        ticks = load_calibration(Path(args.timing)) if args.timing else INSTRUCTION_TICKS
+        keys = [int(key, 0) for key in args.keys.split(",") if key.strip()]
+        names = list(args.traces)
+        traces = [load_trace(Path(trace)) for trace in args.traces]
+    except Exception as e:
+        print(e)
+        return 1
+
+    rng = random.Random(args.seed)
+    for i in range(args.random):
+        names.append(f"random {i} (seed {args.seed})")
+        traces.append(random_trace(rng, keys, args.interval, args.cycles))
+
+    start = time.perf_counter()
+    results = replay_many(program.machine_code, traces, args.cycles, args.frames, ticks, args.jobs)
+    print(format_replay_summary(names, results, time.perf_counter() - start))
+    print(calibration_note(ticks), end="")
+
+    worst = worst_trace(results)
+    if args.save_worst and worst is not None:
+        save_trace(Path(args.save_worst), traces[worst])
+        print(f"{Fore.green}Wrote {Style.underline}{names[worst]}{Style.res_underline} to {Style.underline}{args.save_worst}{Style.res_underline}{Style.reset}")
+
+    if args.json:
+        report = [{"trace": name, "instructions": result.instructions, "ticks": result.ticks, "halted": result.halted, "error": result.error, "frames": result.frames} for name, result in zip(names, results)]
+        Path(args.json).write_text(json.dumps(report) + "\n")
+
+    if args.budget is not None and worst is not None:
+        over = sum(frame_ticks > args.budget for result in results for _, frame_ticks in result.frames)
+        if over:
+            print(f"{Fore.red}{over} frames took more than {args.budget} ticks{Style.reset}")
+            return 1
+
+    return 1 if any(result.error is not None for result in results) else 0
+
+
+COMMANDS = {
+    "analyze": analyze_main,
+    "build": build_main,
+    "disasm": disasm_main,
+    "link": link_main,
+    "profile": profile_main,
+    "record": record_main,
+    "render": render_main,
+    "replay": replay_main,
+    "serve": serve_main,
+}
+
+
+def main(argv: list[str] | None = None) -> int:
+    argv = sys.argv[1:] if argv is None else argv
+    if argv and argv[0] in COMMANDS:
+        return COMMANDS[argv[0]](argv[1:])
+
+    return assemble_main(argv)
+
+
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,84 @@
+import getpass
+import json
+import os
+import socket
+import stat
+import sys
+import tempfile
+from pathlib import Path
+
+# Only the standard library is imported here, so forwarding to a running server starts as fast as Python can
+
+SOCKET_VARIABLE = "FACPU_SOCKET"
+# Set to run every command in its own process, even when a server is running
+NO_SERVER_VARIABLE = "FACPU_NO_SERVER"
+# Commands and flags which are always run in their own process, as they keep running or read from the terminal
+LOCAL_COMMANDS = {"serve", "record"}
+LOCAL_FLAGS = {"--watch"}
+
+
+def socket_path() -> Path:
+    # The runtime directory is private to the user, the temporary directory is shared so the socket there is checked before use
+    if SOCKET_VARIABLE in os.environ:
+        return Path(os.environ[SOCKET_VARIABLE])
+    if os.environ.get("XDG_RUNTIME_DIR"):
+        return Path(os.environ["XDG_RUNTIME_DIR"]) / "facpu.sock"
+    return Path(tempfile.gettempdir()) / f"facpu-{getpass.getuser()}.sock"
+
+
+def check_owner(path: Path) -> None:
+    # Another user could listen on the socket and read every command and file sent to it
+    info = os.stat(path)
+    if not stat.S_ISSOCK(info.st_mode) or info.st_uid != os.getuid():
+        raise PermissionError(f"{path} is not a socket owned by this user")
+
+
+def request(message: dict, path: Path | None = None) -> dict:
+    # Sends one JSON line and waits for the reply, raises OSError when no server is listening or the socket is not this user's
+    path = socket_path() if path is None else path
+    check_owner(path)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(str(path))
+        connection.sendall(json.dumps(message).encode("utf-8") + b"\n")
+        with connection.makefile("rb") as f:
+            reply = f.readline()
+
+    if not reply:
+        raise ConnectionError("The server closed the connection without replying")
+    return json.loads(reply)
+
+
+def forward(argv: list[str]) -> int | None:
+    # Runs the command in the server if one is running, None when it has to be run here
+    if os.environ.get(NO_SERVER_VARIABLE) or not hasattr(socket, "AF_UNIX"):
+        return None
+    if (argv and argv[0] in LOCAL_COMMANDS) or not LOCAL_FLAGS.isdisjoint(argv):
+        return None
+
+    try:
+        reply = request({"command": "run", "argv": argv, "cwd": os.getcwd()})
+    except PermissionError as e:
+        sys.stderr.write(f"Not using the server: {e}\n")
+        return None
+    except (OSError, ValueError):
+        return None
+    if not reply.get("ok"):
+        return None
+
+    sys.stdout.write(reply["output"])
+    return reply["exit"]
+
+
+def main() -> int:
+    argv = sys.argv[1:]
+    code = forward(argv)
+    if code is not None:
+        return code
+
+    from .cli import main as cli_main
+
+    return cli_main()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
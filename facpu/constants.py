@@ -0,0 +1,265 @@
+from bisect import bisect_left, bisect_right
+from functools import cache
+
+from colored import Style
+
+from .assembler import AssemblyError, split_line
+from .assembler_instructions import (ASSEMBLER_PSEUDO_INSTRUCTIONS,
+                                     ExpandingPseudoInstruction,
+                                     parse_constant)
+from .emulator import ALU_OPERATIONS
+from .hardware_definition import (DEFAULT_INSTRUCTION_TICKS, INSTRUCTION_SIZE,
+                                  INSTRUCTION_TICKS, PARAM_SIZE)
+from .program import Instruction, from_instructions, to_instructions
+
+MAX_WORD = (1 << INSTRUCTION_SIZE) - 1
+MAX_IMMEDIATE = (1 << PARAM_SIZE["imm10"]) - 1
+# Every 31-bit value can be built by LI, then SHL and OR ten bits at a time
+MAX_SEQUENCE = 7
+# A constant is only read from the pool when this many LIW load it
+POOL_MIN_USES = 2
+
+EXPANDING_INSTRUCTIONS = {name for name, info in ASSEMBLER_PSEUDO_INSTRUCTIONS.items() if isinstance(info, ExpandingPseudoInstruction)}
+
+# An instruction applied to the register being loaded, with its immediate (None for register operands)
+Step = tuple[str, int | None]
+# Inclusive range of values, sets of values are kept as sorted lists of disjoint ranges
+Interval = tuple[int, int]
+
+# Scaling by an immediate, in increasing order of factor. Powers of two are shifts, which reach up to bit 30.
+FACTORS: list[tuple[int, Step]] = sorted(
+    [(factor, ("MUL/I", factor)) for factor in range(3, MAX_IMMEDIATE + 1) if factor & (factor - 1)]
+    + [(1 << shift, ("SHL/I", shift)) for shift in range(1, INSTRUCTION_SIZE)]
+)
+# Shifts are tried first when building a sequence, so `LIW R1 5000` reads as `LI R1 625`, `SHL R1 R1 3`
+PREFERRED_FACTORS = sorted(FACTORS, key=lambda factor: factor[1][0] != "SHL/I")
+POWERS = range(2, INSTRUCTION_SIZE)
+
+
+def power_step(power: int) -> Step:
+    return ("MUL/R", None) if power == 2 else ("POW/I", power)
+
+
+def integer_root(value: int, power: int) -> int:
+    root = round(value ** (1 / power))
+    while root**power > value:
+        root -= 1
+    while (root + 1) ** power <= value:
+        root += 1
+    return root
+
+
+def merge_intervals(intervals: list[Interval]) -> list[Interval]:
+    merged: list[Interval] = []
+    for low, high in sorted(intervals):
+        if merged and low <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(high, merged[-1][1]))
+        else:
+            merged.append((low, high))
+    return merged
+
+
+def contains(intervals: list[Interval], value: int) -> bool:
+    i = bisect_right(intervals, (value, MAX_WORD + 1)) - 1
+    return i >= 0 and intervals[i][1] >= value
+
+
+def preimages(intervals: list[Interval]) -> list[Interval]:
+    # Every value one instruction away from a value in `intervals`.
+    # ADD and SUB reach anything within an immediate of a value, which covers every OR and XOR with an immediate too.
+    # Values stay within 0..MAX_WORD, so no sequence relies on overflow.
+    found: list[Interval] = []
+    for low, high in intervals:
+        found.append((max(low - MAX_IMMEDIATE, 0), min(high + MAX_IMMEDIATE, MAX_WORD)))
+
+        for factor, _ in FACTORS:
+            first, last = -(-low // factor), high // factor
+            if last == 0:
+                break
+            if first <= last:
+                found.append((first, last))
+
+        for power in POWERS:
+            last = integer_root(high, power)
+            if last < 2:
+                break
+            first = integer_root(low - 1, power) + 1 if low else 0
+            if first <= last:
+                found.append((first, last))
+
+    return merge_intervals(found)
+
+
+@cache
+def two_instruction_values() -> list[int]:
+    # Every value loaded by LI and at most one more instruction, sorted
+    found = set(range(2 * MAX_IMMEDIATE + 1))
+    for factor, _ in FACTORS:
+        found.update(range(0, min(MAX_IMMEDIATE * factor, MAX_WORD) + 1, factor))
+    for value in range(2, MAX_IMMEDIATE + 1):
+        for power in POWERS:
+            if value**power > MAX_WORD:
+                break
+            found.add(value**power)
+    return sorted(found)
+
+
+def first_loadable(intervals: list[Interval]) -> int | None:
+    # Smallest value in `intervals` which takes at most two instructions to load
+    loadable = two_instruction_values()
+    for low, high in intervals:
+        i = bisect_left(loadable, low)
+        if i < len(loadable) and loadable[i] <= high:
+            return loadable[i]
+    return None
+
+
+def two_instruction_sequence(value: int) -> tuple[Step, ...]:
+    if value <= MAX_IMMEDIATE:
+        return (("LI", value),)
+
+    for factor, step in PREFERRED_FACTORS:
+        if value % factor == 0 and value // factor <= MAX_IMMEDIATE:
+            return (("LI", value // factor), step)
+    if value - MAX_IMMEDIATE <= MAX_IMMEDIATE:
+        return (("LI", MAX_IMMEDIATE), ("ADD/I", value - MAX_IMMEDIATE))
+    for power in POWERS:
+        root = integer_root(value, power)
+        if root**power == value and root <= MAX_IMMEDIATE:
+            return (("LI", root), power_step(power))
+
+    raise ValueError(f"{value} cannot be loaded in two instructions")
+
+
+def step_into(value: int, intervals: list[Interval]) -> tuple[int, Step]:
+    # An instruction taking `value` to a value in `intervals`, and the value it gives
+    for factor, step in PREFERRED_FACTORS:
+        if value * factor <= MAX_WORD and contains(intervals, value * factor):
+            return value * factor, step
+
+    i = bisect_right(intervals, (value, MAX_WORD + 1))
+    if i < len(intervals) and intervals[i][0] - value <= MAX_IMMEDIATE:
+        immediate = intervals[i][0] - value
+        return value + immediate, ("OR/I" if value & immediate == 0 else "ADD/I", immediate)
+    if i > 0 and value - intervals[i - 1][1] <= MAX_IMMEDIATE:
+        return intervals[i - 1][1], ("SUB/I", value - intervals[i - 1][1])
+
+    for power in POWERS:
+        if value**power > MAX_WORD:
+            break
+        if contains(intervals, value**power):
+            return value**power, power_step(power)
+
+    raise ValueError(f"No instruction takes {value} into the given values")
+
+
+@cache
+def shortest_sequence(value: int) -> tuple[Step, ...]:
+    # Works back from `value` one instruction at a time, keeping every value that can reach it as a set of ranges,
+    # until the set holds a value loadable in two instructions. Each set is searched fully, so the sequence is a shortest one.
+    layers = [[(value, value)]]
+    start = first_loadable(layers[-1])
+    while start is None:
+        if len(layers) + 2 > MAX_SEQUENCE:
+            raise ValueError(f"No sequence of {MAX_SEQUENCE} instructions loads {value}")
+        layers.append(preimages(layers[-1]))
+        start = first_loadable(layers[-1])
+
+    sequence = list(two_instruction_sequence(start))
+    current = start
+    for intervals in reversed(layers[:-1]):
+        current, step = step_into(current, intervals)
+        sequence.append(step)
+
+    return tuple(sequence)
+
+
+def run_sequence(sequence: tuple[Step, ...]) -> int:
+    value = 0
+    for instr, immediate in sequence:
+        if instr == "LI":
+            value = immediate
+        else:
+            value = ALU_OPERATIONS[instr.split("/")[0]](value, value if immediate is None else immediate)
+    return value
+
+
+def sequence_lines(register: str, value: int) -> list[str]:
+    lines: list[str] = []
+    for instr, immediate in shortest_sequence(value):
+        if instr == "LI":
+            lines.append(f"LI {register} {immediate}")
+        elif immediate is None:
+            lines.append(f"{instr} {register} {register} {register}")
+        else:
+            lines.append(f"{instr} {register} {register} {immediate}")
+    return lines
+
+
+def needs_expansion(processed_lines: list[tuple[int, str]]) -> bool:
+    return any(content.split(" ", 1)[0].upper() in EXPANDING_INSTRUCTIONS for _, content in processed_lines)
+
+
+def pooled_constants(instructions: list[Instruction], ticks: dict[str, int]) -> set[int]:
+    # Constants read from the pool: those loaded by several LIW, where a LD costs fewer ticks than building the value
+    # and the pool (one LD per use plus the shared DAT word) takes no more words than building it at every use
+    uses: dict[int, int] = {}
+    for instruction in instructions:
+        if instruction.instr == "LIW" and len(instruction.params) == 2:
+            value = parse_constant(instruction.params[1], instruction.line_no)
+            uses[value] = uses.get(value, 0) + 1
+
+    pooled: set[int] = set()
+    load_ticks = ticks.get("LD", DEFAULT_INSTRUCTION_TICKS)
+    for value, count in uses.items():
+        if count < POOL_MIN_USES or value <= MAX_IMMEDIATE:
+            continue
+        sequence = shortest_sequence(value)
+        sequence_ticks = sum(ticks.get(instr, DEFAULT_INSTRUCTION_TICKS) for instr, _ in sequence)
+        if load_ticks < sequence_ticks and count + 1 <= count * len(sequence):
+            pooled.add(value)
+
+    return pooled
+
+
+def expand_pseudo_instructions(processed_lines: list[tuple[int, str]], labels: dict[str, int], ticks: dict[str, int] = INSTRUCTION_TICKS) -> tuple[list[tuple[int, str]], dict[str, int]]:
+    # Replace pseudo-instructions which stand for several instructions, moving every later label
+    if not needs_expansion(processed_lines):
+        return processed_lines, labels
+
+    instructions, trailing_labels = to_instructions(processed_lines, labels)
+    pooled = pooled_constants(instructions, ticks)
+    pool: dict[int, str] = {}
+    expanded: list[Instruction] = []
+
+    for instruction in instructions:
+        info = ASSEMBLER_PSEUDO_INSTRUCTIONS.get(instruction.instr)
+        if not isinstance(info, ExpandingPseudoInstruction):
+            expanded.append(instruction)
+            continue
+
+        expected_params = info.get_expected_parameters()
+        if expected_params != len(instruction.params):
+            raise AssemblyError(f"Instruction {Style.underline}{instruction.instr}{Style.res_underline} expects {expected_params} params, but got {len(instruction.params)}", instruction.line_no)
+
+        value = parse_constant(instruction.params[1], instruction.line_no) if instruction.instr == "LIW" else None
+        if value in pooled:
+            if value not in pool:
+                label = f"__const_{value}"
+                while label in labels:
+                    label += "_"
+                pool[value] = label
+            lines = [f"LD {instruction.params[0]} {pool[value]}"]
+        else:
+            lines = info.func(*instruction.params, instruction.line_no)
+
+        replacement = [Instruction(instruction.line_no, instr.upper(), params) for instr, params in map(split_line, lines)]
+        replacement[0].labels = instruction.labels
+        expanded.extend(replacement)
+
+    # The constant pool is kept after the program
+    line_no = expanded[-1].line_no
+    for value, label in pool.items():
+        expanded.append(Instruction(line_no, "DAT", [str(value)], [label]))
+
+    return from_instructions(expanded, trailing_labels)
@@ -0,0 +1,57 @@
+from typing import Sequence
+
+from .assembler_instructions import ALIASED_INSTRUCTIONS
+from .emulator import FIELD_LAYOUTS
+from .hardware_definition import (INSTRUCTION_SIZE, INSTRUCTIONS, OPCODE_SIZE,
+                                  ParamType)
+
+# Mnemonic and parameters of each opcode. Aliased instructions are written with their alias,
+# as the assembler picks the same instruction again from the kinds of operand.
+ALIASES = {name: alias for alias, names in ALIASED_INSTRUCTIONS.items() for name in names}
+MNEMONICS: dict[int, tuple[str, list[ParamType]]] = {info["opcode"]: (ALIASES.get(name, name), info["params"]) for name, info in INSTRUCTIONS.items()}
+
+
+def format_operand(value: int, ptype: ParamType, names: dict[int, str]) -> str:
+    if ptype == "reg":
+        return f"R{value}"
+    if ptype == "addr" and value in names:
+        return names[value]
+    return str(value)
+
+
+def disassemble_word(word: int, names: dict[int, str]) -> str:
+    # Words which are not exactly an encoded instruction are written as data
+    opcode = word >> (INSTRUCTION_SIZE - OPCODE_SIZE)
+    if opcode not in MNEMONICS or word >> INSTRUCTION_SIZE:
+        return f"DAT {word:#x}"
+
+    mnemonic, params = MNEMONICS[opcode]
+    values = [(word >> shift) & mask for shift, mask in FIELD_LAYOUTS[opcode]]
+    encoded = opcode << (INSTRUCTION_SIZE - OPCODE_SIZE)
+    for value, (shift, _) in zip(values, FIELD_LAYOUTS[opcode]):
+        encoded |= value << shift
+    if encoded != word:
+        return f"DAT {word:#x}"
+
+    return " ".join([mnemonic, *(format_operand(value, ptype, names) for value, ptype in zip(values, params))])
+
+
+def disassemble(machine_code: Sequence[int], symbols: dict[str, int] | None = None) -> str:
+    # Output assembles back to the same words, with each address and word in a comment
+    labels: dict[int, list[str]] = {}
+    for label, address in (symbols or {}).items():
+        labels.setdefault(address, []).append(label)
+
+    # Labels which would be read as a register are left as numbers
+    names = {address: found[0] for address, found in labels.items() if not found[0].startswith(("R", "%"))}
+
+    listing = ""
+    for address, word in enumerate(machine_code):
+        for label in labels.get(address, []):
+            listing += f"{label}:\n"
+        listing += f"  {disassemble_word(word, names):<28} ; {address:04} {word:#010x}\n"
+
+    for label in labels.get(len(machine_code), []):
+        listing += f"{label}:\n"
+
+    return listing
@@ -0,0 +1,454 @@
+from collections import deque
+from typing import Callable, Iterable
+
+from .hardware_definition import (CALL_STACK_SIZE, DISPLAY_SIZE,
+                                  INSTRUCTION_SIZE, INSTRUCTIONS, MEMORY_SIZE,
+                                  OPCODE_SIZE, PARAM_SIZE, REGISTER_COUNT,
+                                  ParamType)
+
+WORD_MASK = (1 << INSTRUCTION_SIZE) - 1
+ADDRESS_MASK = MEMORY_SIZE - 1
+
+OPCODES: dict[int, str] = {info["opcode"]: name for name, info in INSTRUCTIONS.items()}
+
+
+class EmulatorError(Exception):
+    def __init__(self, message: str, address: int):
+        super().__init__(message)
+        self.address = address
+
+
+class _Halt(Exception):
+    pass
+
+
+class Pause(Exception):
+    # Raised by a display's swap to stop `run` once the GSWP completes, without halting the program
+    pass
+
+
+def field_layout(params: list[ParamType]) -> list[tuple[int, int]]:
+    # Parameters are packed directly after the opcode, from the top of the word down
+    layout: list[tuple[int, int]] = []
+    offset = INSTRUCTION_SIZE - OPCODE_SIZE
+    for ptype in params:
+        offset -= PARAM_SIZE[ptype]
+        layout.append((offset, (1 << PARAM_SIZE[ptype]) - 1))
+
+    return layout
+
+
+FIELD_LAYOUTS: dict[int, list[tuple[int, int]]] = {info["opcode"]: field_layout(info["params"]) for info in INSTRUCTIONS.values()}
+
+
+def decode(word: int) -> tuple[str, list[int]] | None:
+    opcode = word >> (INSTRUCTION_SIZE - OPCODE_SIZE)
+    name = OPCODES.get(opcode)
+    if name is None:
+        return None
+
+    return name, [(word >> shift) & mask for shift, mask in FIELD_LAYOUTS[opcode]]
+
+
+# Registers hold signed 32-bit values, matching factorio signals
+def to_int32(value: int) -> int:
+    return ((value + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+
+
+def alu_div(a: int, b: int) -> int:
+    if b == 0:
+        return 0
+    quotient = abs(a) // abs(b)
+    return to_int32(quotient if (a < 0) == (b < 0) else -quotient)
+
+
+def alu_mod(a: int, b: int) -> int:
+    if b == 0:
+        return 0
+    remainder = abs(a) % abs(b)
+    return -remainder if a < 0 else remainder
+
+
+def alu_pow(a: int, b: int) -> int:
+    if b < 0:
+        return 0
+    return to_int32(pow(a, b, 1 << 32))
+
+
+ALU_OPERATIONS: dict[str, Callable[[int, int], int]] = {
+    "ADD": lambda a, b: to_int32(a + b),
+    "SUB": lambda a, b: to_int32(a - b),
+    "MUL": lambda a, b: to_int32(a * b),
+    "DIV": alu_div,
+    "MOD": alu_mod,
+    "POW": alu_pow,
+    "SHL": lambda a, b: to_int32(a << (b & 31)),
+    "SHR": lambda a, b: a >> (b & 31),
+    "AND": lambda a, b: a & b,
+    "OR": lambda a, b: a | b,
+    "XOR": lambda a, b: a ^ b,
+}
+
+BRANCH_CONDITIONS: dict[str, Callable[[int, int], bool]] = {
+    "BEQ": lambda a, b: a == b,
+    "BNE": lambda a, b: a != b,
+    "BLT": lambda a, b: a < b,
+    "BGT": lambda a, b: a > b,
+}
+
+
+class Display:
+    def __init__(self) -> None:
+        self.front = bytearray(DISPLAY_SIZE * DISPLAY_SIZE)
+        self.back = bytearray(DISPLAY_SIZE * DISPLAY_SIZE)
+        self.frames = 0
+
+    def draw(self, x: int, y: int, width: int, height: int, colour: int) -> None:
+        # Width and height are offset by 1, anything outside the screen is clipped
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + width + 1, DISPLAY_SIZE), min(y + height + 1, DISPLAY_SIZE)
+        if x0 >= x1 or y0 >= y1:
+            return
+
+        row = bytes([colour & 0xFF]) * (x1 - x0)
+        back = self.back
+        for py in range(y0, y1):
+            back[py * DISPLAY_SIZE + x0 : py * DISPLAY_SIZE + x1] = row
+
+    def reset(self) -> None:
+        self.front[:] = bytes(len(self.front))
+        self.back[:] = bytes(len(self.back))
+        self.frames = 0
+
+    def swap(self) -> None:
+        self.front, self.back = self.back, self.front
+        self.frames += 1
+
+
+class Emulator:
+    def __init__(self, machine_code: list[int], keyboard: Iterable[int] = (), display: Display | None = None) -> None:
+        if len(machine_code) > MEMORY_SIZE:
+            raise ValueError(f"Program of {len(machine_code)} words does not fit in {MEMORY_SIZE} words of memory")
+
+        self.registers: list[int] = [0] * REGISTER_COUNT
+        self.memory: list[int] = [code & WORD_MASK for code in machine_code] + [0] * (MEMORY_SIZE - len(machine_code))
+        self.program = list(self.memory)
+        self.call_stack: list[int] = []
+        self.display = display if display is not None else Display()
+        self.keyboard: deque[int] = deque(keyboard)
+
+        self.pc = 0
+        self.cycles = 0
+        self.halted = False
+        # Whether the last run was stopped by the display
+        self.paused = False
+
+        # Each memory word is compiled into a closure the first time it is executed, and recompiled after being stored to
+        self._code: list[Callable[[int], int]] = [self._compile_at] * MEMORY_SIZE
+
+    def reset(self, keyboard: Iterable[int] = ()) -> None:
+        # Restore the program and clear all state in place, keeping compiled code for unmodified words
+        for address, word in enumerate(self.program):
+            if self.memory[address] != word:
+                self.memory[address] = word
+                self._invalidate_word(address)
+
+        self.registers[:] = [0] * REGISTER_COUNT
+        self.call_stack.clear()
+        self.display.reset()
+        self.keyboard.clear()
+        self.keyboard.extend(keyboard)
+
+        self.pc = 0
+        self.cycles = 0
+        self.halted = False
+        self.paused = False
+
+    def _invalidate_word(self, address: int) -> None:
+        self._code[address] = self._compile_at
+
+    def press(self, key: int) -> None:
+        self.keyboard.append(key)
+
+    def _compile_at(self, pc: int) -> int:
+        op = self.compile(pc, self.memory[pc])
+        self._code[pc] = op
+        return op(pc)
+
+    def compile(self, address: int, word: int) -> Callable[[int], int]:
+        opcode = word >> (INSTRUCTION_SIZE - OPCODE_SIZE)
+        builder = _BUILDERS.get(opcode)
+        if builder is None:
+            raise EmulatorError(f"Unknown opcode {opcode:#09b} at address {address}", address)
+
+        args = [(word >> shift) & mask for shift, mask in FIELD_LAYOUTS[opcode]]
+        return builder(self, (address + 1) & ADDRESS_MASK, *args)
+
+    def step(self) -> bool:
+        return self.run(1) == 1 and not self.halted
+
+    def run(self, max_cycles: int | None = None) -> int:
+        if self.halted:
+            return 0
+
+        code = self._code
+        pc = self.pc
+        executed = 0
+        limit = max_cycles if max_cycles is not None else 1 << 62
+        self.paused = False
+        try:
+            for executed in range(1, limit + 1):
+                pc = code[pc](pc)
+        except _Halt:
+            self.halted = True
+        except Pause:
+            # Only GSWP pauses, which always continues to the next address
+            pc = (pc + 1) & ADDRESS_MASK
+            self.paused = True
+        except Exception:
+            # The faulting instruction did not complete
+            executed -= 1
+            raise
+        finally:
+            self.pc = pc
+            self.cycles += executed
+
+        return executed
+
+
+# Instruction builders, each returns a closure taking the current pc and returning the next pc
+
+
+def _build_mov(emu: Emulator, nxt: int, rd: int, rs: int):
+    regs = emu.registers
+
+    def op(pc: int) -> int:
+        regs[rd] = regs[rs]
+        return nxt
+
+    return op
+
+
+def _build_li(emu: Emulator, nxt: int, rd: int, imm: int):
+    regs = emu.registers
+
+    def op(pc: int) -> int:
+        regs[rd] = imm
+        return nxt
+
+    return op
+
+
+def _build_ld(emu: Emulator, nxt: int, rd: int, addr: int):
+    regs, memory = emu.registers, emu.memory
+
+    def op(pc: int) -> int:
+        regs[rd] = memory[addr]
+        return nxt
+
+    return op
+
+
+def _build_st(emu: Emulator, nxt: int, addr: int, rs: int):
+    regs, memory, code = emu.registers, emu.memory, emu._code
+    recompile = emu._compile_at
+
+    def op(pc: int) -> int:
+        memory[addr] = regs[rs] & WORD_MASK
+        code[addr] = recompile
+        return nxt
+
+    return op
+
+
+def _build_ldr(emu: Emulator, nxt: int, rd: int, ra: int):
+    regs, memory = emu.registers, emu.memory
+
+    def op(pc: int) -> int:
+        regs[rd] = memory[regs[ra] & ADDRESS_MASK]
+        return nxt
+
+    return op
+
+
+def _build_str(emu: Emulator, nxt: int, ra: int, rs: int):
+    regs, memory, code = emu.registers, emu.memory, emu._code
+    recompile = emu._compile_at
+
+    def op(pc: int) -> int:
+        addr = regs[ra] & ADDRESS_MASK
+        memory[addr] = regs[rs] & WORD_MASK
+        code[addr] = recompile
+        return nxt
+
+    return op
+
+
+def _build_nop(emu: Emulator, nxt: int):
+    def op(pc: int) -> int:
+        return nxt
+
+    return op
+
+
+def _build_hlt(emu: Emulator, nxt: int):
+    def op(pc: int) -> int:
+        raise _Halt()
+
+    return op
+
+
+def _build_jmp(emu: Emulator, nxt: int, addr: int):
+    def op(pc: int) -> int:
+        return addr
+
+    return op
+
+
+def _make_branch_builder(name: str, immediate: bool):
+    condition = BRANCH_CONDITIONS[name]
+
+    def build(emu: Emulator, nxt: int, ra: int, b: int, addr: int):
+        regs = emu.registers
+
+        if immediate:
+
+            def op(pc: int) -> int:
+                return addr if condition(regs[ra], b) else nxt
+
+        else:
+
+            def op(pc: int) -> int:
+                return addr if condition(regs[ra], regs[b]) else nxt
+
+        return op
+
+    return build
+
+
+def _build_call(emu: Emulator, nxt: int, addr: int):
+    stack = emu.call_stack
+
+    def op(pc: int) -> int:
+        if len(stack) >= CALL_STACK_SIZE:
+            raise EmulatorError(f"Call stack overflow at address {pc}", pc)
+        stack.append(nxt)
+        return addr
+
+    return op
+
+
+def _build_ret(emu: Emulator, nxt: int):
+    stack = emu.call_stack
+
+    def op(pc: int) -> int:
+        if not stack:
+            raise EmulatorError(f"Return with empty call stack at address {pc}", pc)
+        return stack.pop()
+
+    return op
+
+
+def _make_alu_builder(name: str, immediate: bool):
+    operation = ALU_OPERATIONS[name]
+
+    def build(emu: Emulator, nxt: int, rd: int, ra: int, b: int):
+        regs = emu.registers
+
+        if immediate:
+
+            def op(pc: int) -> int:
+                regs[rd] = operation(regs[ra], b)
+                return nxt
+
+        else:
+
+            def op(pc: int) -> int:
+                regs[rd] = operation(regs[ra], regs[b])
+                return nxt
+
+        return op
+
+    return build
+
+
+def _make_gds_builder(variant: str):
+    # Variant letters say whether the position, size and colour come from immediates (I) or registers (R)
+    pos_reg, size_reg, col_reg = (letter == "R" for letter in variant)
+
+    def build(emu: Emulator, nxt: int, x: int, y: int, w: int, h: int, col: int):
+        regs = emu.registers
+        display = emu.display
+
+        def op(pc: int) -> int:
+            display.draw(
+                regs[x] if pos_reg else x,
+                regs[y] if pos_reg else y,
+                regs[w] if size_reg else w,
+                regs[h] if size_reg else h,
+                regs[col] if col_reg else col,
+            )
+            return nxt
+
+        return op
+
+    return build
+
+
+def _build_gswp(emu: Emulator, nxt: int):
+    display = emu.display
+
+    def op(pc: int) -> int:
+        display.swap()
+        return nxt
+
+    return op
+
+
+def _build_krd(emu: Emulator, nxt: int, rd: int):
+    regs, keyboard = emu.registers, emu.keyboard
+
+    def op(pc: int) -> int:
+        regs[rd] = keyboard.popleft() if keyboard else 0
+        return nxt
+
+    return op
+
+
+def _build_krdp(emu: Emulator, nxt: int, rd: int):
+    regs, keyboard = emu.registers, emu.keyboard
+
+    def op(pc: int) -> int:
+        regs[rd] = keyboard[0] if keyboard else 0
+        return nxt
+
+    return op
+
+
+_NAMED_BUILDERS: dict[str, Callable] = {
+    "MOV": _build_mov,
+    "LI": _build_li,
+    "LD": _build_ld,
+    "ST": _build_st,
+    "LDR": _build_ldr,
+    "STR": _build_str,
+    "NOP": _build_nop,
+    "HLT": _build_hlt,
+    "JMP": _build_jmp,
+    "CALL": _build_call,
+    "RET": _build_ret,
+    "GSWP": _build_gswp,
+    "KRD": _build_krd,
+    "KRDP": _build_krdp,
+}
+
+for _name in INSTRUCTIONS:
+    _base, _, _variant = _name.partition("/")
+    if _base in BRANCH_CONDITIONS:
+        _NAMED_BUILDERS[_name] = _make_branch_builder(_base, _variant == "I")
+    elif _base in ALU_OPERATIONS:
+        _NAMED_BUILDERS[_name] = _make_alu_builder(_base, _variant == "I")
+    elif _base == "GDS":
+        _NAMED_BUILDERS[_name] = _make_gds_builder(_variant)
+
+_BUILDERS: dict[int, Callable] = {INSTRUCTIONS[name]["opcode"]: builder for name, builder in _NAMED_BUILDERS.items()}
@@ -1,15 +1,77 @@
-from draftsman.blueprintable import Blueprint
-from draftsman.entity import ConstantCombinator
+import base64
+import json
+import zlib
+from typing import Iterable
 
+# Factorio 2.0.49, the game version draftsman writes into blueprints
+BLUEPRINT_VERSION = (2 << 48) | (0 << 32) | (49 << 16) | 0
+
+
+def encode_blueprint_string(blueprint: dict) -> str:
+    # Version byte, then the base64 of the zlib compressed JSON, as in https://wiki.factorio.com/Blueprint_string_format
+    blueprint_json = json.dumps(blueprint, separators=(",", ":")).encode("utf-8")
+    return "0" + base64.b64encode(zlib.compress(blueprint_json, 9)).decode("utf-8")
+
+
+def flasher_combinator(entity_number: int, address: int, code: int) -> dict:
+    return {
+        "name": "constant-combinator",
+        "position": {"x": 0.5, "y": address + 0.5},
+        "control_behavior": {
+            "sections": {
+                "sections": [
+                    {
+                        "index": 1,
+                        "filters": [{"index": 1, "name": "signal-dot", "type": "virtual", "quality": "normal", "comparator": "=", "count": code}],
+                        "active": True,
+                    }
+                ]
+            }
+        },
+        "connections": {},
+        "entity_number": entity_number,
+    }
+
+
+def flashed_addresses(machine_code: list[int], addresses: Iterable[int] | None) -> list[int]:
+    # Every word is flashed unless only some addresses are asked for
+    return list(range(len(machine_code))) if addresses is None else sorted(addresses)
+
+
+def flasher_blueprint(machine_code: list[int], label: str | None = None, addresses: Iterable[int] | None = None) -> dict:
+    # Same keys, in the same order, as draftsman writes them so the strings are byte-identical
+    blueprint: dict = {"item": "blueprint"}
+    if label is not None:
+        blueprint["label"] = label
+    blueprint["version"] = BLUEPRINT_VERSION
+
+    entities = [flasher_combinator(i + 1, address, machine_code[address]) for i, address in enumerate(flashed_addresses(machine_code, addresses))]
+    if entities:
+        blueprint["entities"] = entities
+
+    return {"blueprint": blueprint}
+
+
+def generate_draftsman_blueprint(machine_code: list[int], label: str | None = None, addresses: Iterable[int] | None = None) -> str:
+    # Draftsman is slow to import and validates every entity, so it is only used when asked for
+    from draftsman.blueprintable import Blueprint
+    from draftsman.entity import ConstantCombinator
 
-def generate_flasher_blueprint(machine_code: list[int], label: str | None = None) -> str:
     blueprint = Blueprint()
     blueprint.label = label
 
-    for i, code in enumerate(machine_code):
-        combinator = ConstantCombinator(tile_position=(0, i))
+    for address in flashed_addresses(machine_code, addresses):
+        combinator = ConstantCombinator(tile_position=(0, address))
         section = combinator.add_section()
-        section.set_signal(0, name="signal-dot", type="virtual", count=code)
+        section.set_signal(0, name="signal-dot", type="virtual", count=machine_code[address])
         blueprint.entities.append(combinator)
 
     return blueprint.to_string()
+
+
+def generate_flasher_blueprint(machine_code: list[int], label: str | None = None, validate: bool = False, addresses: Iterable[int] | None = None) -> str:
+    # With addresses only the combinators for those words are placed, each on its own row so the blueprint lines up with the flasher
+    if validate:
+        return generate_draftsman_blueprint(machine_code, label, addresses)
+
+    return encode_blueprint_string(flasher_blueprint(machine_code, label, addresses))
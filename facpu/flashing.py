@@ -0,0 +1,79 @@
+import json
+from pathlib import Path
+from typing import Iterable
+
+from colored import Fore, Style
+
+# Images of the last flashed machine code are kept beside the source, one per file
+IMAGE_DIRECTORY = ".facpu"
+
+
+def image_path(source: Path) -> Path:
+    return source.parent / IMAGE_DIRECTORY / f"{source.name}.json"
+
+
+def load_flashed_image(source: Path) -> list[int] | None:
+    path = image_path(source)
+    if not path.exists():
+        return None
+
+    try:
+        with open(path, "r") as f:
+            image = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        image = None
+
+    if not isinstance(image, list) or not all(isinstance(word, int) for word in image):
+        print(f"{Fore.yellow}Flashed image {Style.underline}{path}{Style.res_underline} is unreadable, flashing every word{Style.reset}")
+        return None
+
+    return image
+
+
+def save_flashed_image(source: Path, image: list[int]) -> None:
+    path = image_path(source)
+    path.parent.mkdir(exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(image, f)
+
+
+def changed_addresses(previous: list[int], machine_code: list[int]) -> list[int]:
+    # Words past the end of the previous image have never been flashed so always count as changed
+    return [address for address, code in enumerate(machine_code) if address >= len(previous) or previous[address] != code]
+
+
+def delta_addresses(previous: list[int], machine_code: list[int], unconfirmed: Iterable[int] = ()) -> list[int]:
+    # Blueprints are pasted relative to their bounds, so the first and last rows are always included
+    # to keep a delta lined up with the flasher exactly as a full blueprint would be.
+    # Words in `unconfirmed` may hold anything a blueprint which was never pasted would have written, so they are flashed again.
+    changed = {*changed_addresses(previous, machine_code), *(address for address in unconfirmed if address < len(machine_code))}
+    if not changed:
+        return []
+
+    return sorted({0, len(machine_code) - 1, *changed})
+
+
+def flashed_image(previous: list[int], machine_code: list[int]) -> list[int]:
+    # Combinators past the end of a shorter program keep their old words, as flashing does not clear them
+    return machine_code + previous[len(machine_code) :]
+
+
+class FlashSession:
+    # Deltas for one run of the assembler, all made against the image flashed before it started.
+    # Under --watch a blueprint is made on every save but not every one is pasted, so each delta
+    # also covers every word an earlier delta of the session changed.
+    def __init__(self, source: Path, full: bool = False) -> None:
+        self.source = source
+        self.baseline = None if full else load_flashed_image(source)
+        self.image = self.baseline
+        self.unconfirmed: set[int] = set()
+
+    def addresses(self, machine_code: list[int]) -> list[int] | None:
+        # None when every word has to be flashed
+        return None if self.baseline is None else delta_addresses(self.baseline, machine_code, self.unconfirmed)
+
+    def flashed(self, machine_code: list[int]) -> None:
+        # The next run of the assembler makes its deltas against this, the image left by pasting the latest blueprint
+        self.unconfirmed.update(changed_addresses(self.baseline or [], machine_code))
+        self.image = flashed_image(self.image or [], machine_code)
+        save_flashed_image(self.source, self.image)
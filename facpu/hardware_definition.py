@@ -12,6 +12,12 @@ OPCODE_SIZE = 7
 PARAM_SIZE: dict[ParamType, int] = {"reg": 4, "imm4": 4, "imm8": 8, "imm10": 10, "addr": 10}
 INSTRUCTION_SIZE = 31
 
+REGISTER_COUNT = 1 << PARAM_SIZE["reg"]
+REGISTER_SIZE = 32
+MEMORY_SIZE = 1 << PARAM_SIZE["addr"]
+CALL_STACK_SIZE = 16
+DISPLAY_SIZE = 16
+
 INSTRUCTIONS: dict[str, InstructionInfo] = {
     # CPU
     "MOV": {"opcode": 0b0000000, "params": ["reg", "reg"]},
@@ -54,7 +60,7 @@ INSTRUCTIONS: dict[str, InstructionInfo] = {
     "SHL/I": {"opcode": 0b0110110, "params": ["reg", "reg", "imm10"]},
     "SHR/I": {"opcode": 0b0110111, "params": ["reg", "reg", "imm10"]},
     "AND/I": {"opcode": 0b0111000, "params": ["reg", "reg", "imm10"]},
-    "ORI/": {"opcode": 0b0111001, "params": ["reg", "reg", "imm10"]},
+    "OR/I": {"opcode": 0b0111001, "params": ["reg", "reg", "imm10"]},
     "XOR/I": {"opcode": 0b0111010, "params": ["reg", "reg", "imm10"]},
     # Graphics
     "GDS/III": {"opcode": 0b1000000, "params": ["imm4", "imm4", "imm4", "imm4", "imm8"]},
@@ -70,3 +76,8 @@ INSTRUCTIONS: dict[str, InstructionInfo] = {
     "KRD": {"opcode": 0b1010000, "params": ["reg"]},
     "KRDP": {"opcode": 0b1010001, "params": ["reg"]},
 }
+
+# Game ticks each instruction takes in the combinator hardware (~14Hz at 60 UPS).
+# Until measured every instruction costs the same, see timing.load_calibration() to calibrate this.
+DEFAULT_INSTRUCTION_TICKS = 4
+INSTRUCTION_TICKS: dict[str, int] = {name: DEFAULT_INSTRUCTION_TICKS for name in INSTRUCTIONS}
@@ -0,0 +1,76 @@
+import json
+import mmap
+import sys
+from array import array
+from pathlib import Path
+from typing import Sequence
+
+from colored import Fore, Style
+
+# Images are packed little-endian 32-bit words, one per memory address
+WORD_BYTES = 4
+# Array typecode of an unsigned 32-bit integer on this platform
+WORD_TYPECODE = next(code for code in "IL" if array(code).itemsize == WORD_BYTES)
+SYMBOLS_SUFFIX = ".sym.json"
+
+
+def symbols_path(path: Path) -> Path:
+    # `game.bin` keeps its symbols in `game.sym.json`
+    return path.with_suffix(SYMBOLS_SUFFIX)
+
+
+def pack_image(machine_code: Sequence[int]) -> bytes:
+    words = array(WORD_TYPECODE, machine_code)
+    if sys.byteorder == "big":
+        words.byteswap()
+    return words.tobytes()
+
+
+def write_image(path: Path, machine_code: Sequence[int], symbols: dict[str, int] | None = None) -> int:
+    data = pack_image(machine_code)
+    with open(path, "wb") as f:
+        f.write(data)
+
+    if symbols is not None:
+        with open(symbols_path(path), "w") as f:
+            json.dump(dict(sorted(symbols.items(), key=lambda item: (item[1], item[0]))), f, indent=1)
+
+    return len(data)
+
+
+def load_image(path: Path) -> Sequence[int]:
+    # On little-endian hosts the words are read straight out of a memory map, without copying or parsing
+    if not path.exists():
+        raise Exception(f"{Fore.red}Image {Style.underline}{path}{Style.res_underline} cannot be found{Style.reset}")
+
+    if path.suffix == ".json":
+        with open(path, "r") as f:
+            return json.load(f)
+
+    with open(path, "rb") as f:
+        size = f.seek(0, 2)
+        if size % WORD_BYTES:
+            raise Exception(f"{Fore.red}Image {Style.underline}{path}{Style.res_underline} is {size} bytes, which is not a whole number of words{Style.reset}")
+        if size == 0:
+            return []
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    if sys.byteorder == "little":
+        return memoryview(mapped).cast(WORD_TYPECODE)
+
+    words = array(WORD_TYPECODE, mapped)
+    words.byteswap()
+    return words
+
+
+def load_symbols(path: Path) -> dict[str, int]:
+    if not path.exists():
+        return {}
+
+    with open(path, "r") as f:
+        try:
+            symbols = json.load(f)
+        except json.JSONDecodeError as e:
+            raise Exception(f"{Fore.red}Symbol table {Style.underline}{path}{Style.res_underline} is not valid JSON: {e}{Style.reset}")
+
+    return {label: address for label, address in symbols.items() if isinstance(address, int)}
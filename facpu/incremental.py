@@ -0,0 +1,152 @@
+import difflib
+
+from colored import Style
+
+from .assembler import AssembledProgram, AssemblyError, assemble_line, preprocess_line
+from .macros import UserMacroRegistry
+
+# Preprocessed form of a source line, its labels (with columns) and content
+LineResult = tuple[list[tuple[str, int]], str | None]
+
+
+def changed_ranges(old: list[str], new: list[str]) -> list[tuple[int, int, int, int]]:
+    # (i1, i2, j1, j2) for each run of old[i1:i2] replaced by new[j1:j2].
+    # Edits are usually in one place, so the common start and end are skipped before diffing.
+    start = 0
+    while start < len(old) and start < len(new) and old[start] == new[start]:
+        start += 1
+
+    end = 0
+    while end < len(old) - start and end < len(new) - start and old[-1 - end] == new[-1 - end]:
+        end += 1
+
+    matcher = difflib.SequenceMatcher(None, old[start : len(old) - end], new[start : len(new) - end], autojunk=False)
+    return [(start + i1, start + i2, start + j1, start + j2) for tag, i1, i2, j1, j2 in matcher.get_opcodes() if tag != "equal"]
+
+
+class IncrementalAssembler:
+    # Keeps the preprocessed and encoded form of every source line between updates,
+    # so after an edit only the changed lines are lexed and expanded again
+    def __init__(self, optimize: bool = False, inline_budget: int | None = None) -> None:
+        self.optimize = optimize
+        self.inline_budget = inline_budget
+        self.lines: list[str] = []
+        self.results: list[LineResult] = []
+        # User macros defined after each `#define` line, None on every other line
+        self.macro_snapshots: list[dict[str, str] | None] = []
+        # Encoded word of every line with content, None on every other line
+        self.words: list[int | None] = []
+        self.labels: dict[str, int] = {}
+        self.program: AssembledProgram | None = None
+        # Whether the last update rewrote the program, after which no encoded word can be reused
+        self.rewritten = False
+        self.registry = UserMacroRegistry()
+        # Number of lines preprocessed and encoded by the last update
+        self.preprocessed = 0
+        self.encoded = 0
+
+    def preprocess_lines(self, lines: list[str], start: int, end: int) -> tuple[list[LineResult], list[dict[str, str] | None]]:
+        results: list[LineResult] = []
+        snapshots: list[dict[str, str] | None] = []
+
+        for i in range(start, end):
+            found_labels, content = preprocess_line(lines[i], i, self.registry)
+            results.append(([(label, column) for _, label, _, column in found_labels], content))
+            snapshots.append(dict(self.registry.macros) if "#define" in lines[i] else None)
+
+        self.preprocessed += end - start
+        return results, snapshots
+
+    def macros_before(self, snapshots: list[dict[str, str] | None], line_no: int) -> dict[str, str]:
+        for snapshot in reversed(snapshots[:line_no]):
+            if snapshot is not None:
+                return snapshot
+        return {}
+
+    def resolve_labels(self, results: list[LineResult]) -> tuple[list[tuple[int, str]], dict[str, int]]:
+        processed_lines: list[tuple[int, str]] = []
+        labels: dict[str, int] = {}
+
+        for i, (found_labels, content) in enumerate(results):
+            for label, column in found_labels:
+                if label in labels:
+                    raise AssemblyError(f"Duplicate label {Style.underline}{label}{Style.res_underline} found", i, token=label, column=column)
+                labels.update({label: len(processed_lines)})
+
+            if content is not None:
+                processed_lines.append((i, content))
+
+        return processed_lines, labels
+
+    def update(self, lines: list[str]) -> AssembledProgram:
+        try:
+            return self._update(lines)
+        except AssemblyError as e:
+            raise Exception(e.format_error(lines))
+
+    def _update(self, lines: list[str]) -> AssembledProgram:
+        from .optimizer import optimize as optimize_lines
+        from .constants import expand_pseudo_instructions, needs_expansion
+        from .regalloc import allocate_registers, uses_virtual_registers
+
+        self.preprocessed = 0
+        self.encoded = 0
+
+        changed = changed_ranges(self.lines, lines)
+
+        # Macro definitions change how every later line expands, so editing one preprocesses the whole file again
+        redefined = any("#define" in line for i1, i2, j1, j2 in changed for line in self.lines[i1:i2] + lines[j1:j2])
+        results = list(self.results)
+        snapshots = list(self.macro_snapshots)
+        words = list(self.words)
+
+        if self.program is None or redefined:
+            self.registry = UserMacroRegistry()
+            results, snapshots = self.preprocess_lines(lines, 0, len(lines))
+            words = [None] * len(lines)
+            changed = [(0, len(self.lines), 0, len(lines))]
+        else:
+            # Splice from the end, so earlier indices stay valid
+            for i1, i2, j1, j2 in reversed(changed):
+                results[i1:i2] = [([], None)] * (j2 - j1)
+                snapshots[i1:i2] = [None] * (j2 - j1)
+                words[i1:i2] = [None] * (j2 - j1)
+
+            for _, _, j1, j2 in changed:
+                self.registry = UserMacroRegistry(self.macros_before(snapshots, j1))
+                results[j1:j2], snapshots[j1:j2] = self.preprocess_lines(lines, j1, j2)
+
+            self.registry = UserMacroRegistry(self.macros_before(snapshots, len(lines)))
+
+        processed_lines, labels = self.resolve_labels(results)
+
+        # Expanding pseudo-instructions, register allocation and optimization work across the whole program, so everything is encoded again
+        rewritten = needs_expansion(processed_lines) or uses_virtual_registers(processed_lines)
+        if rewritten:
+            processed_lines, labels = expand_pseudo_instructions(processed_lines, labels)
+            processed_lines, labels = allocate_registers(processed_lines, labels)
+
+        optimization = None
+        if self.optimize or rewritten:
+            if self.optimize:
+                processed_lines, labels, optimization = optimize_lines(processed_lines, labels, self.inline_budget)
+            machine_code = [assemble_line(line, labels) for line in processed_lines]
+            self.encoded = len(processed_lines)
+            words = [None] * len(lines)
+        else:
+            # Changed lines are encoded again, along with any line using a label whose address has shifted
+            dirty = set(range(len(lines))) if self.rewritten else {j for _, _, j1, j2 in changed for j in range(j1, j2)}
+            shifted = {label for label in labels.keys() | self.labels.keys() if labels.get(label) != self.labels.get(label)}
+            if shifted:
+                dirty.update(j for j, (_, content) in enumerate(results) if content is not None and not shifted.isdisjoint(content.split()[1:]))
+
+            for j in dirty:
+                content = results[j][1]
+                words[j] = None if content is None else assemble_line((j, content), labels)
+                self.encoded += content is not None
+            machine_code = [word for word in words if word is not None]
+
+        self.lines, self.results, self.macro_snapshots, self.words, self.labels = lines, results, snapshots, words, labels
+        self.rewritten = rewritten
+        self.program = AssembledProgram(lines, processed_lines, labels, machine_code, optimization)
+        return self.program
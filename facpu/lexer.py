@@ -0,0 +1,33 @@
+import re
+from typing import Literal
+
+TokenKind = Literal["word", "label", "macro", "comma", "lparen", "rparen"]
+
+# Tokens are plain (kind, text, line, column) tuples, columns are counted in the unstripped source line
+Token = tuple[TokenKind, str, int, int]
+
+# One alternative per token kind, whitespace between tokens is skipped by finditer.
+# Labels are the longest run of word characters ending in a colon, and macros are their name without the `#`.
+_TOKEN_PATTERN = re.compile(r"(,)|(\()|(\))|#(\w*)|([^\s,;()#]+):|([^\s,;()#]+)")
+_GROUP_KINDS: list[TokenKind] = ["word", "comma", "lparen", "rparen", "macro", "label", "word"]
+
+
+def tokenize(line: str, line_no: int, labels: bool = True) -> list[Token]:
+    # A comment ends the line
+    end = line.find(";")
+    matches = _TOKEN_PATTERN.finditer(line, 0, end if end >= 0 else len(line))
+    tokens: list[Token] = [(_GROUP_KINDS[match.lastindex], match[match.lastindex], line_no, match.start()) for match in matches]
+
+    if not labels:
+        # Without labels the text (including its colon) is a plain word
+        tokens = [("word", f"{text}:", line_no, column) if kind == "label" else (kind, text, line_no, column) for kind, text, _, column in tokens]
+
+    return tokens
+
+
+def token_end(token: Token) -> int:
+    # Column just after the token in the source line
+    kind, text, _, column = token
+    if kind == "macro" or kind == "label":
+        return column + len(text) + 1
+    return column + len(text)
@@ -0,0 +1,273 @@
+import hashlib
+import json
+from pathlib import Path
+
+from colored import Fore, Style
+
+from .assembler import (AssemblyError, assemble_line, parse_op, preprocess,
+                        split_line)
+from .assembler_instructions import PseudoInstruction
+from .cache import assembler_version
+from .constants import expand_pseudo_instructions
+from .emulator import decode, field_layout
+from .flashing import IMAGE_DIRECTORY
+from .hardware_definition import MEMORY_SIZE
+from .program import NO_FALLTHROUGH_INSTRUCTIONS
+from .regalloc import allocate_registers, is_virtual
+
+# Labels starting with this are private to their file, every other label can be referenced from other files
+PRIVATE_PREFIX = "_"
+
+# A label field to fill in when linking, as (address, shift, mask, symbol)
+Relocation = tuple[int, int, int, str]
+
+
+class ObjectFile:
+    def __init__(self, source: str, processed_lines: list[tuple[int, str]], words: list[int], labels: dict[str, int], relocations: list[Relocation], virtual_line: int | None = None) -> None:
+        self.source = source
+        self.processed_lines = processed_lines
+        # Words with every label field left as 0, to be filled in from `relocations`
+        self.words = words
+        self.labels = labels
+        self.relocations = relocations
+        # Source line of the first virtual register, None when the file names only physical registers
+        self.virtual_line = virtual_line
+        # Whether this was loaded from its cached object file rather than assembled
+        self.cached = False
+
+    @property
+    def exports(self) -> dict[str, int]:
+        return {label: address for label, address in self.labels.items() if not label.startswith(PRIVATE_PREFIX)}
+
+    @property
+    def imports(self) -> set[str]:
+        return {symbol for _, _, _, symbol in self.relocations if symbol not in self.labels}
+
+    def to_dict(self) -> dict:
+        return {"processed_lines": self.processed_lines, "words": self.words, "labels": self.labels, "relocations": self.relocations, "virtual_line": self.virtual_line}
+
+    @classmethod
+    def from_dict(cls, source: str, data: dict) -> "ObjectFile":
+        processed_lines = [(line_no, content) for line_no, content in data["processed_lines"]]
+        relocations = [(address, shift, mask, symbol) for address, shift, mask, symbol in data["relocations"]]
+        return cls(source, processed_lines, data["words"], data["labels"], relocations, data["virtual_line"])
+
+
+def object_path(source: Path) -> Path:
+    return source.parent / IMAGE_DIRECTORY / f"{source.name}.o.json"
+
+
+def object_key(source_text: bytes) -> str:
+    digest = hashlib.sha256(assembler_version().encode("utf-8"))
+    digest.update(b"object")
+    digest.update(source_text)
+    return digest.hexdigest()
+
+
+def is_number(param: str) -> bool:
+    try:
+        int(param, 0)
+    except ValueError:
+        return False
+    return True
+
+
+def assemble_object(source: Path, lines: list[str]) -> ObjectFile:
+    # Like assemble_program, but labels are left as relocations rather than resolved
+    try:
+        processed_lines, labels = preprocess(lines)
+        processed_lines, labels = expand_pseudo_instructions(processed_lines, labels)
+        virtual_line = next((line_no for line_no, content in processed_lines if any(map(is_virtual, split_line(content)[1]))), None)
+        processed_lines, labels = allocate_registers(processed_lines, labels)
+
+        words: list[int] = []
+        relocations: list[Relocation] = []
+        for address, (line_no, content) in enumerate(processed_lines):
+            instr, params = split_line(content)
+            instr_info = parse_op(instr, line_no)
+            if not isinstance(instr_info, PseudoInstruction):
+                for i, ((shift, mask), ptype) in enumerate(zip(field_layout(instr_info["params"]), instr_info["params"])):
+                    if i < len(params) and ptype != "reg" and not is_number(params[i]):
+                        relocations.append((address, shift, mask, params[i]))
+                        params[i] = "0"
+
+            words.append(assemble_line((line_no, " ".join([instr, *params])), {}))
+    except AssemblyError as e:
+        raise Exception(f"{Fore.red}In {Style.underline}{source}{Style.res_underline}{Style.reset}\n" + e.format_error(lines))
+
+    return ObjectFile(str(source), processed_lines, words, labels, relocations, virtual_line)
+
+
+def load_object(source: Path) -> ObjectFile:
+    # Objects are cached beside the source, so unchanged files are never assembled again
+    if not source.exists():
+        raise Exception(f"{Fore.red}File {Style.underline}{source}{Style.res_underline} cannot be found{Style.reset}")
+
+    with open(source, "r") as f:
+        lines = f.readlines()
+    key = object_key("".join(lines).encode("utf-8"))
+
+    path = object_path(source)
+    if path.exists():
+        try:
+            with open(path, "r") as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            data = None
+
+        if isinstance(data, dict) and data.get("key") == key:
+            obj = ObjectFile.from_dict(str(source), data)
+            obj.cached = True
+            return obj
+
+    obj = assemble_object(source, lines)
+    path.parent.mkdir(exist_ok=True)
+    with open(path, "w") as f:
+        json.dump({"key": key, **obj.to_dict()}, f)
+
+    return obj
+
+
+class Routine:
+    # Code from one exported label up to the next, the unit the linker keeps or drops
+    def __init__(self, obj: ObjectFile, start: int, end: int, name: str) -> None:
+        self.obj = obj
+        self.start = start
+        self.end = end
+        self.name = name
+        self.address: int | None = None
+
+    def falls_through(self) -> bool:
+        # Data and unknown words are assumed to continue into the next routine
+        instruction = decode(self.obj.words[self.end - 1]) if self.end > self.start else None
+        return self.end == self.start or instruction is None or instruction[0] not in NO_FALLTHROUGH_INSTRUCTIONS
+
+
+def split_routines(obj: ObjectFile) -> list[Routine]:
+    starts = sorted({0, *(address for address in obj.exports.values() if address < len(obj.words))})
+    names = {address: label for label, address in reversed(obj.exports.items())}
+    return [Routine(obj, start, end, names.get(start, "<start>")) for start, end in zip(starts, starts[1:] + [len(obj.words)])]
+
+
+class LinkedProgram:
+    def __init__(self, objects: list[ObjectFile], routines: list[Routine], machine_code: list[int], symbols: dict[str, int]) -> None:
+        self.objects = objects
+        self.routines = routines
+        self.machine_code = machine_code
+        self.symbols = symbols
+
+    @property
+    def dropped(self) -> list[Routine]:
+        return [routine for routine in self.routines if routine.address is None]
+
+
+def link(objects: list[ObjectFile], keep_unused: bool = False) -> LinkedProgram:
+    # The first object is the program, laid out whole from address 0, followed by the routines it uses from the others
+    # Each file hands out its free registers to virtual registers on its own, so two files could be given the same register
+    # and a call into a library would overwrite a value the caller keeps in it
+    if len(objects) > 1:
+        for obj in objects:
+            if obj.virtual_line is not None:
+                raise Exception(f"{Fore.red}{obj.source} line {obj.virtual_line + 1} uses a virtual register, which cannot be linked with other files as each file is given registers on its own{Style.reset}")
+
+    definitions: dict[str, list[ObjectFile]] = {}
+    for obj in objects:
+        for symbol in obj.exports:
+            definitions.setdefault(symbol, []).append(obj)
+
+    def resolve(obj: ObjectFile, symbol: str, address: int) -> tuple[ObjectFile, int]:
+        if symbol in obj.labels:
+            return obj, obj.labels[symbol]
+
+        line_no = obj.processed_lines[address][0] + 1
+        found = definitions.get(symbol, [])
+        if not found:
+            raise Exception(f"{Fore.red}Undefined symbol {Style.underline}{symbol}{Style.res_underline} used in {obj.source} line {line_no}{Style.reset}")
+        if len(found) > 1:
+            raise Exception(f"{Fore.red}Symbol {Style.underline}{symbol}{Style.res_underline} used in {obj.source} line {line_no} is defined in {' and '.join(other.source for other in found)}{Style.reset}")
+        return found[0], found[0].labels[symbol]
+
+    routines = {id(obj): split_routines(obj) for obj in objects}
+
+    def routine_at(obj: ObjectFile, address: int) -> Routine | None:
+        # Labels after the last word belong to no routine
+        return next((routine for routine in routines[id(obj)] if routine.start <= address < routine.end), None)
+
+    # Keep every routine reachable from the program by reference or by running on into the next
+    kept: set[int] = set()
+    stack = list(routines[id(objects[0])]) if not keep_unused else [routine for obj in objects for routine in routines[id(obj)]]
+    while stack:
+        routine = stack.pop()
+        if id(routine) in kept:
+            continue
+        kept.add(id(routine))
+
+        for address, _, _, symbol in routine.obj.relocations:
+            if routine.start <= address < routine.end:
+                target = routine_at(*resolve(routine.obj, symbol, address))
+                if target is not None:
+                    stack.append(target)
+
+        following = routines[id(routine.obj)]
+        index = following.index(routine)
+        if routine.falls_through() and index + 1 < len(following):
+            stack.append(following[index + 1])
+
+    # Lay out the kept routines and work out where every symbol ended up
+    layout: list[Routine] = []
+    address = 0
+    for obj in objects:
+        for routine in routines[id(obj)]:
+            if id(routine) in kept:
+                routine.address = address
+                address += routine.end - routine.start
+                layout.append(routine)
+
+    if address > MEMORY_SIZE:
+        raise Exception(f"{Fore.red}Linked program of {address} words does not fit in {MEMORY_SIZE} words of memory{Style.reset}")
+
+    def symbol_address(obj: ObjectFile, offset: int) -> int:
+        routine = routine_at(obj, offset)
+        if routine is None:
+            # A label after the last word is the end of its object
+            kept_routines = [routine for routine in routines[id(obj)] if routine.address is not None]
+            return kept_routines[-1].address + kept_routines[-1].end - kept_routines[-1].start if kept_routines else address
+        return routine.address + offset - routine.start
+
+    machine_code: list[int] = []
+    for routine in layout:
+        words = routine.obj.words[routine.start : routine.end]
+        for reloc_address, shift, mask, symbol in routine.obj.relocations:
+            if routine.start <= reloc_address < routine.end:
+                value = symbol_address(*resolve(routine.obj, symbol, reloc_address))
+                if value > mask:
+                    line_no = routine.obj.processed_lines[reloc_address][0] + 1
+                    raise Exception(f"{Fore.red}Symbol {Style.underline}{symbol}{Style.res_underline} at address {value} does not fit in its field (max {mask}) in {routine.obj.source} line {line_no}{Style.reset}")
+                words[reloc_address - routine.start] |= value << shift
+        machine_code.extend(words)
+
+    # Addresses of every label that was kept, those from libraries prefixed with their file name
+    symbols: dict[str, int] = {}
+    for obj in objects:
+        for label, offset in obj.labels.items():
+            routine = routine_at(obj, offset)
+            if routine is None or routine.address is not None:
+                symbols[label if obj is objects[0] else f"{Path(obj.source).stem}.{label}"] = symbol_address(obj, offset)
+
+    return LinkedProgram(objects, [routine for obj in objects for routine in routines[id(obj)]], machine_code, symbols)
+
+
+def format_link_summary(program: LinkedProgram) -> str:
+    summary = ""
+    for obj in program.objects:
+        routines = [routine for routine in program.routines if routine.obj is obj]
+        kept = sum(routine.end - routine.start for routine in routines if routine.address is not None)
+        state = "cached" if obj.cached else "assembled"
+        summary += f"{obj.source}: {kept} of {len(obj.words)} words ({state})\n"
+
+    dropped = program.dropped
+    if dropped:
+        summary += f"{Fore.cyan}Dropped {len(dropped)} unreferenced routines ({sum(routine.end - routine.start for routine in dropped)} words): {', '.join(routine.name for routine in dropped)}{Style.reset}\n"
+
+    summary += f"{Fore.green}Linked {len(program.objects)} files into {len(program.machine_code)} words{Style.reset}"
+    return summary
@@ -5,11 +5,11 @@ from colored import Style
 
 
 class Macro:
-    def __init__(self, func: Callable[[list[str], int], str]) -> None:
+    def __init__(self, func: "Callable[[list[str], int, UserMacroRegistry], str]") -> None:
         self.func = func
 
 
-def col_macro(args: list[str], line_no: int) -> str:
+def col_macro(args: list[str], line_no: int, registry: "UserMacroRegistry") -> str:
     from .assembler import AssemblyError
 
     if len(args) == 1:
@@ -40,35 +40,77 @@ def col_macro(args: list[str], line_no: int) -> str:
     else:
         raise AssemblyError(f"Macro {Style.underline}col{Style.res_underline} expects 1 or 3 params, but got {len(args)}", line_no)
 
-    scaled_rgb = (rgb[0] * 7) // 255, (rgb[1] * 7) // 255, (rgb[2] * 3) // 255
+    return str(pack_colour(rgb[0], rgb[1], rgb[2]))
 
-    packed_scaled_rgb = (scaled_rgb[0] << 5) | (scaled_rgb[1] << 2) | (scaled_rgb[2] << 0)
 
-    return str(packed_scaled_rgb)
+def pack_colour(r: int, g: int, b: int) -> int:
+    # 8-bit RRRGGGBB colour used by the display
+    scaled_rgb = (r * 7) // 255, (g * 7) // 255, (b * 3) // 255
 
+    return (scaled_rgb[0] << 5) | (scaled_rgb[1] << 2) | (scaled_rgb[2] << 0)
+
+
+def unpack_colour(colour: int) -> tuple[int, int, int]:
+    # Inverse of pack_colour, each level becomes the lowest 8-bit value that packs back to it (so full levels are 255)
+    levels = ((colour >> 5) & 0b111, (colour >> 2) & 0b111, colour & 0b11)
+    return -(-levels[0] * 255 // 7), -(-levels[1] * 255 // 7), -(-levels[2] * 255 // 3)
 
-class UserMacroRegistry:
-    macros: dict[str, str] = {}
 
-    @staticmethod
-    def apply_macro(macro:str, args:list[str], line_no:int) -> str:
+class MacroTemplate:
+    # A `#define` body split once around its `$n` parameters, so each use only joins strings
+    def __init__(self, name: str, body: str) -> None:
+        self.name = name
+        self.body = body
+        parts = PARAMETER.split(body)
+        # Literal text, then (argument index, literal text) for each parameter
+        self.head = parts[0]
+        self.slots = [(int(index) - 1, text) for index, text in zip(parts[1::2], parts[2::2])]
+
+    def expand(self, args: tuple[str, ...], line_no: int) -> str:
         from .assembler import AssemblyError
-        
-        macro_str = UserMacroRegistry.macros.get(macro, "")
 
-        def replacer(match: re.Match) -> str:
-          index = int(match.group(1)) - 1  # $1 -> args[0]
+        try:
+            return self.head + "".join(args[index] + text for index, text in self.slots)
+        except IndexError:
+            # Reported for the first parameter without an argument (`$0` is the last argument)
+            index = next(index for index, _ in self.slots if not -len(args) <= index < len(args))
+            raise AssemblyError(f"Defined macro {Style.underline}{self.name}{Style.res_underline} requires at least {index + 1} params, but got {len(args)}", line_no)
 
-          try:
-              return str(args[index])
-          except IndexError:
-              raise AssemblyError(f"Defined macro {Style.underline}{macro}{Style.res_underline} requires at least {index + 1} params, but got {len(args)}", line_no)
-      
-        return re.sub(r"\$(\d+)", replacer, macro_str)
 
+PARAMETER = re.compile(r"\$(\d+)")
+# Deepest nesting of macro calls inside arguments, well within Python's recursion limit
+MAX_MACRO_DEPTH = 64
 
 
-def define_macro(args: list[str], line_no: int) -> str:
+class UserMacroRegistry:
+    # Macros from `#define`, one registry per program so definitions never leak between files
+    # and programs can be assembled at the same time in different threads
+    def __init__(self, macros: dict[str, str] | None = None) -> None:
+        self.macros: dict[str, str] = {} if macros is None else dict(macros)
+        self.templates: dict[str, MacroTemplate] = {}
+        # Expansion of each (template, args) already seen, a redefined macro has a new template so is never matched
+        self.expansions: dict[tuple[MacroTemplate, tuple[str, ...]], str] = {}
+
+    def define(self, name: str, body: str) -> None:
+        if name in self.templates and self.templates[name].body != body:
+            self.expansions = {key: expansion for key, expansion in self.expansions.items() if key[0].name != name}
+        self.macros[name] = body
+
+    def template(self, macro: str) -> MacroTemplate:
+        template = self.templates.get(macro)
+        if template is None or template.body != self.macros[macro]:
+            template = self.templates[macro] = MacroTemplate(macro, self.macros[macro])
+        return template
+
+    def apply_macro(self, macro: str, args: list[str], line_no: int) -> str:
+        key = (self.template(macro), tuple(args))
+        expansion = self.expansions.get(key)
+        if expansion is None:
+            expansion = self.expansions[key] = key[0].expand(key[1], line_no)
+        return expansion
+
+
+def define_macro(args: list[str], line_no: int, registry: UserMacroRegistry) -> str:
     from .assembler import AssemblyError
 
     if len(args) != 2:
@@ -76,7 +118,7 @@ def define_macro(args: list[str], line_no: int) -> str:
 
     macro_name, macro_content = args
 
-    UserMacroRegistry.macros.update({macro_name: macro_content})
+    registry.define(macro_name, macro_content)
 
     return ""
 
@@ -0,0 +1,469 @@
+from functools import partial
+
+from colored import Fore, Style
+
+from .emulator import ALU_OPERATIONS
+from .hardware_definition import CALL_STACK_SIZE, DISPLAY_SIZE, PARAM_SIZE
+from .program import (REGISTER_WRITES, Instruction, from_instructions,
+                      label_indices, remove_instruction, successors,
+                      to_instructions)
+
+MAX_IMMEDIATE = (1 << PARAM_SIZE["imm10"]) - 1
+# Largest leaf subroutine (not counting its RET) copied into each caller
+INLINE_BUDGET = 4
+
+
+class OptimizationReport:
+    def __init__(self, instructions_before: int) -> None:
+        self.instructions_before = instructions_before
+        self.instructions_after = instructions_before
+        # Number of changes made by each pass, and cycles saved each time the changed code runs
+        self.changes: dict[str, int] = {}
+        self.cycles_saved: dict[str, int] = {}
+        self.skipped_reason: str | None = None
+        # Deepest nesting of calls from the start of the program, None when a subroutine can call itself
+        self.max_call_depth: int | None = 0
+
+    def to_dict(self) -> dict:
+        return {
+            "instructions_before": self.instructions_before,
+            "instructions_after": self.instructions_after,
+            "changes": self.changes,
+            "cycles_saved": self.cycles_saved,
+            "skipped_reason": self.skipped_reason,
+            "max_call_depth": self.max_call_depth,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "OptimizationReport":
+        report = cls(data["instructions_before"])
+        report.instructions_after = data["instructions_after"]
+        report.changes = dict(data["changes"])
+        report.cycles_saved = dict(data["cycles_saved"])
+        report.skipped_reason = data["skipped_reason"]
+        report.max_call_depth = data["max_call_depth"]
+        return report
+
+    def record(self, name: str, cycles_saved: int = 1) -> None:
+        self.changes[name] = self.changes.get(name, 0) + 1
+        self.cycles_saved[name] = self.cycles_saved.get(name, 0) + cycles_saved
+
+    def format_report(self) -> str:
+        if self.skipped_reason is not None:
+            return f"{Fore.yellow}Optimization skipped: {self.skipped_reason}{Style.reset}\n" + self.format_call_depth()
+
+        removed = self.instructions_before - self.instructions_after
+        report = f"{Fore.green}Optimized {self.instructions_before} -> {self.instructions_after} instructions ({removed} removed){Style.reset}\n"
+        for name, count in self.changes.items():
+            report += f"  {name}: {count} (~{self.cycles_saved[name]} cycles saved per execution)\n"
+        report += f"  {Fore.cyan}Estimated cycles saved: {sum(self.cycles_saved.values())}{Style.reset}\n"
+        # Counted across the whole program, not per frame
+        draws_removed = sum(self.changes.get(name, 0) for name in DRAW_PASSES)
+        if draws_removed:
+            report += f"  {Fore.cyan}GDS draw calls removed: {draws_removed}{Style.reset}\n"
+
+        return report + self.format_call_depth()
+
+    def format_call_depth(self) -> str:
+        if self.max_call_depth is None:
+            return f"  {Fore.yellow}Maximum call depth: unbounded (recursive calls), {CALL_STACK_SIZE} call stack slots{Style.reset}\n"
+
+        colour = Fore.red if self.max_call_depth > CALL_STACK_SIZE else Fore.cyan
+        return f"  {colour}Maximum call depth: {self.max_call_depth} of {CALL_STACK_SIZE} call stack slots{Style.reset}\n"
+
+
+def has_absolute_addresses(instructions: list[Instruction]) -> bool:
+    # Moving code is only safe when every address operand refers to a label
+    indices = label_indices(instructions)
+    for instruction in instructions:
+        for param, ptype in zip(instruction.params, instruction.param_types()):
+            if ptype == "addr" and param not in indices:
+                return True
+
+    return False
+
+
+def thread_jumps(instructions: list[Instruction], trailing_labels: list[str], report: OptimizationReport) -> bool:
+    # Retarget jumps to labels which only hold another JMP
+    changed = False
+    indices = label_indices(instructions)
+
+    for instruction in instructions:
+        target = instruction.jump_target
+        seen: set[str] = set()
+
+        while target in indices and target not in seen:
+            seen.add(target)
+            destination = instructions[indices[target]]
+            if destination.instr != "JMP" or destination.jump_target == target:
+                break
+
+            target = destination.jump_target
+            instruction.params[-1] = target
+            report.record("Jumps threaded")
+            changed = True
+
+    return changed
+
+
+def remove_jumps_to_next(instructions: list[Instruction], trailing_labels: list[str], report: OptimizationReport) -> bool:
+    # Each of these is a no-op on its own, so they can all be removed at once
+    indices = label_indices(instructions)
+    redundant = [
+        i
+        for i, instruction in enumerate(instructions)
+        if instruction.instr != "CALL" and instruction.jump_target is not None and indices.get(instruction.jump_target) == i + 1
+    ]
+
+    for i in reversed(redundant):
+        remove_instruction(instructions, i, trailing_labels)
+        report.record("Jumps to next instruction removed")
+
+    return bool(redundant)
+
+
+def fold_constants(instructions: list[Instruction], trailing_labels: list[str], report: OptimizationReport) -> bool:
+    # Fold `LI Rx a` followed by `OP Rx Rx b` into a single LI, when nothing can jump between them
+    changed = False
+    i = 0
+    while i < len(instructions) - 1:
+        load, operation = instructions[i], instructions[i + 1]
+        base, _, variant = operation.instr.partition("/")
+
+        if (
+            load.instr == "LI"
+            and variant == "I"
+            and base in ALU_OPERATIONS
+            and not operation.labels
+            and operation.params[0].upper() == operation.params[1].upper() == load.params[0].upper()
+        ):
+            try:
+                value = ALU_OPERATIONS[base](int(load.params[1], 0), int(operation.params[2], 0))
+            except ValueError:
+                value = None
+
+            if value is not None and 0 <= value <= MAX_IMMEDIATE:
+                load.params[1] = str(value)
+                remove_instruction(instructions, i + 1, trailing_labels)
+                report.record("Constants folded into LI")
+                changed = True
+                continue
+
+        i += 1
+
+    return changed
+
+
+def remove_self_moves(instructions: list[Instruction], trailing_labels: list[str], report: OptimizationReport) -> bool:
+    changed = False
+    i = 0
+    while i < len(instructions):
+        instruction = instructions[i]
+        if instruction.instr == "MOV" and instruction.params[0].upper() == instruction.params[1].upper():
+            remove_instruction(instructions, i, trailing_labels)
+            report.record("Dead MOV removed")
+            changed = True
+        else:
+            i += 1
+
+    return changed
+
+
+def remove_unreachable(instructions: list[Instruction], trailing_labels: list[str], report: OptimizationReport) -> bool:
+    indices = label_indices(instructions)
+
+    # Labels used as data (eg. `LD R0 label`) may be read or executed in ways we cannot follow
+    roots = {0}
+    for instruction in instructions:
+        for param in instruction.params[:-1] if instruction.jump_target is not None else instruction.params:
+            if param in indices:
+                roots.add(indices[param])
+
+    reachable: set[int] = set()
+    stack = [root for root in roots if root < len(instructions)]
+    while stack:
+        index = stack.pop()
+        if index in reachable:
+            continue
+        reachable.add(index)
+        stack.extend(successors(instructions, index, indices))
+
+    changed = False
+    for i in reversed(range(len(instructions))):
+        if i not in reachable and not instructions[i].is_data:
+            remove_instruction(instructions, i, trailing_labels)
+            report.record("Unreachable instructions removed", cycles_saved=0)
+            changed = True
+
+    return changed
+
+
+# Draw calls saved by these passes are saved every frame the code is drawn
+DRAW_PASSES = ("Overdrawn GDS removed", "Adjacent GDS merged")
+
+Rectangle = tuple[int, int, int, int]
+
+
+class Draw:
+    def __init__(self, index: int, rectangle: Rectangle | None, colour: int | None) -> None:
+        self.index = index
+        # Clipped to the screen as (x0, y0, x1, y1), None when a register operand is not a known constant
+        self.rectangle = rectangle
+        self.colour = colour
+
+
+def operand_value(param: str, ptype: str, constants: dict[str, int]) -> int | None:
+    if ptype == "reg":
+        return constants.get(param.upper())
+    try:
+        value = int(param, 0)
+    except ValueError:
+        return None
+    # Out of range immediates are left for the assembler to reject
+    return value if 0 <= value < 1 << PARAM_SIZE.get(ptype, 0) else None
+
+
+def draw_of(instruction: Instruction, index: int, constants: dict[str, int]) -> Draw:
+    x, y, w, h, colour = (operand_value(param, ptype, constants) for param, ptype in zip(instruction.params, instruction.param_types()))
+    if x is None or y is None or w is None or h is None:
+        return Draw(index, None, None if colour is None else colour & 0xFF)
+
+    # Width and height are offset by 1, as drawn by the display
+    rectangle = (max(x, 0), max(y, 0), min(x + w + 1, DISPLAY_SIZE), min(y + h + 1, DISPLAY_SIZE))
+    return Draw(index, rectangle, None if colour is None else colour & 0xFF)
+
+
+def is_empty(rectangle: Rectangle) -> bool:
+    return rectangle[0] >= rectangle[2] or rectangle[1] >= rectangle[3]
+
+
+def contains(outer: Rectangle, inner: Rectangle) -> bool:
+    return outer[0] <= inner[0] and outer[1] <= inner[1] and inner[2] <= outer[2] and inner[3] <= outer[3]
+
+
+def overlaps(a: Rectangle | None, b: Rectangle) -> bool:
+    # Draws of unknown size may cover anything
+    return a is None or (a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3])
+
+
+def rectangle_union(a: Rectangle, b: Rectangle) -> Rectangle | None:
+    # The union of two rectangles, if it is a rectangle itself
+    if contains(a, b):
+        return a
+    if contains(b, a):
+        return b
+    if a[1] == b[1] and a[3] == b[3] and max(a[0], b[0]) <= min(a[2], b[2]):
+        return (min(a[0], b[0]), a[1], max(a[2], b[2]), a[3])
+    if a[0] == b[0] and a[2] == b[2] and max(a[1], b[1]) <= min(a[3], b[3]):
+        return (a[0], min(a[1], b[1]), a[2], max(a[3], b[3]))
+    return None
+
+
+def coalesce_frame(draws: list[Draw], removed: set[int], merged: dict[int, tuple[Rectangle, int]], report: OptimizationReport) -> None:
+    # Drop draws that are empty or completely painted over later in the frame
+    for i, draw in enumerate(draws):
+        if draw.rectangle is None:
+            continue
+        rectangle = draw.rectangle
+        if is_empty(rectangle) or any(later.rectangle is not None and contains(later.rectangle, rectangle) for later in draws[i + 1 :]):
+            removed.add(draw.index)
+            report.record(DRAW_PASSES[0])
+
+    # Merge same-colour draws whose union is a rectangle, when nothing drawn between them touches the draw being moved
+    remaining = [draw for draw in draws if draw.index not in removed]
+    merging = True
+    while merging:
+        merging = False
+        for i, first in enumerate(remaining):
+            for j in range(i + 1, len(remaining)):
+                second = remaining[j]
+                if first.rectangle is None or second.rectangle is None or first.colour is None or first.colour != second.colour:
+                    continue
+                union = rectangle_union(first.rectangle, second.rectangle)
+                if union is None:
+                    continue
+
+                between = remaining[i + 1 : j]
+                if not any(overlaps(draw.rectangle, first.rectangle) for draw in between):
+                    kept, dropped = second, first
+                elif not any(overlaps(draw.rectangle, second.rectangle) for draw in between):
+                    kept, dropped = first, second
+                else:
+                    continue
+
+                kept.rectangle = union
+                merged[kept.index] = (union, kept.colour)
+                merged.pop(dropped.index, None)
+                removed.add(dropped.index)
+                remaining.remove(dropped)
+                report.record(DRAW_PASSES[1])
+                merging = True
+                break
+            if merging:
+                break
+
+
+def coalesce_draws(instructions: list[Instruction], trailing_labels: list[str], report: OptimizationReport) -> bool:
+    # Within straight-line code, GDS calls up to the next GSWP are drawn into the same frame,
+    # with register operands known from earlier LI/MOV in the same block
+    removed: set[int] = set()
+    merged: dict[int, tuple[Rectangle, int]] = {}
+    constants: dict[str, int] = {}
+    draws: list[Draw] = []
+
+    for i, instruction in enumerate(instructions):
+        block_start = i == 0 or bool(instruction.labels) or instructions[i - 1].jump_target is not None or not instructions[i - 1].falls_through
+        if block_start or instruction.instr == "GSWP" or instruction.is_data:
+            coalesce_frame(draws, removed, merged, report)
+            draws = []
+        if block_start or instruction.is_data:
+            constants = {}
+
+        if instruction.instr.startswith("GDS/"):
+            draws.append(draw_of(instruction, i, constants))
+        elif instruction.instr in REGISTER_WRITES:
+            register = instruction.params[0].upper()
+            constants.pop(register, None)
+            value = operand_value(instruction.params[1], instruction.param_types()[1], constants) if instruction.instr in ("LI", "MOV") else None
+            if value is not None:
+                constants[register] = value
+
+    coalesce_frame(draws, removed, merged, report)
+
+    for index, (rectangle, colour) in merged.items():
+        x0, y0, x1, y1 = rectangle
+        instructions[index].instr = "GDS/III"
+        instructions[index].params = [str(x0), str(y0), str(x1 - x0 - 1), str(y1 - y0 - 1), str(colour)]
+
+    for index in sorted(removed, reverse=True):
+        remove_instruction(instructions, index, trailing_labels)
+
+    return bool(removed)
+
+
+def convert_tail_calls(instructions: list[Instruction], trailing_labels: list[str], report: OptimizationReport) -> bool:
+    # `CALL x` then `RET` becomes `JMP x`, so x returns straight to our caller
+    changed = False
+    for instruction, following in zip(instructions, instructions[1:]):
+        if instruction.instr == "CALL" and following.instr == "RET":
+            instruction.instr = "JMP"
+            report.record("Tail calls converted")
+            changed = True
+
+    return changed
+
+
+def leaf_body(instructions: list[Instruction], entry: int) -> list[Instruction] | None:
+    # Straight-line code from `entry` up to its RET, when it calls nothing and nothing jumps into its middle
+    body: list[Instruction] = []
+    for i in range(entry, len(instructions)):
+        instruction = instructions[i]
+        if i > entry and instruction.labels:
+            return None
+        if instruction.instr == "RET":
+            return body
+        if instruction.is_data or instruction.jump_target is not None or not instruction.falls_through:
+            return None
+        body.append(instruction)
+
+    return None
+
+
+def inline_leaf_calls(instructions: list[Instruction], trailing_labels: list[str], report: OptimizationReport, budget: int = INLINE_BUDGET) -> bool:
+    # Copy small leaf subroutines over their CALL, saving the CALL and RET
+    indices = label_indices(instructions)
+    bodies: dict[str, list[Instruction] | None] = {}
+    changed = False
+
+    # From the end, so earlier call sites keep their index
+    for i in reversed(range(len(instructions))):
+        call = instructions[i]
+        if call.instr != "CALL" or call.jump_target not in indices:
+            continue
+
+        if call.jump_target not in bodies:
+            bodies[call.jump_target] = leaf_body(instructions, indices[call.jump_target])
+        body = bodies[call.jump_target]
+        if body is None or len(body) > budget:
+            continue
+
+        if body:
+            inlined = [Instruction(call.line_no, instruction.instr, list(instruction.params)) for instruction in body]
+            inlined[0].labels = call.labels
+            instructions[i : i + 1] = inlined
+        else:
+            remove_instruction(instructions, i, trailing_labels)
+
+        report.record("Leaf calls inlined", cycles_saved=2)
+        changed = True
+
+    return changed
+
+
+PASSES = [convert_tail_calls, thread_jumps, remove_jumps_to_next, fold_constants, remove_self_moves, remove_unreachable, coalesce_draws]
+
+
+def called_subroutines(instructions: list[Instruction], entry: int, indices: dict[str, int]) -> set[int]:
+    # Entries of the subroutines called by code reachable from `entry` without following a CALL or RET
+    callees: set[int] = set()
+    reachable: set[int] = set()
+    stack = [entry]
+    while stack:
+        index = stack.pop()
+        if index in reachable or index >= len(instructions):
+            continue
+        reachable.add(index)
+
+        instruction = instructions[index]
+        if instruction.instr == "CALL":
+            if instruction.jump_target in indices:
+                callees.add(indices[instruction.jump_target])
+            stack.append(index + 1)
+        else:
+            stack.extend(successors(instructions, index, indices))
+
+    return callees
+
+
+def max_call_depth(instructions: list[Instruction]) -> int | None:
+    indices = label_indices(instructions)
+    depths: dict[int, int | None] = {}
+    # Subroutines being measured, calling one of these again is recursion
+    active: set[int] = set()
+
+    def depth(entry: int) -> int | None:
+        if entry in active:
+            return None
+        if entry not in depths:
+            active.add(entry)
+            callee_depths = [depth(callee) for callee in called_subroutines(instructions, entry, indices)]
+            active.remove(entry)
+            depths[entry] = None if None in callee_depths else max((1 + callee for callee in callee_depths), default=0)
+        return depths[entry]
+
+    return depth(0)
+
+
+def optimize(processed_lines: list[tuple[int, str]], labels: dict[str, int], inline_budget: int | None = None) -> tuple[list[tuple[int, str]], dict[str, int], OptimizationReport]:
+    instructions, trailing_labels = to_instructions(processed_lines, labels)
+    report = OptimizationReport(len(instructions))
+
+    if has_absolute_addresses(instructions):
+        report.skipped_reason = "program uses absolute addresses which cannot be relocated"
+        report.max_call_depth = max_call_depth(instructions)
+        return processed_lines, labels, report
+
+    # Inlining runs first, so small subroutines are copied rather than tail called
+    passes = [partial(inline_leaf_calls, budget=INLINE_BUDGET if inline_budget is None else inline_budget), *PASSES]
+
+    changed = True
+    while changed:
+        changed = False
+        for optimization_pass in passes:
+            changed |= optimization_pass(instructions, trailing_labels, report)
+
+    report.instructions_after = len(instructions)
+    report.max_call_depth = max_call_depth(instructions)
+    processed_lines, labels = from_instructions(instructions, trailing_labels)
+
+    return processed_lines, labels, report
@@ -0,0 +1,194 @@
+from typing import Iterable
+
+from colored import Fore, Style
+
+from .analyzer import describe_address
+from .assembler import AssembledProgram
+from .emulator import ADDRESS_MASK, Emulator, EmulatorError, decode
+from .hardware_definition import MEMORY_SIZE
+from .program import BRANCH_INSTRUCTIONS
+
+
+class FunctionProfile:
+    def __init__(self, entry: int) -> None:
+        self.entry = entry
+        self.calls = 0
+        self.self_instructions = 0
+        self.self_ticks = 0
+        # Ticks spent in this function and everything it called, counted once for recursive calls
+        self.inclusive_ticks = 0
+        self.callers: dict[int, int] = {}
+        self.callees: dict[int, int] = {}
+
+
+class Profile:
+    def __init__(self) -> None:
+        self.instructions = 0
+        self.ticks = 0
+        self.counts = [0] * MEMORY_SIZE
+        self.address_ticks = [0] * MEMORY_SIZE
+        self.taken = [0] * MEMORY_SIZE
+        # Functions by entry address, execution starts in the function at address 0
+        self.functions: dict[int, FunctionProfile] = {0: FunctionProfile(0)}
+        self.halted = False
+        self.error: str | None = None
+
+    def function(self, entry: int) -> FunctionProfile:
+        if entry not in self.functions:
+            self.functions[entry] = FunctionProfile(entry)
+        return self.functions[entry]
+
+
+def profile_program(machine_code: list[int], ticks: dict[str, int], max_cycles: int, keyboard: Iterable[int] = ()) -> Profile:
+    emu = Emulator(machine_code, keyboard=keyboard)
+    profile = Profile()
+    profile.functions[0].calls = 1
+
+    # Decoded instruction of each address, keyed by the word so self-modified code is decoded again
+    decoded: dict[int, tuple[int, str | None, int | None]] = {}
+    # Shadow of the call stack, as (function entry, ticks when it was entered)
+    frames: list[tuple[int, int]] = [(0, 0)]
+    active: dict[int, int] = {0: 1}
+
+    def leave() -> None:
+        entry, entered = frames.pop()
+        active[entry] -= 1
+        if not active[entry]:
+            profile.functions[entry].inclusive_ticks += profile.ticks - entered
+
+    try:
+        while profile.instructions < max_cycles and not emu.halted:
+            pc = emu.pc
+            word = emu.memory[pc]
+            info = decoded.get(pc)
+            if info is None or info[0] != word:
+                instruction = decode(word)
+                name = None if instruction is None else instruction[0]
+                target = instruction[1][0] if name == "CALL" else None
+                info = decoded[pc] = (word, name, target)
+            _, name, target = info
+
+            emu.run(1)
+            cost = ticks.get(name, 0) if name is not None else 0
+            profile.instructions += 1
+            profile.ticks += cost
+            profile.counts[pc] += 1
+            profile.address_ticks[pc] += cost
+
+            function = profile.functions[frames[-1][0]]
+            function.self_instructions += 1
+            function.self_ticks += cost
+
+            if name in BRANCH_INSTRUCTIONS and emu.pc != (pc + 1) & ADDRESS_MASK:
+                profile.taken[pc] += 1
+            elif name == "CALL" and target is not None:
+                callee = profile.function(target)
+                callee.calls += 1
+                callee.callers[function.entry] = callee.callers.get(function.entry, 0) + 1
+                function.callees[target] = function.callees.get(target, 0) + 1
+                frames.append((target, profile.ticks))
+                active[target] = active.get(target, 0) + 1
+            elif name == "RET" and len(frames) > 1:
+                leave()
+    except EmulatorError as e:
+        profile.error = str(e)
+
+    profile.halted = emu.halted
+    while frames:
+        leave()
+
+    return profile
+
+
+def function_name(program: AssembledProgram, entry: int) -> str:
+    return "<start>" if entry == 0 and 0 not in program.labels.values() else describe_address(program, entry)
+
+
+def percent(part: int, whole: int) -> str:
+    return f"{100 * part / whole:5.1f}%" if whole else "  0.0%"
+
+
+def format_summary(profile: Profile, max_cycles: int) -> str:
+    if profile.error is not None:
+        ended = f"{Fore.red}stopped by an error: {profile.error}{Style.reset}"
+    elif profile.halted:
+        ended = "halted"
+    else:
+        ended = f"stopped after {max_cycles} instructions"
+
+    return f"{Fore.green}Profiled {profile.instructions} instructions, {profile.ticks} ticks{Style.reset} ({ended})\n"
+
+
+def format_flat(program: AssembledProgram, profile: Profile, top: int) -> str:
+    # Cost of the code under each label, then the hottest individual instructions
+    starts = sorted((address, name) for name, address in program.labels.items())
+    if not starts or starts[0][0] != 0:
+        starts.insert(0, (0, "<start>"))
+
+    regions: list[tuple[int, int, str, int, int]] = []
+    for i, (start, name) in enumerate(starts):
+        end = starts[i + 1][0] if i + 1 < len(starts) else MEMORY_SIZE
+        region_ticks = sum(profile.address_ticks[start:end])
+        if region_ticks or sum(profile.counts[start:end]):
+            regions.append((region_ticks, sum(profile.counts[start:end]), name, start, end))
+
+    report = f"{Fore.cyan}{'ticks':>10} {'':>6}{'instructions':>14}  label{Style.reset}\n"
+    for region_ticks, count, name, start, _ in sorted(regions, key=lambda region: (-region[0], region[3]))[:top]:
+        report += f"{region_ticks:>10} {percent(region_ticks, profile.ticks)}{count:>14}  {name}\n"
+
+    report += f"{Fore.cyan}{'ticks':>10} {'':>6}{'count':>14}  hottest instructions{Style.reset}\n"
+    hottest = sorted((address for address in range(MEMORY_SIZE) if profile.counts[address]), key=lambda address: (-profile.address_ticks[address], address))
+    for address in hottest[:top]:
+        report += f"{profile.address_ticks[address]:>10} {percent(profile.address_ticks[address], profile.ticks)}{profile.counts[address]:>14}  {describe_source(program, profile, address)}\n"
+
+    return report
+
+
+def format_callgraph(program: AssembledProgram, profile: Profile, top: int) -> str:
+    functions = sorted(profile.functions.values(), key=lambda function: (-function.inclusive_ticks, function.entry))
+    report = f"{Fore.cyan}{'inclusive':>10} {'':>6}{'self':>10} {'':>6}{'calls':>8}  function{Style.reset}\n"
+
+    for function in functions[:top]:
+        report += f"{function.inclusive_ticks:>10} {percent(function.inclusive_ticks, profile.ticks)}{function.self_ticks:>10} {percent(function.self_ticks, profile.ticks)}{function.calls:>8}  {function_name(program, function.entry)}\n"
+        for caller, count in sorted(function.callers.items(), key=lambda item: -item[1]):
+            report += f"{'':>50}called {count} times from {function_name(program, caller)}\n"
+        for callee, count in sorted(function.callees.items(), key=lambda item: -item[1]):
+            report += f"{'':>50}calls {function_name(program, callee)} {count} times\n"
+
+    return report
+
+
+def describe_source(program: AssembledProgram, profile: Profile, address: int) -> str:
+    where = describe_address(program, address)
+    if address >= len(program.processed_lines):
+        return f"{where} (outside the program)"
+
+    line_no, _ = program.processed_lines[address]
+    source = f"{where} line {line_no + 1}: {program.lines[line_no].strip()}"
+    return source + branch_rate(program, profile, address)
+
+
+def branch_rate(program: AssembledProgram, profile: Profile, address: int) -> str:
+    instruction = decode(program.machine_code[address]) if address < len(program.machine_code) else None
+    if instruction is None or instruction[0] not in BRANCH_INSTRUCTIONS or not profile.counts[address]:
+        return ""
+    return f"  [taken {percent(profile.taken[address], profile.counts[address]).strip()}]"
+
+
+def format_listing(program: AssembledProgram, profile: Profile) -> str:
+    # The whole source, with the count and ticks of each instruction beside it
+    addresses = {line_no: address for address, (line_no, _) in enumerate(program.processed_lines)}
+    listing = f"{Fore.cyan}{'count':>10}{'ticks':>10} {'':>6}  source{Style.reset}\n"
+
+    for line_no, line in enumerate(program.lines):
+        source = line.rstrip("\n")
+        address = addresses.get(line_no)
+        if address is None:
+            listing += f"{'':>26}  {source}\n"
+            continue
+
+        count, address_ticks = profile.counts[address], profile.address_ticks[address]
+        colour = Fore.red if address_ticks * 20 >= profile.ticks and address_ticks else ""
+        listing += f"{colour}{count:>10}{address_ticks:>10} {percent(address_ticks, profile.ticks)}{Style.reset if colour else ''}  {source}{branch_rate(program, profile, address)}\n"
+
+    return listing
@@ -0,0 +1,110 @@
+from .assembler_instructions import ASSEMBLER_PSEUDO_INSTRUCTIONS
+from .emulator import ALU_OPERATIONS
+from .hardware_definition import INSTRUCTIONS
+
+# Instructions whose last parameter is the address control may be transferred to
+JUMP_INSTRUCTIONS = {"JMP", "CALL", *(name for name in INSTRUCTIONS if name.split("/")[0] in ("BEQ", "BNE", "BLT", "BGT"))}
+BRANCH_INSTRUCTIONS = JUMP_INSTRUCTIONS - {"JMP", "CALL"}
+# Instructions after which execution never continues onto the next address
+NO_FALLTHROUGH_INSTRUCTIONS = {"JMP", "RET", "HLT"}
+# Instructions whose first parameter is a register they write to
+REGISTER_WRITES = {"MOV", "LI", "LD", "LDR", "KRD", "KRDP", *(name for name in INSTRUCTIONS if name.split("/")[0] in ALU_OPERATIONS)}
+
+
+class Instruction:
+    def __init__(self, line_no: int, instr: str, params: list[str], labels: list[str] | None = None) -> None:
+        self.line_no = line_no
+        self.instr = instr
+        self.params = params
+        self.labels: list[str] = labels if labels is not None else []
+
+    @property
+    def content(self) -> str:
+        return " ".join([self.instr, *self.params])
+
+    @property
+    def is_data(self) -> bool:
+        return self.instr in ASSEMBLER_PSEUDO_INSTRUCTIONS
+
+    @property
+    def jump_target(self) -> str | None:
+        return self.params[-1] if self.instr in JUMP_INSTRUCTIONS and self.params else None
+
+    @property
+    def falls_through(self) -> bool:
+        return self.instr not in NO_FALLTHROUGH_INSTRUCTIONS
+
+    def param_types(self) -> list[str]:
+        info = INSTRUCTIONS.get(self.instr)
+        return list(info["params"]) if info is not None else []
+
+    def register_operands(self) -> tuple[list[int], list[int]]:
+        # Indices of the register parameters written and read
+        indices = [i for i, ptype in enumerate(self.param_types()) if ptype == "reg"]
+        if self.instr in REGISTER_WRITES and indices:
+            return indices[:1], indices[1:]
+        return [], indices
+
+    def __repr__(self) -> str:
+        return f"Instruction({self.line_no}, {self.content!r}, labels={self.labels})"
+
+
+def to_instructions(processed_lines: list[tuple[int, str]], labels: dict[str, int]) -> tuple[list[Instruction], list[str]]:
+    from .assembler import split_line
+
+    instructions: list[Instruction] = []
+    for line_no, content in processed_lines:
+        instr, params = split_line(content)
+        instructions.append(Instruction(line_no, instr.upper(), params))
+
+    # Labels after the last instruction are kept separately
+    trailing_labels: list[str] = []
+    for label, address in labels.items():
+        if address < len(instructions):
+            instructions[address].labels.append(label)
+        else:
+            trailing_labels.append(label)
+
+    return instructions, trailing_labels
+
+
+def from_instructions(instructions: list[Instruction], trailing_labels: list[str]) -> tuple[list[tuple[int, str]], dict[str, int]]:
+    processed_lines: list[tuple[int, str]] = []
+    labels: dict[str, int] = {}
+
+    for address, instruction in enumerate(instructions):
+        labels.update({label: address for label in instruction.labels})
+        processed_lines.append((instruction.line_no, instruction.content))
+
+    labels.update({label: len(instructions) for label in trailing_labels})
+
+    return processed_lines, labels
+
+
+def label_indices(instructions: list[Instruction]) -> dict[str, int]:
+    return {label: i for i, instruction in enumerate(instructions) for label in instruction.labels}
+
+
+def remove_instruction(instructions: list[Instruction], index: int, trailing_labels: list[str]) -> Instruction:
+    # Labels on a removed instruction move onto whatever follows it
+    removed = instructions.pop(index)
+    if index < len(instructions):
+        instructions[index].labels[:0] = removed.labels
+    else:
+        trailing_labels.extend(removed.labels)
+
+    return removed
+
+
+def successors(instructions: list[Instruction], index: int, indices: dict[str, int]) -> list[int]:
+    instruction = instructions[index]
+    result: list[int] = []
+
+    if instruction.falls_through and index + 1 < len(instructions):
+        result.append(index + 1)
+
+    target = instruction.jump_target
+    if target is not None and target in indices:
+        result.append(indices[target])
+
+    return result
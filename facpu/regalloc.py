@@ -0,0 +1,235 @@
+import re
+from itertools import count
+
+from .assembler import AssemblyError
+from .hardware_definition import REGISTER_COUNT
+from .program import (Instruction, from_instructions, label_indices,
+                      successors, to_instructions)
+
+VIRTUAL_PREFIX = "%"
+# Spill cost of an instruction is multiplied by this for each loop it is inside
+LOOP_WEIGHT = 10
+
+
+def is_virtual(param: str) -> bool:
+    return param.startswith(VIRTUAL_PREFIX)
+
+
+def uses_virtual_registers(processed_lines: list[tuple[int, str]]) -> bool:
+    return any(VIRTUAL_PREFIX in content for _, content in processed_lines)
+
+
+def flow_graph(instructions: list[Instruction]) -> list[list[int]]:
+    # Successors of each instruction, RET may return to after any CALL
+    indices = label_indices(instructions)
+    returns = [i + 1 for i, instruction in enumerate(instructions) if instruction.instr == "CALL" and i + 1 < len(instructions)]
+    return [returns if instruction.instr == "RET" else successors(instructions, i, indices) for i, instruction in enumerate(instructions)]
+
+
+def loop_depths(graph: list[list[int]], instructions: list[Instruction]) -> list[int]:
+    # A backwards jump makes everything between its target and itself a loop
+    depths = [0] * len(instructions)
+    for i, targets in enumerate(graph):
+        if instructions[i].instr == "RET":
+            continue
+        for target in targets:
+            if target <= i:
+                for j in range(target, i + 1):
+                    depths[j] += 1
+    return depths
+
+
+def virtual_operands(instruction: Instruction) -> tuple[list[str], list[str]]:
+    writes, reads = instruction.register_operands()
+    return [instruction.params[i] for i in writes if is_virtual(instruction.params[i])], [instruction.params[i] for i in reads if is_virtual(instruction.params[i])]
+
+
+def liveness(instructions: list[Instruction], graph: list[list[int]]) -> list[set[str]]:
+    # Virtual registers live after each instruction, iterated backwards to a fixed point
+    operands = [virtual_operands(instruction) for instruction in instructions]
+    live_in: list[set[str]] = [set() for _ in instructions]
+    live_out: list[set[str]] = [set() for _ in instructions]
+
+    changed = True
+    while changed:
+        changed = False
+        for i in reversed(range(len(instructions))):
+            out = set().union(*(live_in[successor] for successor in graph[i]))
+            writes, reads = operands[i]
+            new_in = (out - set(writes)) | set(reads)
+            if out != live_out[i] or new_in != live_in[i]:
+                live_out[i], live_in[i] = out, new_in
+                changed = True
+
+    return live_out
+
+
+class InterferenceGraph:
+    def __init__(self, instructions: list[Instruction]) -> None:
+        graph = flow_graph(instructions)
+        depths = loop_depths(graph, instructions)
+        live_out = liveness(instructions, graph)
+
+        # Nodes are kept in order of first appearance so allocation is deterministic
+        self.neighbours: dict[str, set[str]] = {}
+        self.moves: dict[str, set[str]] = {}
+        self.costs: dict[str, int] = {}
+
+        for i, instruction in enumerate(instructions):
+            writes, reads = virtual_operands(instruction)
+            for name in reads + writes:
+                self.neighbours.setdefault(name, set())
+                self.moves.setdefault(name, set())
+                # Each use or definition of a spilled register costs a LD or ST
+                self.costs[name] = self.costs.get(name, 0) + LOOP_WEIGHT ** min(depths[i], 6)
+
+            # A copy does not interfere with its source, so both may share a register
+            source = instruction.params[1] if instruction.instr == "MOV" else None
+            if source is not None and writes and is_virtual(source):
+                self.moves[writes[0]].add(source)
+                self.moves[source].add(writes[0])
+
+            for written in writes:
+                for name in live_out[i]:
+                    if name != written and name != source:
+                        self.neighbours[written].add(name)
+                        self.neighbours[name].add(written)
+
+
+def colour(graph: InterferenceGraph, available: list[int], temporaries: set[str]) -> tuple[dict[str, int], list[str]]:
+    # Chaitin-Briggs: remove registers with fewer neighbours than free registers,
+    # otherwise the cheapest to spill, then assign registers in reverse order
+    degrees = {name: len(neighbours) for name, neighbours in graph.neighbours.items()}
+    remaining = dict.fromkeys(graph.neighbours)
+    stack: list[str] = []
+
+    def spill_cost(name: str) -> float:
+        return float("inf") if name in temporaries else graph.costs[name] / max(degrees[name], 1)
+
+    while remaining:
+        name = next((name for name in remaining if degrees[name] < len(available)), None)
+        if name is None:
+            name = min(remaining, key=spill_cost)
+
+        del remaining[name]
+        stack.append(name)
+        for neighbour in graph.neighbours[name]:
+            if neighbour in remaining:
+                degrees[neighbour] -= 1
+
+    registers: dict[str, int] = {}
+    spilled: list[str] = []
+    while stack:
+        name = stack.pop()
+        taken = {registers[neighbour] for neighbour in graph.neighbours[name] if neighbour in registers}
+        free = [register for register in available if register not in taken]
+        if not free:
+            spilled.append(name)
+            continue
+
+        # Giving both sides of a MOV the same register lets the optimizer remove it
+        preferred = [registers[partner] for partner in graph.moves[name] if registers.get(partner) in free]
+        registers[name] = preferred[0] if preferred else free[0]
+
+    return registers, spilled
+
+
+def insert_spill_code(instructions: list[Instruction], spilled: set[str], slots: dict[str, str], temporaries: set[str], counter: count) -> None:
+    # Every use of a spilled register loads it into a short-lived temporary, and every definition stores it back
+    i = 0
+    while i < len(instructions):
+        instruction = instructions[i]
+        writes, reads = instruction.register_operands()
+        names = list(dict.fromkeys(instruction.params[j] for j in writes + reads if instruction.params[j] in spilled))
+        if not names:
+            i += 1
+            continue
+
+        loads: list[Instruction] = []
+        stores: list[Instruction] = []
+        for name in names:
+            temporary = f"{name}.{next(counter)}"
+            temporaries.add(temporary)
+            if any(instruction.params[j] == name for j in reads):
+                loads.append(Instruction(instruction.line_no, "LD", [temporary, slots[name]]))
+            if any(instruction.params[j] == name for j in writes):
+                stores.append(Instruction(instruction.line_no, "ST", [slots[name], temporary]))
+            instruction.params = [temporary if j in writes + reads and param == name else param for j, param in enumerate(instruction.params)]
+
+        # Jumps to the instruction now have to run its loads first
+        if loads:
+            loads[0].labels, instruction.labels = instruction.labels, []
+
+        instructions[i : i + 1] = loads + [instruction] + stores
+        i += len(loads) + 1 + len(stores)
+
+
+def spill_for_temporaries(instructions: list[Instruction], graph: InterferenceGraph, registers: dict[str, int], temporaries: set[str], free: int) -> str:
+    # Only temporaries failed to get a register, so spill the cheapest longer lived register overlapping one
+    failed = [name for name in graph.neighbours if name not in registers]
+    candidates = [neighbour for name in failed for neighbour in graph.neighbours[name] if neighbour not in temporaries]
+    if candidates:
+        return min(candidates, key=lambda name: graph.costs[name])
+
+    # A single instruction needs more registers than are free
+    instruction = next(instruction for instruction in instructions if failed[0] in instruction.params)
+    name = failed[0].split(".")[0]
+    raise AssemblyError(f"Too many virtual registers are live at once, only {free} registers are free", instruction.line_no, token=name)
+
+
+def physical_registers(instructions: list[Instruction]) -> set[int]:
+    used: set[int] = set()
+    for instruction in instructions:
+        for param, ptype in zip(instruction.params, instruction.param_types()):
+            match = re.fullmatch(r"R(\d+)", param, re.IGNORECASE) if ptype == "reg" else None
+            if match:
+                used.add(int(match[1]))
+    return used
+
+
+def allocate_registers(processed_lines: list[tuple[int, str]], labels: dict[str, int]) -> tuple[list[tuple[int, str]], dict[str, int]]:
+    # Replace %name virtual registers with whichever physical registers the program does not name itself
+    if not uses_virtual_registers(processed_lines):
+        return processed_lines, labels
+
+    instructions, trailing_labels = to_instructions(processed_lines, labels)
+    used = physical_registers(instructions)
+    available = [register for register in range(REGISTER_COUNT) if register not in used]
+
+    slots: dict[str, str] = {}
+    temporaries: set[str] = set()
+    counter = count()
+
+    while True:
+        graph = InterferenceGraph(instructions)
+        if graph.neighbours and not available:
+            first = next(instruction for instruction in instructions if any(virtual_operands(instruction)))
+            raise AssemblyError(f"No registers are left for virtual registers, all {REGISTER_COUNT} are used by name", first.line_no)
+
+        registers, spilled = colour(graph, available, temporaries)
+        if not spilled:
+            break
+
+        spilled = [name for name in spilled if name not in temporaries]
+        if not spilled:
+            spilled = [spill_for_temporaries(instructions, graph, registers, temporaries, len(available))]
+
+        for name in spilled:
+            label = f"__spill_{name[1:]}"
+            while label in labels or label in slots.values():
+                label += "_"
+            slots[name] = label
+        insert_spill_code(instructions, set(spilled), slots, temporaries, counter)
+
+    for instruction in instructions:
+        writes, reads = instruction.register_operands()
+        for j in writes + reads:
+            if is_virtual(instruction.params[j]):
+                instruction.params[j] = f"R{registers[instruction.params[j]]}"
+
+    # Spill slots are kept after the program
+    line_no = instructions[-1].line_no if instructions else 0
+    for label in slots.values():
+        instructions.append(Instruction(line_no, "DAT", ["0"], [label]))
+
+    return from_instructions(instructions, trailing_labels)
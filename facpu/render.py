@@ -0,0 +1,171 @@
+import hashlib
+import struct
+import zlib
+from pathlib import Path
+from typing import Iterable
+
+from .block_engine import BlockEmulator
+from .emulator import Display, EmulatorError, Pause
+from .hardware_definition import DISPLAY_SIZE
+from .macros import unpack_colour
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# RGB of every 8-bit RRRGGGBB display colour
+PALETTE = [unpack_colour(colour) for colour in range(256)]
+
+
+def frame_hash(frame: bytes) -> str:
+    return hashlib.blake2b(frame, digest_size=8).hexdigest()
+
+
+class RecordingDisplay(Display):
+    # Keeps the last `capacity` frames shown by GSWP in a ring buffer, and a hash of every frame.
+    # The emulator is paused at the GSWP showing frame `limit`.
+    def __init__(self, capacity: int = 1024, limit: int | None = None) -> None:
+        super().__init__()
+        self.capacity = capacity
+        self.limit = limit
+        self.ring: list[bytes] = [b""] * capacity
+        self.hashes: list[str] = []
+
+    def record(self, frame: bytes) -> None:
+        self.ring[(self.frames - 1) % self.capacity] = frame
+        self.hashes.append(frame_hash(frame))
+
+    def reset(self) -> None:
+        super().reset()
+        self.hashes.clear()
+
+    def swap(self) -> None:
+        super().swap()
+        self.record(bytes(self.front))
+        if self.frames == self.limit:
+            raise Pause()
+
+    def recorded_frames(self) -> list[bytes]:
+        # Oldest first
+        count = min(self.frames, self.capacity)
+        return [self.ring[index % self.capacity] for index in range(self.frames - count, self.frames)]
+
+
+class ArrayDisplay(RecordingDisplay):
+    # GDS fills are slice assignments on 16x16 uint8 arrays, and the ring buffer is one preallocated array
+    def __init__(self, capacity: int = 1024, limit: int | None = None) -> None:
+        if np is None:
+            raise ImportError("numpy is required for ArrayDisplay")
+
+        super().__init__(capacity, limit)
+        self.front = np.zeros((DISPLAY_SIZE, DISPLAY_SIZE), dtype=np.uint8)
+        self.back = np.zeros((DISPLAY_SIZE, DISPLAY_SIZE), dtype=np.uint8)
+        self.frame_ring = np.zeros((capacity, DISPLAY_SIZE, DISPLAY_SIZE), dtype=np.uint8)
+
+    def draw(self, x: int, y: int, width: int, height: int, colour: int) -> None:
+        # Width and height are offset by 1, anything outside the screen is clipped
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + width + 1, DISPLAY_SIZE), min(y + height + 1, DISPLAY_SIZE)
+        if x0 < x1 and y0 < y1:
+            self.back[y0:y1, x0:x1] = colour & 0xFF
+
+    def reset(self) -> None:
+        self.front[:] = 0
+        self.back[:] = 0
+        self.frames = 0
+        self.hashes.clear()
+
+    def swap(self) -> None:
+        self.front, self.back = self.back, self.front
+        self.frames += 1
+
+        slot = self.frame_ring[(self.frames - 1) % self.capacity]
+        slot[:] = self.front
+        self.hashes.append(frame_hash(slot.tobytes()))
+        if self.frames == self.limit:
+            raise Pause()
+
+    def recorded_frames(self) -> list[bytes]:
+        count = min(self.frames, self.capacity)
+        return [self.frame_ring[index % self.capacity].tobytes() for index in range(self.frames - count, self.frames)]
+
+
+def make_display(capacity: int = 1024, limit: int | None = None) -> RecordingDisplay:
+    # NumPy is optional, without it frames are recorded from the plain bytearray display
+    return ArrayDisplay(capacity, limit) if np is not None else RecordingDisplay(capacity, limit)
+
+
+class RenderResult:
+    def __init__(self, display: RecordingDisplay, instructions: int, halted: bool, error: str | None) -> None:
+        self.display = display
+        self.instructions = instructions
+        self.halted = halted
+        self.error = error
+
+    @property
+    def checksum(self) -> str:
+        # Single hash over every frame, in order
+        return hashlib.blake2b("".join(self.display.hashes).encode("utf-8"), digest_size=8).hexdigest()
+
+
+def render(machine_code: list[int], max_cycles: int, max_frames: int | None = None, keyboard: Iterable[int] = (), capacity: int = 1024) -> RenderResult:
+    # The display pauses the emulator at the last frame, so nothing runs after it
+    display = make_display(capacity, max_frames)
+    emu = BlockEmulator(machine_code, keyboard=keyboard, display=display)
+    error = None
+
+    try:
+        if max_frames != 0:
+            emu.run(max_cycles)
+    except EmulatorError as e:
+        error = str(e)
+
+    return RenderResult(display, emu.cycles, emu.halted, error)
+
+
+def frame_rgb(frame: bytes, scale: int) -> list[bytes]:
+    # Rows of 8-bit RGB, each pixel repeated `scale` times in both directions
+    rows: list[bytes] = []
+    for y in range(DISPLAY_SIZE):
+        row = b"".join(bytes(PALETTE[colour]) * scale for colour in frame[y * DISPLAY_SIZE : (y + 1) * DISPLAY_SIZE])
+        rows.extend([row] * scale)
+    return rows
+
+
+def encode_png(frame: bytes, scale: int = 16) -> bytes:
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    size = DISPLAY_SIZE * scale
+    # Each scanline starts with filter type 0
+    raw = b"".join(b"\x00" + row for row in frame_rgb(frame, scale))
+    header = struct.pack(">IIBBBBB", size, size, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(raw, 9)) + chunk(b"IEND", b"")
+
+
+def export_png_sequence(frames: list[bytes], directory: Path, scale: int = 16) -> list[Path]:
+    directory.mkdir(parents=True, exist_ok=True)
+    paths: list[Path] = []
+    for i, frame in enumerate(frames):
+        path = directory / f"frame_{i:05d}.png"
+        path.write_bytes(encode_png(frame, scale))
+        paths.append(path)
+    return paths
+
+
+def export_gif(frames: list[bytes], path: Path, scale: int = 16, fps: float = 14) -> None:
+    # Display colours are already 8-bit palette indices, so frames become palette images without quantizing
+    try:
+        from PIL import Image
+    except ImportError:
+        raise ImportError("Pillow is required to export GIFs, install it with `pip install facpu-assembler[render]`")
+
+    palette = [channel for rgb in PALETTE for channel in rgb]
+    images = []
+    for frame in frames:
+        image = Image.frombytes("P", (DISPLAY_SIZE, DISPLAY_SIZE), frame)
+        image.putpalette(palette)
+        images.append(image.resize((DISPLAY_SIZE * scale, DISPLAY_SIZE * scale), Image.Resampling.NEAREST))
+
+    images[0].save(path, save_all=True, append_images=images[1:], duration=round(1000 / fps), loop=0)
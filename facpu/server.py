@@ -0,0 +1,169 @@
+import json
+import os
+import re
+import traceback
+from contextlib import redirect_stderr, redirect_stdout
+from importlib import import_module
+from io import StringIO
+from pathlib import Path
+from socketserver import StreamRequestHandler, ThreadingUnixStreamServer
+from threading import Lock, Thread
+
+from colored import Fore, Style
+
+from . import cli
+from .assembler import AssemblyError
+from .client import request
+from .factorio import generate_flasher_blueprint
+from .incremental import IncrementalAssembler
+
+# Modules the commands import when they first run, loaded up front so no request pays for them
+WARM_MODULES = ["facpu.analyzer", "facpu.build", "facpu.disasm", "facpu.linker", "facpu.profiler", "facpu.render", "facpu.trace", "draftsman.blueprintable", "draftsman.entity"]
+ANSI_ESCAPE = re.compile(r"\x1b\[[0-9;]*m")
+
+
+def diagnostic(e: Exception) -> dict:
+    # Errors are formatted for the terminal, editors get the plain message and where it is
+    error = e.__context__ if isinstance(e.__context__, AssemblyError) else e
+    if isinstance(error, AssemblyError):
+        return {"message": ANSI_ESCAPE.sub("", str(error)), "line": error.line + 1, "token": error.token, "column": error.column}
+    return {"message": ANSI_ESCAPE.sub("", str(e))}
+
+
+class AssemblerServer(ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: Path) -> None:
+        super().__init__(str(path), AssemblerRequestHandler)
+        # Commands change the working directory and print to stdout, so requests are handled one at a time
+        self.lock = Lock()
+        # An incremental assembler for each file and set of options, so saving a file only reassembles what changed
+        self.assemblers: dict[tuple[str, bool, int | None], IncrementalAssembler] = {}
+        self.requests = 0
+
+    def run(self, message: dict) -> dict:
+        # Runs a facpu command as though from the client's shell, returning what it printed
+        output = StringIO()
+        previous = os.getcwd()
+        try:
+            os.chdir(message["cwd"])
+            with redirect_stdout(output), redirect_stderr(output):
+                try:
+                    code = cli.main(message["argv"])
+                except SystemExit as e:
+                    code = e.code if isinstance(e.code, int) else int(e.code is not None)
+                except Exception:
+                    traceback.print_exc()
+                    code = 1
+        finally:
+            os.chdir(previous)
+
+        return {"ok": True, "exit": code, "output": output.getvalue()}
+
+    def assemble(self, message: dict) -> dict:
+        # Unsaved text from an editor can be sent as `source`, otherwise the file is read
+        file = Path(message.get("cwd", ".")) / message["file"]
+        if "source" in message:
+            lines = message["source"].splitlines(keepends=True)
+        elif file.exists():
+            lines = file.read_text().splitlines(keepends=True)
+        else:
+            return {"ok": False, "diagnostics": [{"message": f"File {file} cannot be found"}]}
+
+        key = (str(file.resolve()), bool(message.get("optimize", False)), message.get("inline"))
+        assembler = self.assemblers.setdefault(key, IncrementalAssembler(optimize=key[1], inline_budget=key[2]))
+        try:
+            program = assembler.update(lines)
+        except Exception as e:
+            return {"ok": False, "diagnostics": [diagnostic(e)]}
+
+        reply = {"ok": True, "diagnostics": [], "machine_code": program.machine_code, "labels": program.labels}
+        if message.get("blueprint", False):
+            reply["blueprint"] = generate_flasher_blueprint(program.machine_code, label=file.name)
+        return reply
+
+    def blueprint(self, message: dict) -> dict:
+        return {"ok": True, "blueprint": generate_flasher_blueprint(message["machine_code"], label=message.get("label"))}
+
+    def handle_message(self, message: dict) -> dict:
+        handlers = {
+            "run": self.run,
+            "assemble": self.assemble,
+            "blueprint": self.blueprint,
+        }
+
+        command = message.get("command")
+        if command == "ping":
+            return {"ok": True, "pid": os.getpid(), "requests": self.requests}
+        if command == "stop":
+            return {"ok": True}
+        if command not in handlers:
+            return {"ok": False, "error": f"Unknown command {command!r}"}
+
+        with self.lock:
+            self.requests += 1
+            try:
+                return handlers[command](message)
+            except KeyError as e:
+                return {"ok": False, "error": f"Command {command!r} is missing {e}"}
+
+
+class AssemblerRequestHandler(StreamRequestHandler):
+    server: AssemblerServer
+
+    def handle(self) -> None:
+        # One JSON object per line in each direction, a connection may send any number of requests
+        for line in self.rfile:
+            try:
+                message = json.loads(line)
+                reply = self.server.handle_message(message) if isinstance(message, dict) else {"ok": False, "error": "Requests must be JSON objects"}
+            except json.JSONDecodeError as e:
+                reply = {"ok": False, "error": f"Invalid JSON: {e}"}
+
+            self.wfile.write(json.dumps(reply).encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+            if reply.get("ok") and message.get("command") == "stop":
+                # shutdown waits for serve_forever to return, so it cannot block the thread handling this request
+                Thread(target=self.server.shutdown).start()
+                return
+
+
+def warm_up() -> None:
+    for module in WARM_MODULES:
+        try:
+            import_module(module)
+        except ImportError:
+            pass
+
+
+def bind(path: Path) -> AssemblerServer:
+    # The socket is created without group or other permissions, so no other user can connect between binding and chmod
+    umask = os.umask(0o177)
+    try:
+        return AssemblerServer(path)
+    finally:
+        os.umask(umask)
+
+
+def serve(path: Path) -> None:
+    if path.exists():
+        try:
+            request({"command": "ping"}, path)
+        except PermissionError:
+            raise Exception(f"{Fore.red}{Style.underline}{path}{Style.res_underline} belongs to another user, set $FACPU_SOCKET to listen somewhere else{Style.reset}")
+        except OSError:
+            # Left behind by a server which did not stop cleanly
+            path.unlink()
+        else:
+            raise Exception(f"{Fore.red}A server is already listening on {Style.underline}{path}{Style.res_underline}{Style.reset}")
+
+    warm_up()
+    with bind(path) as server:
+        print(f"{Fore.green}Listening on {Style.underline}{path}{Style.res_underline}, press Ctrl+C to stop{Style.reset}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            path.unlink(missing_ok=True)
@@ -0,0 +1,116 @@
+import json
+from pathlib import Path
+
+from colored import Fore, Style
+
+from .assembler import AssembledProgram
+from .assembler_instructions import ALIASED_INSTRUCTIONS
+from .hardware_definition import DEFAULT_INSTRUCTION_TICKS, INSTRUCTION_TICKS, INSTRUCTIONS
+from .program import Instruction, label_indices, to_instructions
+
+
+def calibrate(measurements: dict[str, int | dict[str, int]], ticks: dict[str, int] | None = None) -> dict[str, int]:
+    # Measurements are either ticks per instruction, or the ticks taken to run an instruction `count` times.
+    # Aliases (eg. `GDS`) apply to every instruction they resolve to.
+    calibrated = dict(INSTRUCTION_TICKS if ticks is None else ticks)
+
+    for name, measurement in measurements.items():
+        instrs = ALIASED_INSTRUCTIONS.get(name.upper(), [name.upper()])
+        unknown = [instr for instr in instrs if instr not in INSTRUCTIONS]
+        if unknown:
+            raise ValueError(f"Instruction {Style.underline}{name}{Style.res_underline} in timing measurements is unknown")
+
+        if isinstance(measurement, dict):
+            if measurement.get("count", 0) <= 0:
+                raise ValueError(f"Measurement for {Style.underline}{name}{Style.res_underline} needs a positive count")
+            instr_ticks = round(measurement["ticks"] / measurement["count"])
+        else:
+            instr_ticks = int(measurement)
+
+        calibrated.update({instr: instr_ticks for instr in instrs})
+
+    return calibrated
+
+
+def load_calibration(file: Path) -> dict[str, int]:
+    if not file.exists():
+        raise Exception(f"{Fore.red}Timing file {Style.underline}{file}{Style.res_underline} cannot be found{Style.reset}")
+
+    with open(file, "r") as f:
+        try:
+            measurements = json.load(f)
+        except json.JSONDecodeError as e:
+            raise Exception(f"{Fore.red}Timing file {Style.underline}{file}{Style.res_underline} is not valid JSON: {e}{Style.reset}")
+
+    try:
+        return calibrate(measurements)
+    except ValueError as e:
+        raise Exception(f"{Fore.red}{e}{Style.reset}")
+
+
+def calibration_note(ticks: dict[str, int]) -> str:
+    # The default table is flat, so its tick figures are only the instruction count scaled
+    if ticks != INSTRUCTION_TICKS:
+        return ""
+    return f"{Fore.yellow}Ticks are uncalibrated, every instruction counts as {DEFAULT_INSTRUCTION_TICKS} until measured timings are given with --timing{Style.reset}\n"
+
+
+def instruction_ticks(instruction: Instruction, ticks: dict[str, int]) -> int:
+    # Data is never executed so has no cost
+    return ticks.get(instruction.instr, 0)
+
+
+def static_cost(instructions: list[Instruction], ticks: dict[str, int]) -> int:
+    return sum(instruction_ticks(instruction, ticks) for instruction in instructions)
+
+
+def label_costs(instructions: list[Instruction], ticks: dict[str, int]) -> list[tuple[str, int, int, int]]:
+    # Cost of the code from each label up to the next label, as (label, address, instructions, ticks)
+    starts = sorted((address, label) for label, address in label_indices(instructions).items())
+    costs: list[tuple[str, int, int, int]] = []
+
+    for i, (address, label) in enumerate(starts):
+        end = starts[i + 1][0] if i + 1 < len(starts) else len(instructions)
+        if end == address:
+            continue
+        body = instructions[address:end]
+        costs.append((label, address, len(body), static_cost(body, ticks)))
+
+    return costs
+
+
+def loop_costs(instructions: list[Instruction], ticks: dict[str, int]) -> list[tuple[str, int, int, int, int]]:
+    # Every backwards jump closes a loop, its body is costed as if each instruction in it ran once per iteration.
+    # Returns (label, start address, end address, instructions, ticks)
+    indices = label_indices(instructions)
+    costs: list[tuple[str, int, int, int, int]] = []
+
+    for end, instruction in enumerate(instructions):
+        target = instruction.jump_target
+        if instruction.instr == "CALL" or target not in indices or indices[target] > end:
+            continue
+
+        start = indices[target]
+        body = instructions[start : end + 1]
+        costs.append((target, start, end, len(body), static_cost(body, ticks)))
+
+    return costs
+
+
+def format_cost_report(program: AssembledProgram, ticks: dict[str, int], details: bool = False) -> str:
+    instructions, _ = to_instructions(program.processed_lines, program.labels)
+    executable = [instruction for instruction in instructions if not instruction.is_data]
+
+    report = f"{Fore.green}Static cost: {len(executable)} instructions, {static_cost(instructions, ticks)} ticks{Style.reset}\n" + calibration_note(ticks)
+    if not details:
+        return report
+
+    report += f"{Fore.cyan}Labels:{Style.reset}\n"
+    for label, address, count, label_ticks in label_costs(instructions, ticks):
+        report += f"  {label} ({address}): {count} instructions, {label_ticks} ticks\n"
+
+    report += f"{Fore.cyan}Loops (one iteration):{Style.reset}\n"
+    for label, start, end, count, loop_ticks in loop_costs(instructions, ticks):
+        report += f"  {label} ({start}-{end}): {count} instructions, {loop_ticks} ticks\n"
+
+    return report
@@ -0,0 +1,261 @@
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+from typing import Callable
+
+from colored import Fore, Style
+
+from .emulator import Emulator, EmulatorError, Pause, decode
+from .hardware_definition import DEFAULT_INSTRUCTION_TICKS, DISPLAY_SIZE, INSTRUCTION_TICKS
+
+# A key pressed onto the keyboard queue once `cycle` instructions have run, as (cycle, key)
+KeyEvent = tuple[int, int]
+
+# Key codes read by KRD/KRDP for the arrow keys
+ARROW_KEYS = {"A": 128, "B": 129, "C": 130, "D": 131}
+# Instructions replayed between checking the next key press and frame limit
+REPLAY_SLICE = 10_000
+
+
+def parse_trace(text: str, source: str = "trace") -> list[KeyEvent]:
+    # One `<cycle> <key>` press per line, in order of cycle, with `;` comments as in assembly
+    events: list[KeyEvent] = []
+    for line_no, line in enumerate(text.splitlines(), start=1):
+        content = line.split(";", 1)[0].split()
+        if not content:
+            continue
+
+        try:
+            cycle, key = (int(value, 0) for value in content)
+        except ValueError:
+            raise Exception(f"{Fore.red}Line {line_no} of {Style.underline}{source}{Style.res_underline} is not `<cycle> <key>`: {line.strip()}{Style.reset}")
+
+        if cycle < 0 or (events and cycle < events[-1][0]):
+            raise Exception(f"{Fore.red}Line {line_no} of {Style.underline}{source}{Style.res_underline} presses a key at cycle {cycle}, before the line above it{Style.reset}")
+        events.append((cycle, key))
+
+    return events
+
+
+def format_trace(events: list[KeyEvent]) -> str:
+    return "; facpu input trace, <cycle> <key> for each key press\n" + "".join(f"{cycle} {key}\n" for cycle, key in events)
+
+
+def load_trace(path: Path) -> list[KeyEvent]:
+    if not path.exists():
+        raise Exception(f"{Fore.red}Trace {Style.underline}{path}{Style.res_underline} cannot be found{Style.reset}")
+    return parse_trace(path.read_text(), str(path))
+
+
+def save_trace(path: Path, events: list[KeyEvent]) -> None:
+    path.write_text(format_trace(events))
+
+
+def random_trace(rng: random.Random, keys: list[int], interval: int, max_cycles: int) -> list[KeyEvent]:
+    # Presses a random key on average every `interval` instructions
+    events: list[KeyEvent] = []
+    cycle = rng.randint(0, 2 * interval)
+    while cycle < max_cycles:
+        events.append((cycle, rng.choice(keys)))
+        cycle += rng.randint(1, 2 * interval)
+    return events
+
+
+class ReplayEmulator(Emulator):
+    # Counts the instructions and ticks run, noting both at every GSWP so the length of each frame is known
+    def __init__(self, machine_code: list[int], ticks: dict[str, int] = INSTRUCTION_TICKS, frame_limit: int | None = None) -> None:
+        self.tick_costs = ticks
+        self.instructions = 0
+        self.ticks = 0
+        # (instructions, ticks) when each frame was shown
+        self.frame_ends: list[tuple[int, int]] = []
+        # `run` pauses at the GSWP showing this many frames
+        self.frame_limit = frame_limit
+        super().__init__(machine_code)
+
+    def compile(self, address: int, word: int) -> Callable[[int], int]:
+        op = super().compile(address, word)
+        instruction = decode(word)
+        name = instruction[0] if instruction is not None else None
+        cost = self.tick_costs.get(name, DEFAULT_INSTRUCTION_TICKS)
+
+        if name == "GSWP":
+
+            def counted(pc: int) -> int:
+                self.instructions += 1
+                self.ticks += cost
+                self.frame_ends.append((self.instructions, self.ticks))
+                nxt = op(pc)
+                if len(self.frame_ends) == self.frame_limit:
+                    raise Pause
+                return nxt
+
+        else:
+
+            def counted(pc: int) -> int:
+                self.instructions += 1
+                self.ticks += cost
+                return op(pc)
+
+        return counted
+
+
+class ReplayResult:
+    def __init__(self, frames: list[tuple[int, int]], instructions: int, ticks: int, halted: bool, error: str | None) -> None:
+        # (instructions, ticks) of each frame, up to and including its GSWP
+        self.frames = frames
+        self.instructions = instructions
+        self.ticks = ticks
+        self.halted = halted
+        self.error = error
+
+    @property
+    def worst_frame(self) -> int | None:
+        return max(range(len(self.frames)), key=lambda i: self.frames[i][1], default=None)
+
+
+def replay(machine_code: list[int], events: list[KeyEvent], max_cycles: int, max_frames: int | None = None, ticks: dict[str, int] = INSTRUCTION_TICKS) -> ReplayResult:
+    # Runs headless, pressing each key of the trace once its cycle is reached
+    # Stopped at the last frame's GSWP, so the totals do not include instructions run after it
+    emu = ReplayEmulator(machine_code, ticks, max_frames)
+    next_event = 0
+    error = None
+
+    try:
+        while emu.cycles < max_cycles and not emu.halted and (max_frames is None or len(emu.frame_ends) < max_frames):
+            while next_event < len(events) and events[next_event][0] <= emu.cycles:
+                emu.press(events[next_event][1])
+                next_event += 1
+
+            stop = events[next_event][0] if next_event < len(events) else max_cycles
+            if emu.run(min(stop, max_cycles, emu.cycles + REPLAY_SLICE) - emu.cycles) == 0:
+                break
+    except EmulatorError as e:
+        error = str(e)
+
+    frames: list[tuple[int, int]] = []
+    previous = (0, 0)
+    for end in emu.frame_ends:
+        frames.append((end[0] - previous[0], end[1] - previous[1]))
+        previous = end
+
+    return ReplayResult(frames, emu.cycles, emu.ticks, emu.halted, error)
+
+
+def replay_many(machine_code: list[int], traces: list[list[KeyEvent]], max_cycles: int, max_frames: int | None = None, ticks: dict[str, int] = INSTRUCTION_TICKS, jobs: int | None = None) -> list[ReplayResult]:
+    if jobs == 1 or len(traces) <= 1:
+        return [replay(machine_code, events, max_cycles, max_frames, ticks) for events in traces]
+
+    count = len(traces)
+    # Spawned rather than forked, as replays also run inside the threaded server
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=get_context("spawn")) as executor:
+        # Traces are short, so they are sent to the workers in chunks
+        chunksize = max(1, count // ((jobs or os.cpu_count() or 1) * 4))
+        return list(executor.map(replay, [machine_code] * count, traces, [max_cycles] * count, [max_frames] * count, [ticks] * count, chunksize=chunksize))
+
+
+def percentile(values: list[int], fraction: float) -> int:
+    return sorted(values)[min(len(values) - 1, int(len(values) * fraction))] if values else 0
+
+
+def worst_trace(results: list[ReplayResult]) -> int | None:
+    # Index of the trace with the slowest frame, None when no trace showed a frame
+    return max((i for i, result in enumerate(results) if result.frames), key=lambda i: results[i].frames[results[i].worst_frame][1], default=None)
+
+
+def format_replay_summary(names: list[str], results: list[ReplayResult], seconds: float) -> str:
+    frame_ticks = [frame_ticks for result in results for _, frame_ticks in result.frames]
+    summary = f"{Fore.green}Replayed {len(results)} traces in {seconds * 1000:.1f}ms, {sum(len(result.frames) for result in results)} frames{Style.reset}\n"
+
+    worst = worst_trace(results)
+    if worst is not None:
+        summary += f"Frame ticks: median {percentile(frame_ticks, 0.5)}, 90% {percentile(frame_ticks, 0.9)}, 99% {percentile(frame_ticks, 0.99)}, worst {max(frame_ticks)}\n"
+
+        frame = results[worst].worst_frame
+        instructions, ticks = results[worst].frames[frame]
+        summary += f"Worst frame: {ticks} ticks ({instructions} instructions), frame {frame + 1} of {Style.underline}{names[worst]}{Style.res_underline}\n"
+    else:
+        summary += f"{Fore.yellow}No trace reached a GSWP{Style.reset}\n"
+
+    halted = sum(result.halted for result in results)
+    summary += f"{halted} of {len(results)} traces halted"
+
+    for name, result in zip(names, results):
+        if result.error is not None:
+            summary += f"\n{Fore.red}{name}: {result.error}{Style.reset}"
+
+    return summary
+
+
+def read_key(text: str) -> tuple[int | None, str]:
+    # Key code of the first key in terminal input, and the input after it
+    if text.startswith("\x1b[") and len(text) >= 3:
+        return ARROW_KEYS.get(text[2]), text[3:]
+    if text.startswith("\x1b"):
+        return None, text[1:]
+    if text[0] == "\r" or text[0] == "\n":
+        return 10, text[1:]
+    return (ord(text[0]) if ord(text[0]) < 128 else None), text[1:]
+
+
+def draw_frame(frame: bytes) -> str:
+    # Two spaces per pixel, coloured with the display palette
+    from .render import PALETTE
+
+    rows = []
+    for y in range(DISPLAY_SIZE):
+        pixels = frame[y * DISPLAY_SIZE : (y + 1) * DISPLAY_SIZE]
+        rows.append("".join(f"\x1b[48;2;{r};{g};{b}m  " for r, g, b in (PALETTE[colour] for colour in pixels)) + "\x1b[0m")
+    return "\x1b[H" + "\n".join(rows) + "\n"
+
+
+def record(machine_code: list[int], ips: float, max_cycles: int | None = None) -> list[KeyEvent]:
+    # Runs the program in the terminal at `ips` instructions per second, recording the keys pressed until Ctrl+C or Ctrl+D
+    try:
+        import select
+        import termios
+        import tty
+    except ImportError:
+        raise Exception(f"{Fore.red}Recording needs a Unix terminal{Style.reset}")
+
+    if not sys.stdin.isatty():
+        raise Exception(f"{Fore.red}Recording needs a terminal to read keys from{Style.reset}")
+
+    emu = Emulator(machine_code)
+    events: list[KeyEvent] = []
+    shown = -1
+    start = time.perf_counter()
+    settings = termios.tcgetattr(sys.stdin)
+
+    try:
+        tty.setcbreak(sys.stdin.fileno())
+        sys.stdout.write("\x1b[2J")
+        while not emu.halted and (max_cycles is None or emu.cycles < max_cycles):
+            if select.select([sys.stdin], [], [], 1 / 60)[0]:
+                text = os.read(sys.stdin.fileno(), 64).decode("utf-8", "ignore")
+                if "\x04" in text or not text:
+                    break
+                while text:
+                    key, text = read_key(text)
+                    if key is not None:
+                        emu.press(key)
+                        events.append((emu.cycles, key))
+
+            due = int((time.perf_counter() - start) * ips)
+            if due > emu.cycles:
+                emu.run(due - emu.cycles if max_cycles is None else min(due, max_cycles) - emu.cycles)
+
+            if emu.display.frames != shown:
+                shown = emu.display.frames
+                sys.stdout.write(draw_frame(bytes(emu.display.front)) + f"cycle {emu.cycles}, frame {shown}, {len(events)} keys, Ctrl+C to stop\n")
+                sys.stdout.flush()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        termios.tcsetattr(sys.stdin, termios.TCSADRAIN, settings)
+
+    return events
@@ -8,10 +8,11 @@ setup(
     packages=find_packages(),
     entry_points={
         "console_scripts": [
-            "facpu = facpu.cli:main",
+            "facpu = facpu.client:main",
         ],
     },
     install_requires=["colored", "pyperclip", "factorio-draftsman"],
+    extras_require={"render": ["numpy", "Pillow"]},
     author="Joel Cutler",
     description="facPU assembler",
     long_description=(Path(__file__).parent / "README.md").read_text("utf-8"),
@@ -0,0 +1,23 @@
+from pathlib import Path
+
+import pytest
+
+from facpu.assembler import AssembledProgram, assemble_program
+
+DEMOS = sorted((Path(__file__).resolve().parent.parent / "demos").glob("*.fpu"))
+
+
+@pytest.fixture(params=DEMOS, ids=lambda path: path.name)
+def demo(request) -> Path:
+    return request.param
+
+
+@pytest.fixture
+def assemble_source(tmp_path):
+    # Assembles source text as though it were a file, returning the AssembledProgram
+    def assemble_source(source: str, optimize: bool = False, name: str = "program.fpu") -> AssembledProgram:
+        file = tmp_path / name
+        file.write_text(source)
+        return assemble_program(file, optimize)
+
+    return assemble_source
@@ -0,0 +1,51 @@
+from facpu.analyzer import Analyzer, format_analysis
+from facpu.hardware_definition import INSTRUCTION_TICKS
+
+TICKS = INSTRUCTION_TICKS["ADD/I"]
+
+
+def analyze(assemble_source, source: str):
+    program = assemble_source(source)
+    analyzer = Analyzer(program, INSTRUCTION_TICKS)
+    frames = analyzer.analyze_frames()
+    return program, {frame.start: frame for frame in frames}, analyzer.warnings
+
+
+def test_straight_line_frame(assemble_source):
+    _, frames, warnings = analyze(assemble_source, "LI R1 1\nADD R1 R1 2\nGDS 0 0 1 1 R1\nGSWP\nHLT\n")
+
+    summary = frames[0].summary
+    assert (summary.best, summary.worst, summary.worst_instructions, summary.paths) == (4 * TICKS, 4 * TICKS, 4, 1)
+    assert frames[0].path == [0, 1, 2, 3]
+    assert frames[0].loops == []
+    assert frames[4].summary is None and frames[4].halts
+    assert warnings == []
+
+
+def test_counted_loop(assemble_source):
+    _, frames, _ = analyze(assemble_source, "LI R1 0\nloop:\n  ADD R1 R1 1\n  BLT R1 10 loop\nGSWP\nHLT\n")
+
+    (loop,) = frames[0].loops
+    assert loop.members == [1, 2] and loop.trips == 10
+    # The LI and GSWP around ten trips of the two instruction body
+    assert frames[0].summary.worst == (2 + 10 * 2) * TICKS
+    assert frames[0].summary.worst_instructions == 2 + 10 * 2
+
+
+def test_gswp_inside_a_call(assemble_source):
+    source = "main:\n  LI R1 0\n  CALL show\n  ADD R1 R1 1\n  JMP main\nshow:\n  GDS 0 0 1 1 R1\n  GSWP\n  LI R2 0\n  RET\n"
+    program, frames, _ = analyze(assemble_source, source)
+
+    # The CALL ends the frame at the GSWP inside it
+    assert frames[0].summary.worst == 4 * TICKS
+    assert frames[0].path == [0, 1]
+
+    # The next frame finishes the subroutine, returns, and loops round through the CALL to its GSWP again
+    frame = frames[2]
+    assert frame.returning_from == program.labels["show"]
+    assert frame.summary.worst == (2 + 4 + 2) * TICKS
+    assert 7 not in frames
+
+    report = format_analysis(program, list(frames.values()), [])
+    assert "No GSWP reachable" not in report
+    assert "returning from show" in report
@@ -0,0 +1,59 @@
+from facpu.assembler import assemble
+from facpu.block_engine import BlockEmulator
+from facpu.emulator import Emulator
+
+KEYS = [129, 129, 128, 130, 131, 128]
+
+
+def state(emu: Emulator):
+    return (emu.pc, emu.cycles, emu.halted, list(emu.registers), list(emu.memory), list(emu.call_stack), list(emu.keyboard), bytes(emu.display.front), bytes(emu.display.back), emu.display.frames)
+
+
+def states(engine: type[Emulator], machine_code: list[int], slices: list[int]) -> list:
+    # The state after each slice, resetting halted programs, so the engines are compared mid-block too
+    emu = engine(machine_code, keyboard=KEYS)
+    snapshots = []
+    for cycles in slices:
+        if emu.halted:
+            emu.reset(keyboard=KEYS)
+        emu.run(cycles)
+        snapshots.append(state(emu))
+    return snapshots
+
+
+def test_block_engine_matches_stepping(demo):
+    slices = [1, 7, 63, 64, 65, 1000, 3, 20_000] * 3
+    machine_code = assemble(demo)
+    assert states(BlockEmulator, machine_code, slices) == states(Emulator, machine_code, slices)
+
+
+def test_block_engine_matches_single_steps(demo):
+    machine_code = assemble(demo)
+    block = BlockEmulator(machine_code, keyboard=KEYS)
+    stepping = Emulator(machine_code, keyboard=KEYS)
+    for _ in range(3000):
+        block.step()
+        stepping.step()
+        assert state(block) == state(stepping)
+
+
+def test_self_modifying_block(assemble_source):
+    # The store rewrites an instruction later in the running block, and in a block compiled earlier
+    program = assemble_source(
+        """
+        loop: ADD R2 R2 1
+        LD R3 replacement
+        ST target R3
+        target: LI R1 1
+        ST earlier R3
+        BLT R2 3 loop
+        earlier: LI R1 5
+        HLT
+        replacement: LI R1 2
+        """
+    )
+    slices = [1, 2, 5, 100]
+    assert states(BlockEmulator, program.machine_code, slices) == states(Emulator, program.machine_code, slices)
+    emu = BlockEmulator(program.machine_code)
+    emu.run(100)
+    assert emu.halted and emu.registers[1] == 2
@@ -0,0 +1,50 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from facpu.assembler import assemble_program
+from facpu.build import build, find_sources, format_build_summary
+from facpu.cli import main
+from facpu.factorio import generate_flasher_blueprint
+from facpu.image import load_image, load_symbols, symbols_path
+
+DEMO_DIRECTORY = Path(__file__).resolve().parent.parent / "demos"
+DEMOS = [DEMO_DIRECTORY / "player_controller.fpu", DEMO_DIRECTORY / "pong.fpu"]
+
+
+@pytest.mark.parametrize("output_format", ["blueprint", "json", "bin"])
+def test_parallel_builds_match_assembling_each_file(tmp_path, output_format):
+    results = build(DEMOS, tmp_path, output_format=output_format, jobs=2)
+    assert [result.source for result in results] == DEMOS
+
+    for source, result in zip(DEMOS, results):
+        assert result.error is None
+        program = assemble_program(source)
+        assert result.words == len(program.machine_code)
+
+        if output_format == "blueprint":
+            assert result.output.read_text() == generate_flasher_blueprint(program.machine_code, label=source.name)
+        elif output_format == "json":
+            assert json.loads(result.output.read_text()) == program.machine_code
+        else:
+            assert list(load_image(result.output)) == program.machine_code
+            assert load_symbols(symbols_path(result.output)) == program.labels
+
+
+def test_failures_are_reported_without_stopping_the_build(tmp_path):
+    for source in DEMOS:
+        (tmp_path / source.name).write_text(source.read_text())
+    (tmp_path / "broken.fpu").write_text("NOP\nFOO R1\n")
+
+    results = build(find_sources(str(tmp_path)), output_format="json", jobs=2)
+    assert [result.source.name for result in results] == ["broken.fpu", "player_controller.fpu", "pong.fpu"]
+    assert results[0].error is not None and "FOO" in results[0].error and results[0].output is None
+    assert all(result.error is None and result.output.exists() for result in results[1:])
+
+    summary = format_build_summary(results, 0.1)
+    assert "failed" in summary and "Built 2 of 3 programs" in summary
+
+    assert main(["build", str(tmp_path), "--image", "-j", "2"]) == 1
+    (tmp_path / "broken.fpu").unlink()
+    assert main(["build", str(tmp_path), "--image", "-j", "2"]) == 0
@@ -0,0 +1,87 @@
+import random
+
+from facpu.constants import MAX_IMMEDIATE, MAX_WORD, pooled_constants, run_sequence, shortest_sequence
+from facpu.emulator import Emulator
+from facpu.hardware_definition import DEFAULT_INSTRUCTION_TICKS, INSTRUCTION_TICKS
+from facpu.program import to_instructions
+from facpu.timing import calibrate
+
+# Targets checked against the brute force search
+LIMIT = 1 << 13
+
+
+def brute_force_lengths(limit: int) -> dict[int, int]:
+    # Breadth first from every LI over all values a sequence can pass through on the way to one below `limit`.
+    # Only SUB and XOR make a value smaller, by at most an immediate each, so larger values can never lead back.
+    bound = limit + (MAX_IMMEDIATE + 1) * 7
+    lengths = {value: 1 for value in range(MAX_IMMEDIATE + 1)}
+    frontier = set(lengths)
+    depth = 1
+    while frontier:
+        depth += 1
+        found: set[int] = set()
+        for value in frontier:
+            # ADD and SUB, which cover XOR and OR as those stay within the same 1024 values
+            found.update(range(max(value - MAX_IMMEDIATE, 0), min(value + MAX_IMMEDIATE + 1, bound)))
+            found.update(range(2 * value, min((MAX_IMMEDIATE + 1) * value, bound), value or bound))
+            found.update(value << shift for shift in range(10, 31) if value << shift < bound)
+            power = value * value
+            while 1 < value and power < bound:
+                found.add(power)
+                power *= value
+        frontier = found - lengths.keys()
+        lengths.update({value: depth for value in frontier})
+    return lengths
+
+
+def load(assemble_source, source: str) -> Emulator:
+    emu = Emulator(assemble_source(source).machine_code)
+    emu.run(1000)
+    return emu
+
+
+def test_sequences_are_shortest():
+    lengths = brute_force_lengths(LIMIT)
+    for value in range(LIMIT):
+        sequence = shortest_sequence(value)
+        assert run_sequence(sequence) == value
+        assert len(sequence) == lengths[value], value
+
+
+def test_large_values():
+    rng = random.Random(0)
+    for value in [MAX_WORD, 1 << 30, 5000, *(rng.randint(0, MAX_WORD) for _ in range(20))]:
+        assert run_sequence(shortest_sequence(value)) == value
+
+    # Needs two MUL with even factors, LI 746, MUL 863, MUL 564
+    assert len(shortest_sequence(363102072)) == 3
+    assert shortest_sequence(5000) == (("LI", 625), ("SHL/I", 3))
+
+
+def test_single_use_is_not_pooled(assemble_source):
+    program = assemble_source("LIW R1 5000\nHLT")
+    assert program.processed_lines == [(0, "LI R1 625"), (0, "SHL/I R1 R1 3"), (1, "HLT")]
+
+
+def test_repeated_use_is_pooled(assemble_source):
+    source = "LIW R1 123456789\nLIW R2 123456789\nLIW R3 5000\nHLT"
+    program = assemble_source(source)
+    # Two LD and a DAT word take fewer words and ticks than two 4 instruction sequences
+    assert [content.split()[0] for _, content in program.processed_lines] == ["LD", "LD", "LI", "SHL/I", "HLT", "DAT"]
+
+    emu = load(assemble_source, source)
+    assert emu.registers[1:4] == [123456789, 123456789, 5000]
+
+
+def test_slow_loads_are_not_pooled():
+    instructions, _ = to_instructions([(0, "LIW R1 5000"), (1, "LIW R2 5000"), (2, "HLT")], {})
+    assert pooled_constants(instructions, INSTRUCTION_TICKS) == {5000}
+    # A LD costing as much as LI and SHL together is not worth the extra word
+    assert pooled_constants(instructions, calibrate({"LD": 2 * DEFAULT_INSTRUCTION_TICKS})) == set()
+
+
+def test_loaded_values(assemble_source):
+    values = [0, MAX_IMMEDIATE, MAX_IMMEDIATE + 1, 363102072, MAX_WORD]
+    emu = load(assemble_source, "\n".join(f"LIW R{i + 1} {value}" for i, value in enumerate(values)) + "\nHLT")
+    assert emu.halted
+    assert emu.registers[1 : len(values) + 1] == values
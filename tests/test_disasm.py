@@ -0,0 +1,46 @@
+import random
+
+import pytest
+
+from facpu.assembler import assemble_program
+from facpu.disasm import disassemble
+from facpu.image import load_image, load_symbols, symbols_path, write_image
+
+
+def reassemble(tmp_path, listing: str) -> list[int]:
+    file = tmp_path / "listing.fpu"
+    file.write_text(listing)
+    return assemble_program(file).machine_code
+
+
+@pytest.mark.parametrize("with_symbols", [False, True], ids=["numbers", "symbols"])
+def test_demos_round_trip(demo, tmp_path, with_symbols):
+    program = assemble_program(demo)
+    listing = disassemble(program.machine_code, program.labels if with_symbols else None)
+    assert reassemble(tmp_path, listing) == program.machine_code
+
+
+def test_random_words_round_trip(tmp_path):
+    rng = random.Random(0)
+    words = [rng.getrandbits(31) for _ in range(500)]
+    assert reassemble(tmp_path, disassemble(words)) == words
+
+
+def test_images_round_trip(demo, tmp_path):
+    program = assemble_program(demo)
+    image = tmp_path / "program.bin"
+    assert write_image(image, program.machine_code, program.labels) == 4 * len(program.machine_code)
+
+    assert list(load_image(image)) == program.machine_code
+    assert load_symbols(symbols_path(image)) == program.labels
+    assert reassemble(tmp_path, disassemble(load_image(image), load_symbols(symbols_path(image)))) == program.machine_code
+
+
+def test_empty_and_truncated_images(tmp_path):
+    image = tmp_path / "empty.bin"
+    write_image(image, [])
+    assert list(load_image(image)) == []
+
+    image.write_bytes(b"\x01\x02\x03")
+    with pytest.raises(Exception, match="not a whole number of words"):
+        load_image(image)
@@ -0,0 +1,112 @@
+import random
+
+import pytest
+
+from facpu.assembler import assemble, assemble_line
+from facpu.emulator import Emulator, EmulatorError, alu_div, alu_mod, decode, to_int32
+from facpu.hardware_definition import INSTRUCTIONS, OPCODE_SIZE, PARAM_SIZE
+
+
+def test_decode_reads_the_fields_the_assembler_writes():
+    rng = random.Random(0)
+    for name, info in INSTRUCTIONS.items():
+        for _ in range(20):
+            fields = [rng.randrange(1 << PARAM_SIZE[ptype]) for ptype in info["params"]]
+            params = [f"R{value}" if ptype == "reg" else str(value) for ptype, value in zip(info["params"], fields)]
+            word = assemble_line((0, " ".join([name] + params)), {})
+            assert word >> (31 - OPCODE_SIZE) == info["opcode"]
+            assert decode(word) == (name, fields)
+
+
+def test_alu_matches_32_bit_hardware():
+    assert to_int32(0x7FFFFFFF + 1) == -0x80000000
+    assert alu_div(-7, 2) == -3
+    assert alu_div(7, 0) == 0
+    assert alu_mod(-7, 2) == -1
+    assert alu_mod(7, 0) == 0
+
+
+def test_program_runs_to_halt(assemble_source):
+    program = assemble_source(
+        """
+        LI R1 6
+        LI R2 7
+        CALL multiply
+        ST result R3
+        HLT
+        multiply: MUL R3 R1 R2
+        RET
+        result: DAT 0
+        """
+    )
+    emu = Emulator(program.machine_code)
+    emu.run(100)
+    assert emu.halted
+    assert emu.cycles == 7
+    assert emu.memory[program.labels["result"]] == 42
+    assert emu.call_stack == []
+
+
+def test_keyboard_and_display(assemble_source):
+    program = assemble_source(
+        """
+        KRDP R1
+        KRD R2
+        KRD R3
+        KRD R4
+        GDS 1 2 3 0 R2
+        GSWP
+        HLT
+        """
+    )
+    emu = Emulator(program.machine_code, keyboard=[128, 5])
+    emu.run()
+    assert emu.registers[1:5] == [128, 128, 5, 0]
+    assert emu.display.frames == 1
+    assert emu.display.front[2 * 16 + 1 : 2 * 16 + 5] == bytes([128] * 4)
+    assert emu.display.front[2 * 16 + 5] == 0
+
+
+def test_stored_instructions_are_recompiled(assemble_source):
+    # The loop overwrites its own `LI R1 1` with `LI R1 2` the first time round
+    program = assemble_source(
+        """
+        loop: ADD R2 R2 1
+        target: LI R1 1
+        LD R3 replacement
+        ST target R3
+        BLT R2 2 loop
+        HLT
+        replacement: LI R1 2
+        """
+    )
+    emu = Emulator(program.machine_code)
+    emu.run(100)
+    assert emu.halted
+    assert emu.registers[1] == 2
+
+
+@pytest.mark.parametrize(
+    "source, message",
+    [
+        ("RET", "empty call stack"),
+        ("loop: CALL loop", "Call stack overflow"),
+        ("JMP 5", "Unknown opcode"),
+    ],
+)
+def test_errors(assemble_source, source, message):
+    machine_code = assemble_source(source).machine_code
+    machine_code += [0b1111111 << (31 - OPCODE_SIZE)] * 8
+    emu = Emulator(machine_code)
+    with pytest.raises(EmulatorError, match=message):
+        emu.run(100)
+
+
+def test_reset_restores_the_program(demo):
+    emu = Emulator(assemble(demo), keyboard=[128, 130])
+    emu.run(5000)
+    emu.reset(keyboard=[128, 130])
+    fresh = Emulator(assemble(demo), keyboard=[128, 130])
+    emu.run(5000)
+    fresh.run(5000)
+    assert (emu.registers, emu.memory, emu.pc, emu.cycles, emu.display.frames) == (fresh.registers, fresh.memory, fresh.pc, fresh.cycles, fresh.display.frames)
@@ -0,0 +1,43 @@
+import pytest
+
+from facpu.assembler import assemble
+from facpu.factorio import generate_draftsman_blueprint, generate_flasher_blueprint
+from facpu.flashing import delta_addresses
+
+pytest.importorskip("draftsman")
+
+# Largest program the address space can hold, with words covering the full 31 bit range
+LARGE_PROGRAM = [(i * 2654435761) & 0x7FFFFFFF for i in range(1024)]
+
+
+def test_full_flash_matches_draftsman(demo):
+    machine_code = assemble(demo)
+    assert generate_flasher_blueprint(machine_code, label=demo.name) == generate_draftsman_blueprint(machine_code, label=demo.name)
+
+
+def test_delta_flash_matches_draftsman(demo):
+    machine_code = assemble(demo)
+    previous = list(machine_code)
+    previous[len(previous) // 2] ^= 1
+    previous[1] ^= 1 << 30
+    addresses = delta_addresses(previous, machine_code)
+    assert len(addresses) < len(machine_code) or len(machine_code) <= 4
+    assert generate_flasher_blueprint(machine_code, label=demo.name, addresses=addresses) == generate_draftsman_blueprint(machine_code, label=demo.name, addresses=addresses)
+
+
+@pytest.mark.parametrize(
+    "machine_code, label, addresses",
+    [
+        ([], None, None),
+        ([1, 2, 3], None, None),
+        (LARGE_PROGRAM, "1024 words", None),
+        (LARGE_PROGRAM, "delta", [0, 5, 700, 1023]),
+        (LARGE_PROGRAM, "unchanged", []),
+    ],
+)
+def test_edge_cases_match_draftsman(machine_code, label, addresses):
+    assert generate_flasher_blueprint(machine_code, label=label, addresses=addresses) == generate_draftsman_blueprint(machine_code, label=label, addresses=addresses)
+
+
+def test_validate_uses_draftsman():
+    assert generate_flasher_blueprint([7], label="x", validate=True) == generate_draftsman_blueprint([7], label="x")
@@ -0,0 +1,70 @@
+from facpu.flashing import FlashSession, delta_addresses, flashed_image, image_path, load_flashed_image, save_flashed_image
+
+
+def paste(memory: list[int], machine_code: list[int], addresses: list[int]) -> list[int]:
+    # Memory of the CPU after a delta blueprint is pasted
+    memory = list(memory)
+    for address in addresses:
+        memory[address] = machine_code[address]
+    return memory
+
+
+def test_delta_addresses():
+    assert delta_addresses([1, 2, 3, 4], [1, 2, 3, 4]) == []
+    # The first and last words keep the delta lined up with the flasher
+    assert delta_addresses([1, 2, 3, 4, 5], [1, 2, 9, 4, 5]) == [0, 2, 4]
+    # Words past the end of the old image were never flashed
+    assert delta_addresses([1, 2], [1, 2, 3, 4]) == [0, 2, 3]
+    assert delta_addresses([1, 2, 3, 4], [1, 2]) == []
+    assert delta_addresses([1, 2, 3, 4], [1, 2, 3, 4], {2, 7}) == [0, 2, 3]
+
+
+def test_flashed_image():
+    assert flashed_image([1, 2, 3], [4, 5]) == [4, 5, 3]
+    assert flashed_image([1], [4, 5, 6]) == [4, 5, 6]
+    assert flashed_image([], []) == []
+
+
+def test_images_are_saved(tmp_path):
+    source = tmp_path / "program.fpu"
+    assert load_flashed_image(source) is None
+
+    save_flashed_image(source, [1, 2, 3])
+    assert load_flashed_image(source) == [1, 2, 3]
+
+    image_path(source).write_text("not json")
+    assert load_flashed_image(source) is None
+
+
+def test_unpasted_deltas_are_flashed_again(tmp_path):
+    source = tmp_path / "program.fpu"
+    save_flashed_image(source, [1, 2, 3, 4, 5])
+    memory = [1, 2, 3, 4, 5]
+
+    # Three saves under --watch, where the first and last blueprints are pasted but not the second
+    session = FlashSession(source)
+    versions = [[1, 9, 3, 4, 5], [1, 9, 3, 8, 5], [1, 2, 3, 8, 5]]
+    for i, machine_code in enumerate(versions):
+        addresses = session.addresses(machine_code)
+        session.flashed(machine_code)
+        if i != 1:
+            memory = paste(memory, machine_code, addresses)
+
+    # Word 3 was first changed by the unpasted blueprint, and word 1 is changed back by the last one
+    assert addresses == [0, 1, 3, 4]
+    assert memory == versions[-1]
+    assert load_flashed_image(source) == versions[-1]
+
+    # A later run takes the last blueprint as flashed
+    assert FlashSession(source).addresses(versions[-1]) == []
+
+
+def test_every_word_is_flashed_without_an_image(tmp_path):
+    source = tmp_path / "program.fpu"
+    session = FlashSession(source)
+    assert session.addresses([1, 2]) is None
+    session.flashed([1, 2])
+    assert session.addresses([1, 3]) is None
+
+    assert FlashSession(source, full=True).addresses([1, 2]) is None
+    assert FlashSession(source).addresses([1, 2]) == []
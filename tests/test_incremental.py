@@ -0,0 +1,77 @@
+import random
+
+import pytest
+
+from facpu.assembler import assemble_program
+from facpu.incremental import IncrementalAssembler, changed_ranges
+
+EDITS = 40
+
+
+def edit(rng: random.Random, lines: list[str]) -> list[str]:
+    lines = list(lines)
+    i = rng.randrange(len(lines) + 1)
+    kind = rng.randrange(5)
+    if kind == 0:
+        lines.insert(i, "  NOP\n")
+    elif kind == 1 and lines:
+        del lines[min(i, len(lines) - 1)]
+    elif kind == 2 and lines:
+        # May duplicate a label, which must fail the same way
+        lines.insert(i, rng.choice(lines))
+    elif kind == 3:
+        lines.insert(i, f"  LI R{rng.randrange(16)} {rng.randrange(1024)}\n")
+    else:
+        lines.insert(i, f"#define(EXTRA_{rng.randrange(3)}, NOP)\n")
+    return lines
+
+
+def full(tmp_path, lines: list[str], optimize: bool):
+    file = tmp_path / "full.fpu"
+    file.write_text("".join(lines))
+    try:
+        return assemble_program(file, optimize).machine_code
+    except Exception:
+        return None
+
+
+def incremental(assembler: IncrementalAssembler, lines: list[str]):
+    try:
+        return assembler.update(lines).machine_code
+    except Exception:
+        return None
+
+
+@pytest.mark.parametrize("optimize", [False, True])
+def test_incremental_matches_full_assembly(demo, tmp_path, optimize):
+    rng = random.Random(demo.name)
+    lines = demo.read_text().splitlines(keepends=True)
+    assembler = IncrementalAssembler(optimize=optimize)
+
+    valid = lines
+    for _ in range(EDITS):
+        expected = full(tmp_path, lines, optimize)
+        assert incremental(assembler, lines) == expected
+        # After an edit that fails, go back to the last good source, as an editor undoing it would
+        if expected is not None:
+            valid = lines
+        lines = edit(rng, valid)
+
+
+def test_only_changed_lines_are_reassembled(demo):
+    lines = demo.read_text().splitlines(keepends=True)
+    assembler = IncrementalAssembler()
+    assembler.update(lines)
+
+    assembler.update(lines)
+    assert (assembler.preprocessed, assembler.encoded) == (0, 0)
+
+    # Appending a line shifts no labels, so only it is encoded
+    assembler.update(lines + ["  NOP\n"])
+    assert (assembler.preprocessed, assembler.encoded) == (1, 1)
+
+
+def test_changed_ranges():
+    assert changed_ranges(["a", "b", "c"], ["a", "x", "c"]) == [(1, 2, 1, 2)]
+    assert changed_ranges(["a", "b"], ["a", "b", "c"]) == [(2, 2, 2, 3)]
+    assert changed_ranges(["a", "b"], ["a", "b"]) == []
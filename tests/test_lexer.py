@@ -0,0 +1,87 @@
+import re
+
+import pytest
+
+from facpu.assembler import AssemblyError, line_words, match_brackets, parse_macros
+from facpu.lexer import token_end, tokenize
+from facpu.macros import UserMacroRegistry
+
+
+def test_token_kinds_and_positions():
+    line = "  loop: ADD R1, R1 #col(1,2,3) ; done: (x)"
+    assert tokenize(line, 3) == [
+        ("label", "loop", 3, 2),
+        ("word", "ADD", 3, 8),
+        ("word", "R1", 3, 12),
+        ("comma", ",", 3, 14),
+        ("word", "R1", 3, 16),
+        ("macro", "col", 3, 19),
+        ("lparen", "(", 3, 23),
+        ("word", "1", 3, 24),
+        ("comma", ",", 3, 25),
+        ("word", "2", 3, 26),
+        ("comma", ",", 3, 27),
+        ("word", "3", 3, 28),
+        ("rparen", ")", 3, 29),
+    ]
+    # Every token is found at its column in the source line
+    for kind, text, _, column in tokenize(line, 3):
+        assert line[column : token_end((kind, text, 3, column))] == {"label": f"{text}:", "macro": f"#{text}"}.get(kind, text)
+
+
+def test_comments():
+    assert tokenize("; only a comment", 0) == []
+    assert tokenize("NOP;HLT", 0) == [("word", "NOP", 0, 0)]
+    assert tokenize("", 0) == []
+
+
+def test_labels():
+    assert tokenize("a: b:c", 0) == [("label", "a", 0, 0), ("label", "b", 0, 3), ("word", "c", 0, 5)]
+    # Inside macro arguments labels are plain words
+    assert tokenize("a: b:c", 0, labels=False) == [("word", "a:", 0, 0), ("word", "b:", 0, 3), ("word", "c", 0, 5)]
+
+
+def test_bracket_matching():
+    tokens = tokenize("#a(#b(1) (2)) (", 0)
+    # Opening token index to its closing index and whether a macro is inside, unclosed ones run to the end
+    assert match_brackets(tokens) == {1: (9, True), 3: (5, False), 6: (8, False), 10: (11, False)}
+
+
+@pytest.mark.parametrize(
+    "line, column",
+    [
+        ("NOP )", 4),
+        ("  LI R1 (", 8),
+        ("(LI R1 2)", 0),
+        ("LI R1 #col(000000))", 18),
+        ("LI R1 #col(000000) (2)", 19),
+        ("LI R1 #col (000000)", 11),
+    ],
+)
+def test_unbalanced_brackets(line, column):
+    with pytest.raises(AssemblyError, match="Unexpected") as error:
+        line_words(line, tokenize(line, 6), 6, UserMacroRegistry())
+    assert (error.value.line, error.value.column) == (6, column)
+    assert line[column] == error.value.token
+
+
+def test_unclosed_arguments_run_to_the_end():
+    line = "LI R1 #col(0000ff"
+    assert line_words(line, tokenize(line, 0), 0, UserMacroRegistry()) == ["LI", "R1", "3"]
+
+
+def old_preprocessing(line: str, line_no: int, registry: UserMacroRegistry) -> tuple[list[str], list[str]]:
+    # Labels and words as the regular expressions before the lexer found them
+    clean_line = line.split(";")[0].strip()
+    labels = re.findall(r"([^\s]+):", clean_line)
+    clean_line = parse_macros(re.sub(r"[^\s]+:", "", clean_line).strip(), line_no, registry)
+    return labels, [word for word in re.split(r"[,\s]+", clean_line) if word]
+
+
+def test_demos_match_the_old_preprocessing(demo):
+    old_registry = UserMacroRegistry()
+    registry = UserMacroRegistry()
+    for line_no, line in enumerate(demo.read_text().splitlines()):
+        tokens = tokenize(line, line_no)
+        labels = [text for kind, text, _, _ in tokens if kind == "label"]
+        assert (labels, line_words(line, tokens, line_no, registry)) == old_preprocessing(line, line_no, old_registry), line
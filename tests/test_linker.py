@@ -0,0 +1,103 @@
+import pytest
+
+from facpu.assembler import assemble_program
+from facpu.emulator import Emulator
+from facpu.linker import assemble_object, link, load_object
+
+LIBRARY = """
+lib_double:
+  ADD R1 R1 R1
+  RET
+lib_unused:
+  LI R2 99
+  RET
+lib_triple:
+  CALL _add_once
+  CALL _add_once
+  RET
+_add_once:
+  ADD R1 R1 R3
+  RET
+"""
+
+
+@pytest.fixture
+def write_object(tmp_path):
+    # Assembles source text as a file of its own, returning its ObjectFile
+    def write_object(name: str, source: str):
+        file = tmp_path / name
+        file.write_text(source)
+        return assemble_object(file, file.read_text().splitlines(keepends=True))
+
+    return write_object
+
+
+def run(machine_code: list[int]) -> Emulator:
+    emu = Emulator(machine_code)
+    emu.run(1000)
+    assert emu.halted
+    return emu
+
+
+def test_relocations(write_object):
+    main = write_object("main.fpu", "LI R1 5\nCALL lib_double\nLD R4 value\nHLT\nvalue: DAT 42\n")
+    program = link([main, write_object("lib.fpu", LIBRARY)])
+
+    emu = run(program.machine_code)
+    assert emu.registers[1] == 10
+    assert emu.registers[4] == 42
+    assert program.symbols["lib.lib_double"] == 5
+
+
+def test_linking_one_file_matches_assembling_it(demo, tmp_path):
+    source = tmp_path / demo.name
+    source.write_text(demo.read_text())
+    assert link([load_object(source)]).machine_code == assemble_program(demo).machine_code
+    # Loaded again from the object file written beside it
+    assert load_object(source).cached
+
+
+def test_unused_routines_are_dropped(write_object):
+    main = write_object("main.fpu", "LI R1 2\nLI R3 5\nCALL lib_triple\nHLT\n")
+    program = link([main, write_object("lib.fpu", LIBRARY)])
+
+    assert [routine.name for routine in program.dropped] == ["lib_double", "lib_unused"]
+    assert run(program.machine_code).registers[1] == 12
+    assert len(link([main, write_object("lib.fpu", LIBRARY)], keep_unused=True).machine_code) == len(program.machine_code) + 4
+
+
+def test_private_labels(write_object):
+    main = write_object("main.fpu", "CALL _add_once\nHLT\n")
+    with pytest.raises(Exception, match="Undefined symbol"):
+        link([main, write_object("lib.fpu", LIBRARY)])
+
+    # Each file has its own private labels, so the same name can be used in both
+    main = write_object("main.fpu", "LI R3 1\nCALL lib_triple\nCALL _add_once\nHLT\n_add_once:\n  ADD R1 R1 100\n  RET\n")
+    assert run(link([main, write_object("lib.fpu", LIBRARY)]).machine_code).registers[1] == 102
+
+
+def test_duplicate_symbols(write_object):
+    main = write_object("main.fpu", "CALL lib_double\nHLT\n")
+    with pytest.raises(Exception, match="is defined in"):
+        link([main, write_object("a.fpu", LIBRARY), write_object("b.fpu", LIBRARY)])
+
+
+def test_symbols_must_fit_their_field(write_object):
+    main = write_object("main.fpu", "CALL lib_double\nGDS far 0 0 0 1\nHLT\n")
+    # GDS coordinates are 4 bits, so a label past address 15 cannot be one
+    library = write_object("lib.fpu", LIBRARY + "  DAT 0\n" * 20 + "far: DAT 0\n")
+    with pytest.raises(Exception, match="far.* at address 32 does not fit in its field"):
+        link([main, library], keep_unused=True)
+
+
+def test_virtual_registers_are_not_linked(write_object):
+    # Both files would be given R0 for their virtual register, so the library would overwrite %a
+    main = write_object("main.fpu", "LI %a 5\nCALL lib_fn\nADD R1 %a 0\nHLT\n")
+    library = write_object("lib.fpu", "lib_fn:\n  LI %t 7\n  ST scratch %t\n  RET\nscratch: DAT 0\n")
+    with pytest.raises(Exception, match="main.fpu line 1 uses a virtual register"):
+        link([main, library])
+    with pytest.raises(Exception, match="lib.fpu line 2 uses a virtual register"):
+        link([write_object("main.fpu", "CALL lib_fn\nHLT\n"), library])
+
+    # A file on its own is given registers as when it is assembled
+    assert run(link([write_object("main.fpu", "LI %a 5\nADD R1 %a 0\nHLT\n")]).machine_code).registers[1] == 5
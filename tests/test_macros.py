@@ -0,0 +1,77 @@
+import sys
+
+import pytest
+
+from facpu.assembler import AssemblyError, parse_macros
+from facpu.macros import MAX_MACRO_DEPTH, MacroTemplate, UserMacroRegistry
+
+MACROS = {"pair": "$1, $2", "twice": "$1 $1", "last": "$0"}
+
+
+def fresh_expansion(macro: str, args: list[str], registry: UserMacroRegistry) -> str:
+    # Expanded from the definition without going through the registry's memo
+    return MacroTemplate(macro, registry.macros[macro]).expand(tuple(args), 0)
+
+
+def test_memoized_nested_calls():
+    registry = UserMacroRegistry(MACROS)
+    line = "LI R1 #pair(#last(1, 2), #twice(3)) #twice(3)"
+
+    first = parse_macros(line, 0, registry)
+    assert first == "LI R1 2, 3 3 3 3"
+    # Every call, inner ones included, was memoized once and is reused
+    assert len(registry.expansions) == 3
+    assert parse_macros(line, 0, registry) == first
+    assert len(registry.expansions) == 3
+
+    assert parse_macros(line, 0, UserMacroRegistry(MACROS)) == first
+    for (template, args), expansion in registry.expansions.items():
+        assert expansion == fresh_expansion(template.name, list(args), registry)
+
+
+def test_redefined_macros_are_expanded_again():
+    registry = UserMacroRegistry()
+    parse_macros("#define(inc, ADD $1 $1 1)", 0, registry)
+    assert parse_macros("#inc(R1)", 1, registry) == "ADD R1 R1 1"
+
+    parse_macros("#define(inc, SUB $1 $1 1)", 2, registry)
+    assert parse_macros("#inc(R1)", 3, registry) == "SUB R1 R1 1"
+    assert all(template.body == "SUB $1 $1 1" for template, _ in registry.expansions)
+
+    # Defining it back gives the first body again
+    parse_macros("#define(inc, ADD $1 $1 1)", 4, registry)
+    assert parse_macros("#inc(R1)", 5, registry) == "ADD R1 R1 1"
+
+
+def test_missing_parameters():
+    registry = UserMacroRegistry(MACROS)
+    with pytest.raises(AssemblyError, match="requires at least 2 params, but got 1") as error:
+        parse_macros("LI R1 #pair(1)", 3, registry)
+    assert error.value.line == 3
+    assert not registry.expansions
+
+
+def test_nesting_is_limited():
+    registry = UserMacroRegistry({"id": "$1"})
+
+    def nested(depth: int) -> str:
+        return "LI R1 " + "#id(" * depth + "1" + ")" * depth
+
+    assert parse_macros(nested(MAX_MACRO_DEPTH), 0, registry) == "LI R1 1"
+
+    # Far deeper than a lowered recursion limit, which must not be what stops it
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(200)
+    try:
+        with pytest.raises(AssemblyError, match=f"nested more than {MAX_MACRO_DEPTH} deep") as error:
+            parse_macros(nested(1000), 12, registry)
+    finally:
+        sys.setrecursionlimit(limit)
+    assert error.value.line == 12
+    assert error.value.column == len("LI R1 ") + 4 * MAX_MACRO_DEPTH
+
+
+def test_nesting_error_in_a_file(assemble_source):
+    source = "NOP\n#define(id, $1)\nLI R1 " + "#id(" * 500 + "1" + ")" * 500 + "\n"
+    with pytest.raises(Exception, match="Error on line 3"):
+        assemble_source(source)
@@ -0,0 +1,81 @@
+import json
+
+from facpu.assembler import assemble_program
+from facpu.cache import assemble_cached, save_entry
+from facpu.emulator import Emulator
+from facpu.optimizer import OptimizationReport
+from facpu.render import render
+
+KEYS = [129, 129, 128, 130, 131, 128, 128, 130, 130, 129]
+
+PASSES_SOURCE = """
+  LI R1 3
+  ADD R1 R1 2     ; folded into LI R1 5
+  MOV R2 R2       ; removed
+  JMP next        ; threaded to draw
+next: JMP draw
+  NOP             ; unreachable
+draw:
+  GDS 0 0 15 15 0  ; overdrawn
+  GDS 0 0 15 15 1
+  GDS 0 0 7 15 2   ; merged with the next
+  GDS 8 0 7 15 2
+  CALL leaf        ; inlined
+  GSWP
+  ADD R3 R3 1
+  BLT R3 4 draw
+  HLT
+leaf:
+  ADD R4 R4 R1
+  RET
+"""
+
+
+def frames(machine_code: list[int]) -> tuple[list[str], bool, str | None]:
+    result = render(machine_code, 200_000, 60, keyboard=KEYS)
+    return result.display.hashes, result.halted, result.error
+
+
+def test_optimized_demos_draw_the_same_frames(demo):
+    assert frames(assemble_program(demo, optimize=True).machine_code) == frames(assemble_program(demo).machine_code)
+
+
+def test_every_pass_keeps_the_program_equivalent(assemble_source):
+    plain = assemble_source(PASSES_SOURCE)
+    optimized = assemble_source(PASSES_SOURCE, optimize=True)
+    assert len(optimized.machine_code) < len(plain.machine_code)
+    assert set(optimized.optimization.changes) >= {
+        "Constants folded into LI",
+        "Dead MOV removed",
+        "Jumps threaded",
+        "Unreachable instructions removed",
+        "Overdrawn GDS removed",
+        "Adjacent GDS merged",
+        "Leaf calls inlined",
+    }
+    assert frames(optimized.machine_code) == frames(plain.machine_code)
+    assert "GDS draw calls removed: 3" in optimized.optimization.format_report()
+
+    results = []
+    for machine_code in (plain.machine_code, optimized.machine_code):
+        emu = Emulator(machine_code)
+        emu.run(10_000)
+        results.append((emu.halted, emu.registers))
+    assert results[0] == results[1]
+
+
+def test_reports_round_trip_through_the_cache(tmp_path):
+    file = tmp_path / "passes.fpu"
+    file.write_text(PASSES_SOURCE)
+    program, entry = assemble_cached(file, optimize=True)
+    save_entry(file, json.loads(json.dumps(entry)))
+
+    cached, _ = assemble_cached(file, optimize=True)
+    assert program.optimization.changes
+    assert cached.optimization.to_dict() == program.optimization.to_dict()
+    assert cached.optimization.format_report() == program.optimization.format_report()
+
+    report = OptimizationReport(4)
+    report.skipped_reason = "absolute address"
+    report.max_call_depth = None
+    assert vars(OptimizationReport.from_dict(json.loads(json.dumps(report.to_dict())))) == vars(report)
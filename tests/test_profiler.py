@@ -0,0 +1,80 @@
+from facpu.hardware_definition import INSTRUCTION_TICKS
+from facpu.profiler import format_callgraph, format_flat, profile_program
+
+TICKS = INSTRUCTION_TICKS["NOP"]
+
+# main runs the loop 3 times, each calling outer which calls leaf twice
+CALLS_SOURCE = """
+main:
+  LI R1 0
+loop:
+  CALL outer
+  ADD R1 R1 1
+  BLT R1 3 loop
+  HLT
+outer:
+  CALL leaf
+  CALL leaf
+  RET
+leaf:
+  NOP
+  RET
+"""
+
+
+def profile(assemble_source, source: str):
+    program = assemble_source(source)
+    return program, profile_program(program.machine_code, INSTRUCTION_TICKS, 1000)
+
+
+def test_label_counts(assemble_source):
+    program, result = profile(assemble_source, CALLS_SOURCE)
+    assert result.halted and result.error is None
+    assert (result.instructions, result.ticks) == (32, 32 * TICKS)
+
+    labels = program.labels
+    assert result.counts[labels["main"] : labels["loop"]] == [1]
+    assert result.counts[labels["loop"] : labels["outer"]] == [3, 3, 3, 1]
+    assert result.counts[labels["outer"] : labels["leaf"]] == [3, 3, 3]
+    assert result.counts[labels["leaf"] : labels["leaf"] + 2] == [6, 6]
+    assert result.taken[labels["loop"] + 2] == 2
+
+    # Labels ordered by their ticks, with the instructions run under each
+    rows = [line.split() for line in format_flat(program, result, 4).splitlines()[1:5]]
+    assert [(row[-1], int(row[0]), int(row[2])) for row in rows] == [("leaf", 12 * TICKS, 12), ("loop", 10 * TICKS, 10), ("outer", 9 * TICKS, 9), ("main", TICKS, 1)]
+
+
+def test_call_graph(assemble_source):
+    program, result = profile(assemble_source, CALLS_SOURCE)
+    main, outer, leaf = (result.functions[program.labels[name]] for name in ("main", "outer", "leaf"))
+
+    assert [(function.calls, function.self_instructions) for function in (main, outer, leaf)] == [(1, 11), (3, 9), (6, 12)]
+    # Each CALL is counted in its caller, and outer includes both calls to leaf
+    assert (main.inclusive_ticks, outer.inclusive_ticks, leaf.inclusive_ticks) == (32 * TICKS, 3 * 7 * TICKS, 12 * TICKS)
+    assert (main.callees, outer.callers, outer.callees, leaf.callers) == ({outer.entry: 3}, {main.entry: 3}, {leaf.entry: 6}, {outer.entry: 6})
+
+    report = format_callgraph(program, result, 10)
+    assert "called 6 times from outer" in report and "calls outer 3 times" in report
+
+
+def test_recursion_is_counted_once(assemble_source):
+    source = "  LI R2 3\n  CALL rec\n  HLT\nrec:\n  SUB R2 R2 1\n  BEQ R2 0 done\n  CALL rec\ndone:\n  RET\n"
+    program, result = profile(assemble_source, source)
+    rec = result.functions[program.labels["rec"]]
+
+    assert (rec.calls, rec.callers, rec.callees) == (3, {0: 1, rec.entry: 2}, {rec.entry: 2})
+    # Everything but the LI, CALL and HLT outside it, rather than the sum over every level
+    assert rec.inclusive_ticks == (result.instructions - 3) * TICKS
+    assert rec.self_ticks == rec.inclusive_ticks
+
+
+def test_return_with_an_empty_stack(assemble_source):
+    # leaf is called once, then jumped to, so its second RET has nothing to return to
+    program, result = profile(assemble_source, "main:\n  CALL leaf\n  JMP leaf\nleaf:\n  NOP\n  RET\n")
+    main, leaf = result.functions[0], result.functions[program.labels["leaf"]]
+
+    assert "Return with empty call stack" in result.error and not result.halted
+    # The faulting RET never ran, and the jumped-to NOP is still main's
+    assert (result.instructions, main.self_instructions, leaf.self_instructions) == (5, 3, 2)
+    assert (main.inclusive_ticks, leaf.inclusive_ticks) == (5 * TICKS, 2 * TICKS)
+    assert "called 1 times from main" in format_callgraph(program, result, 10)
@@ -0,0 +1,74 @@
+import random
+
+import pytest
+
+from facpu.emulator import ALU_OPERATIONS, WORD_MASK, Emulator
+
+PROGRAMS = 200
+OPERATIONS = ["ADD", "SUB", "XOR", "AND", "OR", "MUL"]
+
+
+def generate(rng: random.Random) -> tuple[str, dict[str, int]]:
+    # A loop over random ALU operations on up to 30 virtual registers, with calls to a subroutine that has its own.
+    # Returns the source and the value of every output word, worked out by a reference interpreter.
+    names = [f"%v{i}" for i in range(rng.randrange(2, 31))]
+    values = {name: rng.randrange(1024) for name in names}
+    body = []
+    for _ in range(rng.randrange(5, 40)):
+        if rng.random() < 0.15:
+            body.append(("CALL", None, None, None))
+        else:
+            b = rng.randrange(1024) if rng.random() < 0.3 else rng.choice(names)
+            body.append((rng.choice(OPERATIONS), rng.choice(names), rng.choice(names), b))
+    iterations = rng.randrange(1, 5)
+
+    lines = ["LI R2 0"] + [f"LI {name} {value}" for name, value in values.items()] + ["LI R1 0", "loop:"]
+    lines += ["CALL bump" if op == "CALL" else f"{op} {dest} {a} {b}" for op, dest, a, b in body]
+    lines += ["ADD R1 R1 1", f"BLT R1 {iterations} loop"]
+    lines += [f"ST out_{name[1:]} {name}" for name in names] + ["ST out_r2 R2", "HLT"]
+    lines += ["bump:", "LI %step 3", "ADD R2 R2 %step", "RET"]
+    lines += [f"out_{name[1:]}: DAT 0" for name in names] + ["out_r2: DAT 0"]
+
+    r2 = 0
+    for _ in range(iterations):
+        for op, dest, a, b in body:
+            if op == "CALL":
+                r2 += 3
+            else:
+                values[dest] = ALU_OPERATIONS[op](values[a], b if isinstance(b, int) else values[b])
+
+    expected = {f"out_{name[1:]}": value & WORD_MASK for name, value in values.items()}
+    expected["out_r2"] = r2
+    return "\n".join(lines) + "\n", expected
+
+
+@pytest.mark.parametrize("optimize", [False, True])
+def test_allocation_matches_reference_interpreter(assemble_source, optimize):
+    rng = random.Random(14)
+    spilled = 0
+    for _ in range(PROGRAMS):
+        source, expected = generate(rng)
+        program = assemble_source(source, optimize=optimize)
+        spilled += any(label.startswith("__spill_") for label in program.labels)
+
+        emu = Emulator(program.machine_code)
+        emu.run(100_000)
+        assert emu.halted, source
+        assert {label: emu.memory[program.labels[label]] for label in expected} == expected, source
+
+    # Enough programs have more live values than registers to exercise spilling
+    assert spilled > PROGRAMS // 4
+
+
+def test_named_registers_are_not_allocated(assemble_source):
+    program = assemble_source("LI R3 1\nLI %a 2\nADD R3 R3 %a\nHLT\n")
+    assert program.processed_lines[1][1].split()[1] != "R3"
+    emu = Emulator(program.machine_code)
+    emu.run(10)
+    assert emu.registers[3] == 3
+
+
+def test_all_registers_named_is_an_error(assemble_source):
+    source = "".join(f"LI R{i} 0\n" for i in range(16)) + "LI %a 1\nADD R0 R0 %a\n"
+    with pytest.raises(Exception, match="No registers are left"):
+        assemble_source(source)
@@ -0,0 +1,119 @@
+import struct
+import zlib
+
+import pytest
+
+from facpu.assembler import assemble
+from facpu.block_engine import BlockEmulator
+from facpu.emulator import Emulator
+from facpu.hardware_definition import DISPLAY_SIZE
+from facpu.render import PALETTE, ArrayDisplay, RecordingDisplay, encode_png, frame_hash, render
+
+CYCLES = 200_000
+KEYS = [129, 129, 128, 130, 131, 128]
+
+
+def frame_ends(machine_code: list[int], frames: int) -> list[int]:
+    # Instructions run by the end of each GSWP, stepping one at a time
+    emu = Emulator(machine_code, keyboard=KEYS)
+    ends: list[int] = []
+    while len(ends) < frames and emu.cycles < CYCLES and emu.step():
+        if emu.display.frames > len(ends):
+            ends.append(emu.cycles)
+    return ends
+
+
+def test_displays_record_the_same_frames(demo):
+    pytest.importorskip("numpy")
+    machine_code = assemble(demo)
+
+    recorded = []
+    for display in [RecordingDisplay(), ArrayDisplay()]:
+        BlockEmulator(machine_code, keyboard=KEYS, display=display).run(CYCLES)
+        recorded.append((display.hashes, display.recorded_frames()))
+
+    assert recorded[0] == recorded[1]
+    assert recorded[0][0] == [frame_hash(frame) for frame in recorded[0][1]]
+
+
+@pytest.mark.parametrize("frames", [1, 3, 10])
+def test_frame_limit_is_exact(demo, frames):
+    machine_code = assemble(demo)
+    ends = frame_ends(machine_code, frames)
+    result = render(machine_code, CYCLES, frames, keyboard=KEYS)
+
+    assert len(result.display.hashes) == len(result.display.recorded_frames()) == len(ends)
+    if len(ends) == frames:
+        # Stopped at the GSWP showing the last frame, without running on
+        assert result.instructions == ends[-1]
+        assert not result.halted
+        assert result.display.hashes == render(machine_code, CYCLES, frames + 5, keyboard=KEYS).display.hashes[:frames]
+
+
+def test_no_frames(demo):
+    result = render(assemble(demo), CYCLES, 0, keyboard=KEYS)
+    assert result.display.hashes == [] and result.instructions == 0
+
+
+def test_stepping_pauses_at_the_limit(demo):
+    machine_code = assemble(demo)
+    ends = frame_ends(machine_code, 3)
+
+    emu = Emulator(machine_code, keyboard=KEYS, display=RecordingDisplay(limit=3))
+    emu.run(CYCLES)
+    assert emu.display.frames == len(ends)
+    if len(ends) == 3:
+        assert emu.paused and not emu.halted
+        assert emu.cycles == ends[-1]
+
+
+def test_png_decodes():
+    frame = bytes(range(DISPLAY_SIZE * DISPLAY_SIZE))
+    scale = 2
+    png = encode_png(frame, scale)
+    assert png.startswith(b"\x89PNG\r\n\x1a\n")
+
+    chunks = {}
+    offset = 8
+    while offset < len(png):
+        (length,) = struct.unpack(">I", png[offset : offset + 4])
+        kind, data = png[offset + 4 : offset + 8], png[offset + 8 : offset + 8 + length]
+        assert struct.unpack(">I", png[offset + 8 + length : offset + 12 + length])[0] == zlib.crc32(kind + data)
+        chunks[kind] = data
+        offset += 12 + length
+
+    size = DISPLAY_SIZE * scale
+    assert struct.unpack(">IIBBBBB", chunks[b"IHDR"]) == (size, size, 8, 2, 0, 0, 0)
+
+    raw = zlib.decompress(chunks[b"IDAT"])
+    stride = 1 + 3 * size
+    for y in range(size):
+        row = raw[y * stride : (y + 1) * stride]
+        assert row[0] == 0
+        for x in range(size):
+            assert tuple(row[1 + 3 * x : 4 + 3 * x]) == PALETTE[frame[(y // scale) * DISPLAY_SIZE + x // scale]]
+
+
+def test_png_opens_with_pillow(tmp_path):
+    image_module = pytest.importorskip("PIL.Image")
+    frame = bytes(range(DISPLAY_SIZE * DISPLAY_SIZE))
+    path = tmp_path / "frame.png"
+    path.write_bytes(encode_png(frame, 1))
+
+    with image_module.open(path) as image:
+        assert image.size == (DISPLAY_SIZE, DISPLAY_SIZE)
+        assert image.convert("RGB").getpixel((5, 3)) == PALETTE[frame[3 * DISPLAY_SIZE + 5]]
+
+
+def test_paused_runs_continue(demo):
+    machine_code = assemble(demo)
+    whole = BlockEmulator(machine_code, keyboard=KEYS, display=RecordingDisplay())
+    whole.run(CYCLES)
+
+    display = RecordingDisplay(limit=2)
+    paused = BlockEmulator(machine_code, keyboard=KEYS, display=display)
+    paused.run(CYCLES)
+    display.limit = None
+    paused.run(CYCLES - paused.cycles)
+
+    assert (paused.cycles, paused.pc, paused.registers, paused.display.hashes) == (whole.cycles, whole.pc, whole.registers, whole.display.hashes)
@@ -0,0 +1,53 @@
+import os
+import stat
+from pathlib import Path
+from threading import Thread
+
+import pytest
+
+from facpu import client
+from facpu.client import request, socket_path
+from facpu.server import bind
+
+
+@pytest.fixture
+def server(tmp_path):
+    path = tmp_path / "facpu.sock"
+    server = bind(path)
+    thread = Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield path
+    server.shutdown()
+    server.server_close()
+
+
+def test_socket_is_private(server):
+    assert stat.S_IMODE(os.stat(server).st_mode) == 0o600
+    assert request({"command": "ping"}, server)["ok"]
+
+
+def test_sockets_of_other_users_are_refused(server, monkeypatch, capsys):
+    monkeypatch.setenv(client.SOCKET_VARIABLE, str(server))
+    monkeypatch.setattr(os, "getuid", lambda: os.stat(server).st_uid + 1)
+
+    with pytest.raises(PermissionError):
+        request({"command": "ping"}, server)
+    assert client.forward(["disasm", "missing.bin"]) is None
+    assert "Not using the server" in capsys.readouterr().err
+
+
+def test_socket_path(monkeypatch, tmp_path):
+    monkeypatch.delenv(client.SOCKET_VARIABLE, raising=False)
+    monkeypatch.setenv("XDG_RUNTIME_DIR", str(tmp_path))
+    assert socket_path() == tmp_path / "facpu.sock"
+
+    monkeypatch.setenv(client.SOCKET_VARIABLE, str(tmp_path / "other.sock"))
+    assert socket_path() == tmp_path / "other.sock"
+
+
+def test_process_pools_in_the_server(server, tmp_path, recwarn):
+    demo = sorted((Path(__file__).resolve().parent.parent / "demos").glob("*.fpu"))[0]
+    # Forking a threaded process warns, and can deadlock
+    reply = request({"command": "run", "argv": ["replay", str(demo), "--random", "4", "--cycles", "20000", "-j", "2"], "cwd": str(tmp_path)}, server)
+    assert reply["exit"] == 0, reply["output"]
+    assert not [warning for warning in recwarn if "fork" in str(warning.message)]
@@ -0,0 +1,33 @@
+from facpu.hardware_definition import DEFAULT_INSTRUCTION_TICKS, INSTRUCTION_TICKS
+from facpu.program import to_instructions
+from facpu.timing import calibrate, calibration_note, loop_costs, static_cost
+
+
+def test_calibrate_from_measurements():
+    ticks = calibrate({"LD": 5, "GDS": {"count": 100, "ticks": 612}})
+    assert ticks["LD"] == 5
+    assert ticks["GDS/III"] == ticks["GDS/RRR"] == 6
+    assert ticks["ADD/R"] == DEFAULT_INSTRUCTION_TICKS
+
+
+def test_uncalibrated_figures_are_labelled():
+    assert "uncalibrated" in calibration_note(INSTRUCTION_TICKS)
+    assert calibration_note(calibrate({"LD": 5})) == ""
+
+
+def test_costs_use_the_table(assemble_source):
+    program = assemble_source(
+        """
+        LI R1 0
+        loop: LD R2 value
+        ADD R1 R1 1
+        BLT R1 10 loop
+        HLT
+        value: DAT 7
+        """
+    )
+    instructions, _ = to_instructions(program.processed_lines, program.labels)
+    ticks = calibrate({"LD": 10})
+    # Data is never executed
+    assert static_cost(instructions, ticks) == 10 + 4 * DEFAULT_INSTRUCTION_TICKS
+    assert loop_costs(instructions, ticks) == [("loop", 1, 3, 3, 10 + 2 * DEFAULT_INSTRUCTION_TICKS)]
@@ -0,0 +1,74 @@
+import random
+
+import pytest
+
+from facpu.assembler import assemble_program
+from facpu.emulator import Emulator
+from facpu.trace import format_trace, parse_trace, random_trace, replay, replay_many
+
+KEYS = [128, 129, 130, 131]
+CYCLES = 20_000
+
+
+def traces(count: int) -> list[list[tuple[int, int]]]:
+    rng = random.Random(0)
+    return [random_trace(rng, KEYS, 200, CYCLES) for _ in range(count)]
+
+
+def test_parallel_matches_sequential(demo):
+    machine_code = assemble_program(demo).machine_code
+    sequential = replay_many(machine_code, traces(6), CYCLES, jobs=1)
+    parallel = replay_many(machine_code, traces(6), CYCLES, jobs=2)
+    assert [vars(result) for result in parallel] == [vars(result) for result in sequential]
+
+
+def test_replay_matches_stepping(demo):
+    machine_code = assemble_program(demo).machine_code
+    events = traces(1)[0]
+    result = replay(machine_code, events, CYCLES)
+
+    # The same presses, made one instruction at a time
+    emu = Emulator(machine_code)
+    pending = list(events)
+    frame_starts = [0]
+    while emu.cycles < CYCLES and not emu.halted:
+        while pending and pending[0][0] <= emu.cycles:
+            emu.press(pending.pop(0)[1])
+        emu.step()
+        if emu.display.frames == len(frame_starts):
+            frame_starts.append(emu.cycles)
+
+    assert (result.instructions, result.halted) == (emu.cycles, emu.halted)
+    assert [instructions for instructions, _ in result.frames] == [end - start for start, end in zip(frame_starts, frame_starts[1:])]
+
+
+@pytest.mark.parametrize("frames", [1, 3])
+def test_frame_limit(demo, frames):
+    machine_code = assemble_program(demo).machine_code
+    events = traces(1)[0]
+    result = replay(machine_code, events, CYCLES, max_frames=frames)
+    whole = replay(machine_code, events, CYCLES)
+
+    assert result.frames == whole.frames[:frames]
+    if len(whole.frames) > frames:
+        # The totals stop at the GSWP showing the last frame
+        assert result.instructions == sum(instructions for instructions, _ in result.frames)
+        assert result.ticks == sum(ticks for _, ticks in result.frames)
+        assert not result.halted
+
+
+def test_traces_round_trip():
+    for events in traces(5):
+        assert parse_trace(format_trace(events)) == events
+    assert parse_trace("; comment\n\n10 128 ; up\n0x20 129\n") == [(10, 128), (32, 129)]
+
+
+def test_random_traces_are_repeatable():
+    assert traces(3) == traces(3)
+    assert all(cycle < CYCLES and key in KEYS for events in traces(3) for cycle, key in events)
+
+
+@pytest.mark.parametrize("text, error", [("10\n", "is not `<cycle> <key>`"), ("10 128\n5 129\n", "before the line above it"), ("-1 128\n", "before the line above it")])
+def test_invalid_traces(text, error):
+    with pytest.raises(Exception, match=error):
+        parse_trace(text)